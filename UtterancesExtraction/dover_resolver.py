@@ -1,22 +1,26 @@
-from rapidfuzz import fuzz
 import logging
 import json
 import re
 
 
 from UtterancesExtraction.bad_dover_exception import BadDoverException
+from UtterancesExtraction.mk_name_index import MKNameIndex, load_role_aliases
 from logger_config import get_logger
 
 logger = get_logger(__name__)
+MEETING_CACHE_SIZE = 256
 
 
 class DoverResolver:
-    def __init__(self, min_ratio_for_rapidfuzz=75):
+    def __init__(self, min_ratio_for_rapidfuzz=75, mks: dict = None, role_aliases: dict = None):
         self.min_ratio = min_ratio_for_rapidfuzz
-        self.mks = self.load_mks_data()
+        self.mks = mks if mks is not None else self.load_mks_data()
+        self.role_aliases = role_aliases if role_aliases is not None else load_role_aliases()
         self.mks_by_name = self.transfer_mks_to_name_format()
+        self.name_index = MKNameIndex(self.mks, self.role_aliases)
         self.rapidfuzz_cache = {}
         self.no_match_person = []
+        self.meeting_cache = {}
 
     def transfer_mks_to_name_format(self) -> dict:
         mks_by_name = {}
@@ -44,42 +48,67 @@ class DoverResolver:
     def fallback_to_rapidfuzz_(self, name: str):
         rapidfuzz_cache_entry = self.rapidfuzz_cache.get(name)
         if rapidfuzz_cache_entry is not None:
+            # a cached miss is still a miss, otherwise the answer depends on which name was seen first
+            if self.min_ratio > rapidfuzz_cache_entry["max_ratio"]:
+                raise BadDoverException(f"Can't find mk to match {name}")
             return (rapidfuzz_cache_entry["max_mk_key"],
                     rapidfuzz_cache_entry["max_sim_mk"],
                     rapidfuzz_cache_entry["max_ratio"])
 
-        max_ratio = 0
-        max_sim_mk = {}
-        max_mk_key = ""
-        for mk_key, mk_meta in self.mks_by_name.items():
-            ratio = fuzz.token_sort_ratio(name, mk_key)
-            if (ratio > max_ratio):
-                max_ratio = ratio
-                max_sim_mk = mk_meta
-                max_mk_key = mk_key
+        _, max_ratio, mk_id = self.name_index.fuzzy(name)
+        max_sim_mk = self.mks[mk_id] if mk_id is not None else {}
+        max_mk_key = self.name_index.display_name(mk_id) if mk_id is not None else ""
         self.rapidfuzz_cache[name] = {"max_ratio": max_ratio,
                                       "max_sim_mk": max_sim_mk, "max_mk_key": max_mk_key}
         if self.min_ratio > max_ratio:
             raise BadDoverException(f"Can't find mk to match {name}")
         return max_mk_key, max_sim_mk, max_ratio
 
-    def resolve_mk(self, speaker: str, mks_in_meeting: list):
+    def meeting_mk_ids(self, mks_in_meeting) -> set:
+        key = frozenset(mks_in_meeting)
+        mk_ids = self.meeting_cache.get(key)
+        if mk_ids is None:
+            if len(self.meeting_cache) >= MEETING_CACHE_SIZE:
+                self.meeting_cache.clear()
+            mk_ids = {self.name_index.lookup(name) for name in key} - {None}
+            self.meeting_cache[key] = mk_ids
+        return mk_ids
+
+    def resolve_chair(self, chairs) -> str:
+        chair_ids = {self.name_index.lookup(self.extract_name_key_from_dover(c))
+                     for c in chairs} - {None}
+        # with a chair and a stand-in chair we can't tell who spoke
+        return chair_ids.pop() if len(chair_ids) == 1 else None
+
+    def resolve_mk(self, speaker: str, mks_in_meeting: list, chairs=None):
         speaker_key = self.extract_name_key_from_dover(
             speaker)
+        mk_id = self.name_index.lookup(speaker_key)
+        if mk_id is not None:
+            if speaker_key in mks_in_meeting or mk_id in self.meeting_mk_ids(mks_in_meeting):
+                return self.name_index.display_name(mk_id), self.mks[mk_id]
+            return None, None
+
+        # role titles instead of a name: the meeting chair, or a knesset-wide role like a minister
+        if chairs and self.name_index.is_chair_role(speaker_key):
+            mk_id = self.resolve_chair(chairs)
+        if mk_id is None:
+            mk_id = self.name_index.resolve_role(speaker_key)
+        if mk_id is not None:
+            return self.name_index.display_name(mk_id), self.mks[mk_id]
+
         if speaker_key in mks_in_meeting:
-            mk_meta = self.mks_by_name.get(speaker_key)
-            if mk_meta is None:
-                try:
-                    rapidfuzz_match, mk_meta, ratio = self.fallback_to_rapidfuzz_(
-                        speaker_key)
-                    logger.info(
-                        f"Rapidfuzz search for {speaker_key}, found: {rapidfuzz_match} with certainty: {ratio}")
-                    return rapidfuzz_match, mk_meta
-                except BadDoverException:
-                    self.no_match_person.append(speaker_key)
-                    logger.error(
-                        f"Can't find match for {speaker_key} with rapidfuzz match set as a min of {self.min_ratio}")
-        return {"speaker_key": None, "mk_meta": None}
+            try:
+                rapidfuzz_match, mk_meta, ratio = self.fallback_to_rapidfuzz_(
+                    speaker_key)
+                logger.info(
+                    f"Rapidfuzz search for {speaker_key}, found: {rapidfuzz_match} with certainty: {ratio}")
+                return rapidfuzz_match, mk_meta
+            except BadDoverException:
+                self.no_match_person.append(speaker_key)
+                logger.error(
+                    f"Can't find match for {speaker_key} with rapidfuzz match set as a min of {self.min_ratio}")
+        return None, None
 
     def load_mks_data(self):
         try:
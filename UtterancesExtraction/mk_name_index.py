@@ -0,0 +1,127 @@
+import json
+import re
+from functools import lru_cache
+
+from rapidfuzz import fuzz, process
+
+from logger_config import get_logger
+
+ROLES_FILE = "mk_roles.json"
+ROLE_CACHE_SIZE = 1024
+MIN_ROLE_RATIO = 90
+# titles that are never part of a name
+HONORIFICS = {'חה"כ', 'ח"כ', 'ד"ר', "פרופ'", 'עו"ד', 'הרב', 'רב', 'גב\'', 'מר'}
+CHAIR_ROLES = {'יור', 'יו"ר', 'היו"ר', 'מ"מ היו"ר', 'ממלא מקום היו"ר', 'יושב ראש הוועדה', 'יושבת ראש הוועדה'}
+
+NIQQUD_RE = re.compile(r"[\u0591-\u05BD\u05BF-\u05C7]")
+DASH_RE = re.compile(r"[\u05BE\-\u2013\u2014]")
+SPACES_RE = re.compile(r"\s+")
+QUOTES = str.maketrans({"\u05F3": "'", "\u2019": "'", "`": "'", "\u05F4": '"', "\u201C": '"', "\u201D": '"'})
+
+logger = get_logger(__name__)
+
+
+def normalize_name(name: str) -> str:
+    name = NIQQUD_RE.sub("", name).translate(QUOTES)
+    name = DASH_RE.sub(" ", name).replace("<", " ").replace(">", " ")
+    tokens = [t for t in SPACES_RE.split(name.strip()) if t and t not in HONORIFICS]
+    return " ".join(tokens)
+
+
+def name_variants(first_name: str, last_name: str) -> set:
+    firsts = normalize_name(first_name).split()
+    last = normalize_name(last_name)
+    variants = {" ".join(firsts + [last]), " ".join([last] + firsts)}
+    # middle names are mostly dropped in protocols, either of them may be the one that is kept
+    for first in firsts:
+        variants.add(f"{first} {last}")
+        variants.add(f"{last} {first}")
+    # compound last names ("דיסטל אטבריאן") are sometimes written with only one part
+    for part in last.split():
+        if part != last:
+            variants.add(f"{firsts[0]} {part}" if firsts else part)
+    return {v for v in variants if v}
+
+
+def load_role_aliases(path: str = ROLES_FILE) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"Error parsing {path}, ignoring role aliases")
+        return {}
+
+
+class MKNameIndex:
+    """
+    Precomputed lookup of every way an MK name is written in the protocols.
+    Exact lookups are a dict hit on the normalized variant, fuzzy lookups run rapidfuzz
+    over one prebuilt choice array instead of a python loop over the roster.
+    """
+
+    def __init__(self, mks: dict, role_aliases: dict = None):
+        self.mks = mks
+        self.display_names = {}
+        variant_owners = {}
+        for mk_id, mk in mks.items():
+            self.display_names[mk_id] = mk["FirstName"] + " " + mk["LastName"]
+            for variant in name_variants(mk["FirstName"], mk["LastName"]):
+                variant_owners.setdefault(variant, set()).add(mk_id)
+
+        # a variant shared by two MKs identifies neither of them
+        self.exact = {v: next(iter(owners)) for v, owners in variant_owners.items() if len(owners) == 1}
+        self.choices = list(self.exact)
+        self.choice_owners = [self.exact[c] for c in self.choices]
+
+        self.roles = {normalize_name(role): str(mk_id) for role, mk_id in (role_aliases or {}).items()
+                      if str(mk_id) in mks}
+        self.role_choices = list(self.roles)
+        self.resolve_role = lru_cache(maxsize=ROLE_CACHE_SIZE)(self._resolve_role)
+
+    def lookup(self, name: str):
+        """O(1) exact match on the name, or on its tail when it is prefixed by a role ("שר החינוך X Y")."""
+        tokens = normalize_name(name).split()
+        for i in range(len(tokens)):
+            mk_id = self.exact.get(" ".join(tokens[i:]))
+            if mk_id is not None:
+                return mk_id
+        return None
+
+    def fuzzy(self, name: str) -> tuple:
+        """Returns (best variant, score, mk id) of the closest variant."""
+        best = process.extractOne(normalize_name(name), self.choices,
+                                  scorer=fuzz.token_sort_ratio, processor=None)
+        if best is None:
+            return "", 0, None
+        choice, score, idx = best
+        return choice, score, self.choice_owners[idx]
+
+    def fuzzy_many(self, names: list, min_ratio: int) -> list:
+        """Batched fuzzy lookup, returns an mk id (or None) per name."""
+        if not names or not self.choices:
+            return [None] * len(names)
+        scores = process.cdist([normalize_name(n) for n in names], self.choices,
+                               scorer=fuzz.token_sort_ratio, processor=None, workers=-1)
+        best = scores.argmax(axis=1)
+        return [self.choice_owners[j] if scores[i, j] >= min_ratio else None
+                for i, j in enumerate(best)]
+
+    def is_chair_role(self, name: str) -> bool:
+        return normalize_name(name) in CHAIR_ROLES
+
+    def _resolve_role(self, name: str):
+        role = normalize_name(name)
+        if not role:
+            return None
+        mk_id = self.roles.get(role)
+        if mk_id is None and self.role_choices:
+            best = process.extractOne(role, self.role_choices, scorer=fuzz.ratio,
+                                      processor=None, score_cutoff=MIN_ROLE_RATIO)
+            if best is not None:
+                mk_id = self.roles[best[0]]
+        return mk_id
+
+    def display_name(self, mk_id) -> str:
+        return self.display_names[mk_id]
@@ -0,0 +1,65 @@
+import re
+from collections import namedtuple
+
+# kind is one of "topic", "members", "chair", "turn".
+# value: topic -> str, members -> (section title, [lines]), chair -> (name, role), turn -> (speaker, utterance)
+Segment = namedtuple("Segment", ["kind", "value", "start", "end"])
+
+SECTION_TITLES = ("חברי הוועדה", "חברי הכנסת", "מוזמנים")
+MEMBER_SECTIONS = ("חברי הוועדה", "חברי הכנסת")
+
+_SECTION_HEADER = "|".join(SECTION_TITLES)
+
+# every construct the extractor cares about, as one alternation, so the text is scanned exactly once.
+TOKEN_RE = re.compile(
+    r"<< נושא >>[ \t]*(?P<topic>[^<]+?)\s*<< נושא >>"
+    r"|<< (?:דובר|יור) >>[ \t]*(?P<speaker>[^:<\n]+):[ \t]*<< (?:דובר|יור) >>"
+    rf"|^[ \t]*(?P<section>{_SECTION_HEADER}):[ \t]*\n"
+    rf"(?P<members>(?:(?![ \t]*(?:{_SECTION_HEADER}):|[^\n]*<<)[ \t]*\S[^\n]*(?:\n|\Z))*)"
+    r"|^(?P<chair>[^\n<:]+?)[ \t]+[–-][ \t]+(?P<role>מ\"מ היו\"ר|היו\"ר|יו\"ר)[ \t]*$"
+    r"|(?P<marker><<[^>\n]*>>)",
+    re.M,
+)
+CHAIR_LINE_RE = re.compile(
+    r"^(?P<name>.+?)\s+[–-]\s+(?P<role>מ\"מ היו\"ר|היו\"ר|יו\"ר)\s*$")
+
+
+def tokenize_protocol(text: str):
+    """
+    Scans a protocol once and yields Segments in text order.
+    A speaker turn runs until the next << >> marker; member lists and chair markers are only
+    taken from the text before the first turn, inside the debate they are just speech.
+    """
+    turn = None
+    in_debate = False
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "members":
+            kind = "section"
+
+        if turn is not None and kind in ("topic", "speaker", "marker"):
+            speaker, body_start = turn
+            yield Segment("turn", (speaker, text[body_start:match.start()].strip()), body_start, match.start())
+            turn = None
+
+        if kind == "topic":
+            yield Segment("topic", match.group("topic").strip(), match.start(), match.end())
+        elif kind == "speaker":
+            in_debate = True
+            turn = (match.group("speaker").strip(), match.end())
+        elif in_debate or turn is not None:
+            continue
+        elif kind == "section":
+            lines = [line.strip() for line in match.group("members").splitlines() if line.strip()]
+            yield Segment("members", (match.group("section"), lines), match.start(), match.end())
+            for line in lines:
+                chair_match = CHAIR_LINE_RE.match(line)
+                if chair_match:
+                    yield Segment("chair", (chair_match.group("name"), chair_match.group("role")),
+                                  match.start(), match.end())
+        elif kind == "role":
+            yield Segment("chair", (match.group("chair").strip(), match.group("role")), match.start(), match.end())
+
+    if turn is not None:
+        speaker, body_start = turn
+        yield Segment("turn", (speaker, text[body_start:].strip()), body_start, len(text))
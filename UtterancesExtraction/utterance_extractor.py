@@ -1,116 +1,160 @@
-import re
 import os
 import json
+from concurrent.futures import ProcessPoolExecutor
 
 from UtterancesExtraction.dover_resolver import DoverResolver
+from UtterancesExtraction.protocol_tokenizer import MEMBER_SECTIONS, tokenize_protocol
 from logger_config import get_logger
+from metrics import metrics
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore, utterance_rows
+
+NOT_FOUND_KEYS_FILE = "not_found_keys.txt"
 
 logger = get_logger(__name__)
 
 
-def extract_pretext_info(dover_resolver: DoverResolver, text: str) -> tuple:
+def pretext_info_from_segments(dover_resolver: DoverResolver, segments: list) -> tuple:
     mks_from_list = set()
     chairs = set()
     topic = ""
-    topic_match = re.search(
-        r"<< נושא >>\s*(?P<topic>[^<]+?)\s*<< נושא >>", text)
-    if topic_match:
-        topic = topic_match.group("topic").strip()
-
-    chair_matches = re.findall(
-        r"(?P<name>.+?)\s+[–-]\s+(?P<role>יו\"ר|מ\"מ היו\"ר)", text)
-    for name, _ in chair_matches:
-        mks_from_list.add(
-            dover_resolver.extract_name_key_from_dover(name.strip()))
-        chairs.add(name.strip())
-
-    # Extract both sections and combine their lines
-    combined_lines = []
-    for section_title in ["חברי הוועדה", "חברי הכנסת"]:
-        section_match = re.search(
-            rf"{section_title}:\s*\n(?P<section>.*?)(?:\n\s*\n|מוזמנים:|חברי הוועדה:|חברי הכנסת:)", text, re.S)
-        if section_match:
-            lines = section_match.group("section").splitlines()
-            combined_lines.extend([line.strip()
-                                  for line in lines if line.strip()])
-
-    for line in combined_lines:
-        mks_from_list.add(dover_resolver.extract_name_key_from_dover(line))
+    for segment in segments:
+        if segment.kind == "topic" and not topic:
+            topic = segment.value
+        elif segment.kind == "chair":
+            name = segment.value[0].strip()
+            mks_from_list.add(dover_resolver.extract_name_key_from_dover(name))
+            chairs.add(name)
+        elif segment.kind == "members" and segment.value[0] in MEMBER_SECTIONS:
+            for line in segment.value[1]:
+                mks_from_list.add(
+                    dover_resolver.extract_name_key_from_dover(line))
 
     return mks_from_list, chairs, topic
 
 
-def extract_utterance_from_file(dover_resolver: DoverResolver, content: str):
+def extract_pretext_info(dover_resolver: DoverResolver, text: str) -> tuple:
+    return pretext_info_from_segments(dover_resolver, list(tokenize_protocol(text)))
 
-    mks_in_meeting, chairs, title = extract_pretext_info(dover_resolver,
-                                                         content)
-    speaker_utterances = {}
-    pattern = r'<< (?:דובר|יור) >>\s*(?P<speaker>[^:]+):\s*<< (?:דובר|יור) >>\s*(?P<utterance>[^<]+)'
 
-    matches = re.finditer(pattern, content)
+def extract_utterance_from_file(dover_resolver: DoverResolver, content: str):
+    segments = list(tokenize_protocol(content))
+    mks_in_meeting, chairs, title = pretext_info_from_segments(dover_resolver,
+                                                               segments)
+    speaker_utterances = {}
+    # the same speaker string resolves the same way for the whole protocol
+    resolved_speakers = {}
 
-    for match in matches:
-        speaker = match.group('speaker').strip()
-        utterance = match.group('utterance').strip()
+    for segment in segments:
+        if segment.kind != "turn":
+            continue
+        speaker, utterance = segment.value
 
         if speaker and utterance:
-            if speaker not in speaker_utterances:
-                speaker_key, mk_meta = dover_resolver.resolve_mk(
-                    speaker, mks_in_meeting)
-                if mk_meta is not None:
-                    # first time speaking
-                    if speaker_utterances.get(speaker_key) is None:
-                        speaker_utterances[speaker_key] = {}
-                        speaker_utterances[speaker_key]["utterances"] = []
-                    speaker_utterances[speaker_key]["metadata"] = mk_meta
-                    speaker_utterances[speaker_key]["utterances"].append(
-                        utterance)
+            if speaker not in resolved_speakers:
+                resolved_speakers[speaker] = dover_resolver.resolve_mk(
+                    speaker, mks_in_meeting, chairs)
+            speaker_key, mk_meta = resolved_speakers[speaker]
+            if mk_meta is not None:
+                # first time speaking
+                if speaker_utterances.get(speaker_key) is None:
+                    speaker_utterances[speaker_key] = {}
+                    speaker_utterances[speaker_key]["utterances"] = []
+                speaker_utterances[speaker_key]["metadata"] = mk_meta
+                speaker_utterances[speaker_key]["utterances"].append(
+                    utterance)
 
     return title, speaker_utterances
 
 
-def process_protocols(output_folder="committee_data", utterances_folder="utterances", force_refresh=True):
+def process_protocol_file(dover_resolver: DoverResolver, file_path: str, store: UtteranceStore) -> int:
+    """Extracts one protocol into the store, returns the number of utterances written."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        protocol_data = json.load(f)
+    title, utterances = extract_utterance_from_file(
+        dover_resolver, protocol_data["text"])
+
+    # one row per utterance, in this protocol's file of the utterance store
+    rows = utterance_rows(protocol_data, utterances, title)
+    store.write_protocol(protocol_data.get("knesset_num"), protocol_data.get("committee"), protocol_data["doc_id"], rows)
+    return len(rows)
+
+
+def _count_extracted(utterances: int):
+    # counted by the parent, a pool worker's own metrics registry is never exported
+    metrics.inc("protocols_extracted_total")
+    metrics.inc("utterances_extracted_total", utterances)
+
+
+# each pool worker process builds its own resolver once, from the roster sent at startup
+_worker_dover_resolver = None
+
+
+def _init_worker(mks: dict, min_ratio: int, role_aliases: dict):
+    global _worker_dover_resolver
+    _worker_dover_resolver = DoverResolver(min_ratio, mks=mks, role_aliases=role_aliases)
+
+
+def _process_protocol_file_in_worker(paths: tuple):
+    """Returns what the worker resolver learned from this file, so the parent can merge it, and the utterance count."""
+    file_path, store_dir = paths
+    resolver = _worker_dover_resolver
+    no_match_before = len(resolver.no_match_person)
+    cached_before = set(resolver.rapidfuzz_cache)
+    utterances = process_protocol_file(resolver, file_path, UtteranceStore(store_dir))
+    new_cache = {name: entry for name, entry in resolver.rapidfuzz_cache.items()
+                 if name not in cached_before}
+    return resolver.no_match_person[no_match_before:], new_cache, utterances
+
+
+def process_protocols(output_folder="committee_data", store_dir=UTTERANCE_STORE_DIR, force_refresh=True, file_names: list = None, workers: int = 1,
+                      mks: dict = None, role_aliases: dict = None, not_found_path: str = NOT_FOUND_KEYS_FILE):
     """
     Process all JSON files in the output folder to extract utterances by speaker.
-    Save utterances to separate files in a dedicated utterances folder.
+    Utterances are written to the partitioned utterance store, one file per protocol.
+    When file_names is given only those protocols are (re)processed.
+    With workers > 1 the protocols are split over a process pool, the output is the same as the serial run.
+    mks and role_aliases default to mks_data.json and the roles file of the current Knesset.
     """
-    dover_resolver = DoverResolver()
-    # Create utterances folder if it doesn't exist
-    os.makedirs(utterances_folder, exist_ok=True)
+    dover_resolver = DoverResolver(mks=mks, role_aliases=role_aliases)
+    store = UtteranceStore(store_dir)
+    extracted = store.doc_paths()
+
+    if file_names is None:
+        file_names = os.listdir(output_folder)
+    else:
+        force_refresh = True
 
     # Get total number of files
-    total_files = len([f for f in os.listdir(
-        output_folder)])
+    total_files = len(file_names)
     files_processed = 0
+    jobs = []
 
-    for file_name in os.listdir(output_folder):
+    for file_name in file_names:
         files_processed += 1
         files_left = total_files - files_processed
         logger.debug(
             f"Processing file {files_processed}/{total_files}: {file_name} ({files_left} files left)")
         if file_name.endswith(".json"):
             file_path = os.path.join(output_folder, file_name)
-
-            with open(file_path, "r", encoding="utf-8") as f:
-                # Create utterances file path
-                utterances_file_name = f"utterances_{file_name}"
-                utterances_file_path = os.path.join(
-                    utterances_folder, utterances_file_name)
-                if force_refresh or not os.path.exists(utterances_file_path):
-                    protocol_data = json.load(f)
-                    title, utterances = extract_utterance_from_file(
-                        dover_resolver, protocol_data["text"])
-
-                    del protocol_data["text"]
-                    protocol_data["utterances"] = utterances
-                    protocol_data["subject"] = title
-                    # Save utterances to separate file
-                    with open(utterances_file_path, "w", encoding="utf-8") as f:
-                        json.dump(protocol_data, f,
-                                  ensure_ascii=False, indent=2)
+            if force_refresh or file_name[:-len(".json")] not in extracted:
+                if workers > 1:
+                    jobs.append((file_path, store_dir))
+                else:
+                    _count_extracted(process_protocol_file(
+                        dover_resolver, file_path, store))
+
+    if jobs:
+        logger.info(
+            f"Extracting utterances from {len(jobs)} protocols with {workers} processes")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(dover_resolver.mks, dover_resolver.min_ratio, dover_resolver.role_aliases)) as executor:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            for no_match, rapidfuzz_cache, utterances in executor.map(_process_protocol_file_in_worker, jobs, chunksize=chunksize):
+                dover_resolver.no_match_person.extend(no_match)
+                dover_resolver.rapidfuzz_cache.update(rapidfuzz_cache)
+                _count_extracted(utterances)
 
     # After processing all files, save the list of keys not found
-    not_found_file_path = os.path.join(utterances_folder, "not_found_keys.txt")
-    with open(not_found_file_path, "w", encoding="utf-8") as f:
+    with open(not_found_path, "w", encoding="utf-8") as f:
         for key in sorted(dover_resolver.no_match_person):
             f.write(f"{key}\n")
@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from clustering import cluster_config, cluster_embeddings  # noqa: E402
+from embedding_store import EmbeddingStore, peak_rss_mb  # noqa: E402
+from utterance_store import UtteranceStore  # noqa: E402
+
+# streaming clustering of a synthetic corpus with known topics: fit time, peak RSS,
+# agreement with the true topics, and the cost of labelling new utterances with the saved model.
+
+TOPICS = 30
+COMMITTEES = 12
+DOC_ROWS = 500
+# norm of the noise around each topic direction
+NOISE = 1.2
+
+
+def build(root: str, rows: int, dim: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((TOPICS, dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    topics = rng.integers(0, TOPICS, rows)
+
+    utterances = UtteranceStore(os.path.join(root, "utterances"))
+    for start in range(0, rows, DOC_ROWS):
+        picked = range(start, min(rows, start + DOC_ROWS))
+        # every topic is discussed mostly in "its" committee, under a subject naming it
+        committee = f"committee{topics[start] % COMMITTEES}"
+        utterances.write_protocol(25, committee, f"doc{start // DOC_ROWS:05d}", [
+            {"utter_id": f"{i:09d}", "doc_id": f"doc{start // DOC_ROWS:05d}", "speaker_key": "mk",
+             "subject": f"subject topic{topics[i]}", "text": f"utterance {i}"} for i in picked])
+
+    def encode(texts):
+        picked = np.array([int(t) for t in texts])
+        noise = rng.standard_normal((len(picked), dim), dtype=np.float32) * (NOISE / np.sqrt(dim))
+        vectors = centers[topics[picked]] + noise
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    store = EmbeddingStore("synthetic", dim, os.path.join(root, "embeddings"))
+    return store, utterances, topics, encode
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--reducer", default="pca")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        store, utterances, topics, encode = build(root, args.rows, args.dim)
+        # 90% is there when the model is fitted, the rest arrives later
+        initial = int(args.rows * 0.9)
+        utter_ids = [f"{i:09d}" for i in range(args.rows)]
+        store.sync(utter_ids[:initial], [str(i) for i in range(initial)], encode)
+
+        config = cluster_config(reducer=args.reducer)
+        clusters_dir = os.path.join(root, "clusters")
+        started = time.perf_counter()
+        cluster_embeddings(store, utterances.root, clusters_dir, config)
+        fit_seconds = time.perf_counter() - started
+        fit_rss = peak_rss_mb()
+
+        store.sync(utter_ids, [str(i) for i in range(args.rows)], encode)
+        started = time.perf_counter()
+        labels = cluster_embeddings(store, utterances.root, clusters_dir, config)
+        assign_seconds = time.perf_counter() - started
+        store.close()
+
+    truth = topics[labels["utter_id"].astype(int).to_numpy()]
+    clustered = labels["cluster"].to_numpy() >= 0
+    print("=" * 60)
+    print(f"{args.rows} utterances x {args.dim}, {TOPICS} true topics, {args.reducer} reducer")
+    print(f"fit + label {initial} utterances   {fit_seconds:8.1f}s  peak RSS {fit_rss:.0f} MB")
+    print(f"assign {args.rows - initial} new utterances  {assign_seconds:8.1f}s")
+    print(f"topics found {labels['cluster'].max() + 1}, noise {1 - clustered.mean():.3f}, "
+          f"ARI on clustered {adjusted_rand_score(truth[clustered], labels['cluster'][clustered]):.3f}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_store import EmbeddingStore, peak_rss_mb  # noqa: E402
+
+# peak RSS of loading and scanning embeddings: the old np.load of one .npy against
+# the memory-mapped shards of the embedding store, in float32 and float16.
+# every measurement runs in a fresh process, ru_maxrss only ever grows.
+# peak RSS counts mapped file pages too, which the kernel can drop and every process shares,
+# so the private (anonymous) memory held at the scan's peak is reported next to it (linux only).
+
+DIM = 768
+MODEL = "synthetic"
+
+
+def random_vectors(rng, rows: int) -> np.ndarray:
+    vectors = rng.standard_normal((rows, DIM), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build(root: str, rows: int, dtype: str):
+    rng = np.random.default_rng(0)
+    store = EmbeddingStore(MODEL, DIM, os.path.join(root, dtype), dtype=dtype)
+    utter_ids = [f"u{i}" for i in range(rows)]
+    started = time.perf_counter()
+    store.sync(utter_ids, utter_ids, lambda texts: random_vectors(rng, len(texts)))
+    seconds = time.perf_counter() - started
+    store.close()
+    return seconds
+
+
+def write_npy(root: str, rows: int):
+    store = EmbeddingStore(MODEL, DIM, os.path.join(root, "float32"))
+    np.save(os.path.join(root, "embeddings.npy"), store.gather(np.arange(rows)))
+    store.close()
+
+
+def anon_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return float("nan")
+
+
+def scan_npy(root: str, query: np.ndarray) -> float:
+    embeddings = np.load(os.path.join(root, "embeddings.npy"))
+    embeddings @ query
+    return anon_rss_mb()
+
+
+def scan_store(root: str, dtype: str, query: np.ndarray) -> float:
+    store = EmbeddingStore(MODEL, DIM, os.path.join(root, dtype), dtype=dtype)
+    private = 0.0
+    for _, block in store.iter_blocks():
+        block @ query
+        private = max(private, anon_rss_mb())
+    store.close()
+    return private
+
+
+def measured(target, args, queue):
+    started = time.perf_counter()
+    result = target(*args)
+    queue.put((result, time.perf_counter() - started, peak_rss_mb()))
+
+
+def run_isolated(target, *args) -> tuple:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measured, args=(target, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def disk_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path)
+               for f in files if f.startswith("vectors_")) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    query = random_vectors(np.random.default_rng(1), 1)[0]
+    baseline = run_isolated(peak_rss_mb)[0]
+
+    with tempfile.TemporaryDirectory() as root:
+        rows = []
+        for dtype in ("float32", "float16"):
+            _, seconds, rss = run_isolated(build, root, args.rows, dtype)
+            rows.append((f"encode+append {dtype}", seconds, rss, float("nan"), disk_mb(os.path.join(root, dtype))))
+        run_isolated(write_npy, root, args.rows)
+        private, seconds, rss = run_isolated(scan_npy, root, query)
+        rows.append(("np.load scan", seconds, rss, private,
+                     os.path.getsize(os.path.join(root, "embeddings.npy")) / (1024 * 1024)))
+        for dtype in ("float32", "float16"):
+            private, seconds, rss = run_isolated(scan_store, root, dtype, query)
+            rows.append((f"mmap shard scan {dtype}", seconds, rss, private, disk_mb(os.path.join(root, dtype))))
+
+    print("=" * 80)
+    print(f"{args.rows} x {DIM} embeddings, empty interpreter peak RSS {baseline:.0f} MB")
+    print(f"{'':28}{'seconds':>10}{'peak RSS MB':>14}{'private MB':>14}{'disk MB':>12}")
+    for name, seconds, rss, private, disk in rows:
+        print(f"{name:28}{seconds:>10.2f}{rss:>14.0f}{private:>14.0f}{disk:>12.0f}")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
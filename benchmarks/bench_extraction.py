@@ -0,0 +1,64 @@
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks.synthetic_protocols import MKS_FILE, generate_corpus  # noqa: E402
+
+# serial vs process-pool throughput of process_protocols over a synthetic corpus,
+# also checks that both modes write byte-identical utterance store files.
+# Runs in a temp working directory, logs and not_found_keys.txt never land in the repository.
+
+
+def run_extraction(protocols_dir: str, out_dir: str, workers: int) -> float:
+    # imported here so its loggers open logs/ in the temp working directory
+    from UtterancesExtraction.utterance_extractor import NOT_FOUND_KEYS_FILE, process_protocols
+
+    started = time.perf_counter()
+    process_protocols(protocols_dir, out_dir, force_refresh=True, workers=workers,
+                      not_found_path=os.path.join(os.path.dirname(out_dir), f"{workers}_{NOT_FOUND_KEYS_FILE}"))
+    return time.perf_counter() - started
+
+
+def compare_outputs(left: str, right: str) -> list:
+    names = sorted(os.path.relpath(os.path.join(dirpath, f), left)
+                   for dirpath, _, files in os.walk(left) for f in files)
+    _, mismatch, errors = filecmp.cmpfiles(left, right, names, shallow=False)
+    return mismatch + errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--protocols", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        # the resolver reads the MK list from the working directory
+        shutil.copy(MKS_FILE, "mks_data.json")
+        protocols_dir = os.path.join(tmp, "committee_data")
+        generate_corpus(protocols_dir, protocols=args.protocols)
+
+        serial_dir = os.path.join(tmp, "serial")
+        parallel_dir = os.path.join(tmp, "parallel")
+        serial_seconds = run_extraction(protocols_dir, serial_dir, workers=1)
+        parallel_seconds = run_extraction(protocols_dir, parallel_dir, workers=args.workers)
+        mismatched = compare_outputs(serial_dir, parallel_dir)
+
+    print("=" * 50)
+    print(f"serial:   {args.protocols / serial_seconds:.1f} protocols/sec ({serial_seconds:.2f}s)")
+    print(f"{args.workers} workers: {args.protocols / parallel_seconds:.1f} protocols/sec ({parallel_seconds:.2f}s)")
+    print(f"speedup:  {serial_seconds / parallel_seconds:.2f}x")
+    print(f"identical outputs: {not mismatched} {mismatched[:5] if mismatched else ''}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from filtered_search import FilteredSearcher, MetadataCodes  # noqa: E402
+from vector_index import index_config, new_index, set_search_params  # noqa: E402
+
+# fill rate, recall@k and latency of filtered queries at several selectivities:
+# the old "search 100 then filter" against FilteredSearcher's postfilter / prefilter / partition choice.
+
+FACTIONS = 5
+COMMITTEES = 30
+SPEAKERS = 1000
+
+
+def synthetic(rows: int, dim: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((rows, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    speakers = rng.integers(0, SPEAKERS, rows)
+    columns = {
+        "speaker_key": np.array([f"mk{s}" for s in speakers], dtype=object),
+        "mk_id": np.array([str(s) for s in speakers], dtype=object),
+        "faction": np.array([f"faction{s % FACTIONS}" for s in speakers], dtype=object),
+        "committee": np.array([f"committee{c}" for c in rng.integers(0, COMMITTEES, rows)], dtype=object),
+        "doc_id": np.array([f"doc{i // 200}" for i in range(rows)], dtype=object),
+        "date": np.array([f"2023-{m:02d}-01" for m in rng.integers(1, 13, rows)], dtype=object),
+    }
+    return vectors, columns
+
+
+def exact(vectors, mask, queries, k) -> np.ndarray:
+    ids = np.flatnonzero(mask)
+    scores = queries @ vectors[ids].T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return ids[top]
+
+
+def evaluate(search, queries, truth, k) -> tuple:
+    started = time.perf_counter()
+    found = [search(q[None, :])[0] for q in queries]
+    ms = (time.perf_counter() - started) * 1000 / len(queries)
+    fill = np.mean([np.sum(f >= 0) / k for f in found])
+    recall = np.mean([len(np.intersect1d(f[f >= 0], t)) / len(t) for f, t in zip(found, truth)])
+    return fill, recall, ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-type", dest="index_type", default="flat")
+    args = parser.parse_args()
+    faiss.omp_set_num_threads(1)
+
+    vectors, columns = synthetic(args.rows, args.dim)
+    ids = np.arange(args.rows, dtype=np.int64)
+    config = index_config(type=args.index_type)
+    sample = vectors[np.random.default_rng(1).choice(args.rows, min(args.rows, 50_000))]
+    index = new_index(config, args.dim, sample, rows=args.rows)
+    index.add_with_ids(vectors, ids)
+    set_search_params(index)
+    codes = MetadataCodes(columns, ids)
+    searcher = FilteredSearcher(index, codes)
+    queries = np.random.default_rng(2).standard_normal((args.queries, args.dim), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    cases = [
+        ("none", {}),
+        ("faction", {"faction": "faction1"}),
+        ("committee", {"committee": "committee3"}),
+        ("faction+month", {"faction": "faction2", "date_from": "2023-03-01", "date_to": "2023-03-31"}),
+        ("speaker", {"speaker_key": "mk7"}),
+        ("doc", {"doc_id": "doc42"}),
+    ]
+    print("=" * 88)
+    print(f"{args.rows} x {args.dim} {args.index_type}, k={args.k}, {args.queries} queries")
+    print(f"{'filter':16}{'selectivity':>12}{'strategy':>12}{'old fill':>10}{'fill':>8}{'recall':>8}"
+          f"{'old ms':>10}{'ms':>8}")
+    for name, filters in cases:
+        mask = codes.mask(filters)
+        mask = np.ones(args.rows, dtype=bool) if mask is None else mask
+        truth = exact(vectors, mask, queries, args.k)
+
+        def old_search(q):
+            _, found = index.search(q, 100)
+            found = found[0][mask[found[0]]][:args.k]
+            return np.pad(found, (0, args.k - len(found)), constant_values=-1)[None, :]
+
+        searcher.strategy_counts.clear()
+        old_fill, _, old_ms = evaluate(old_search, queries, truth, args.k)
+        fill, recall, ms = evaluate(lambda q: searcher.search(q, args.k, filters)[1], queries, truth, args.k)
+        strategy = max(searcher.strategy_counts, key=searcher.strategy_counts.get)
+        print(f"{name:16}{mask.mean():>12.4f}{strategy:>12}{old_fill:>10.2f}{fill:>8.2f}{recall:>8.2f}"
+              f"{old_ms:>10.2f}{ms:>8.2f}")
+    print("=" * 88)
+
+
+if __name__ == "__main__":
+    main()
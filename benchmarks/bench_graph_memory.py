@@ -0,0 +1,134 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from bench_embedding_memory import anon_rss_mb  # noqa: E402
+from embedding_store import EmbeddingStore  # noqa: E402
+from utterance_graph import graph_table  # noqa: E402
+from utterance_store import UtteranceStore  # noqa: E402
+
+# private memory of the graph stage as the corpus grows: the sampled graph (stratified sample,
+# PCA on the sample, blocked top-k over the index) against the old cosine_similarity(embeddings),
+# whose N x N matrix is measured at the sizes where it fits and projected beyond.
+# the index itself is loaded before the baseline is taken, it is the same for both.
+
+FACTIONS = 6
+COMMITTEES = 25
+DOC_ROWS = 500
+MODEL = "synthetic"
+OLD_MAX_ROWS = 20_000
+
+
+def build(root: str, rows: int, dim: int):
+    rng = np.random.default_rng(0)
+    utterances = UtteranceStore(os.path.join(root, "utterances"))
+    for start in range(0, rows, DOC_ROWS):
+        doc = start // DOC_ROWS
+        committee = f"committee{doc % COMMITTEES}"
+        utterances.write_protocol(25, committee, f"doc{doc:05d}", [
+            {"utter_id": f"{i:09d}", "doc_id": f"doc{doc:05d}", "speaker_key": f"mk{i % 120}",
+             "faction": f"faction{i % 120 % FACTIONS}", "text": f"utterance {i}"}
+            for i in range(start, min(rows, start + DOC_ROWS))])
+
+    def encode(texts):
+        vectors = rng.standard_normal((len(texts), dim), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    store = EmbeddingStore(MODEL, dim, os.path.join(root, "embeddings"))
+    utter_ids = [f"{i:09d}" for i in range(rows)]
+    store.sync(utter_ids, utter_ids, encode)
+    store.load_index()
+    store.close()
+
+
+class PeakSampler:
+    """Polls RssAnon in the background, ru_maxrss can not be reset between phases."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = anon_rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, anon_rss_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, anon_rss_mb())
+
+
+def measure(root: str, dim: int, sample: int, old: bool) -> tuple:
+    store = EmbeddingStore(MODEL, dim, os.path.join(root, "embeddings"))
+    index = store.load_index()
+    baseline = anon_rss_mb()
+    started = time.perf_counter()
+    with PeakSampler() as sampler:
+        if old:
+            from sklearn.metrics.pairwise import cosine_similarity
+            cosine_similarity(store.gather(np.arange(store.num_rows())))
+        else:
+            graph_table(store, index, os.path.join(root, "utterances"), size=sample)
+    store.close()
+    return sampler.peak - baseline, time.perf_counter() - started
+
+
+def measured(target, args, queue):
+    faiss.omp_set_num_threads(1)
+    queue.put(target(*args))
+
+
+def run_isolated(target, *args):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measured, args=(target, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000, 800_000])
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--sample", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("=" * 76)
+    print(f"graph stage over {args.dim}-dim embeddings, sample {args.sample}, private MB above the loaded index")
+    print(f"{'rows':>10}{'sampled MB':>14}{'seconds':>10}{'old N x N MB':>16}{'old seconds':>14}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as root:
+            run_isolated(build, root, rows, args.dim)
+            new_mb, new_seconds = run_isolated(measure, root, args.dim, args.sample, False)
+            if rows <= OLD_MAX_ROWS:
+                old_mb, old_seconds = run_isolated(measure, root, args.dim, args.sample, True)
+                old = f"{old_mb:>16.0f}{old_seconds:>14.2f}"
+            else:
+                old = f"{rows * rows * 4 / 2 ** 20:>15.0f}*{'-':>14}"
+        print(f"{rows:>10}{new_mb:>14.0f}{new_seconds:>10.2f}{old}")
+    print("* projected, float32 N x N similarity matrix")
+    print("=" * 76)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from vector_index import index_config, new_index, set_search_params  # noqa: E402
+
+# recall@k and per-query latency of every index type against the exact flat index,
+# over the embedding store when --store is given, otherwise over synthetic clustered vectors.
+
+
+def synthetic_vectors(rows: int, dim: int, clusters: int = 200, seed: int = 0) -> np.ndarray:
+    # sentence embeddings are far from uniform, topics make tight clusters
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, clusters, rows)] + 0.6 * rng.standard_normal((rows, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def store_vectors(store_dir: str, model_name: str, dim: int, dtype: str) -> np.ndarray:
+    from embedding_store import EmbeddingStore
+    store = EmbeddingStore(model_name, dim, store_dir, dtype=dtype)
+    vectors = np.concatenate([block for _, block in store.iter_blocks()])
+    store.close()
+    return vectors
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)]))
+
+
+def timed_search(index, queries: np.ndarray, k: int) -> tuple:
+    # one query at a time, like an interactive search
+    started = time.perf_counter()
+    found = np.vstack([index.search(q[None, :], k)[1] for q in queries])
+    return found, (time.perf_counter() - started) * 1000 / len(queries)
+
+
+def index_mb(index) -> float:
+    return len(faiss.serialize_index(index)) / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--store", default=None, help="embedding store directory to benchmark instead of synthetic data")
+    parser.add_argument("--model", default="sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
+    parser.add_argument("--dtype", default="float32")
+    args = parser.parse_args()
+    faiss.omp_set_num_threads(1)
+
+    if args.store:
+        vectors = store_vectors(args.store, args.model, args.dim, args.dtype)
+    else:
+        vectors = synthetic_vectors(args.rows, args.dim)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape, dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    ids = np.arange(len(vectors), dtype=np.int64)
+
+    flat = new_index(index_config(type="flat"), args.dim, vectors[:0])
+    flat.add_with_ids(vectors, ids)
+    truth, flat_ms = timed_search(flat, queries, args.k)
+
+    sweeps = [
+        ("ivf_flat", {"nprobe": [1, 4, 16, 64]}),
+        ("ivf_pq", {"nprobe": [4, 16, 64]}),
+        ("hnsw", {"ef_search": [16, 64, 128, 256]}),
+    ]
+    print("=" * 78)
+    print(f"{len(vectors)} x {args.dim} vectors, {args.queries} queries, recall@{args.k} vs exact IndexFlatIP")
+    print(f"{'index':12}{'param':>16}{'recall':>10}{'ms/query':>12}{'build s':>10}{'size MB':>10}")
+    print(f"{'flat':12}{'-':>16}{1.0:>10.3f}{flat_ms:>12.3f}{0.0:>10.1f}{index_mb(flat):>10.0f}")
+    for kind, params in sweeps:
+        config = index_config(type=kind)
+        if kind == "ivf_pq" and args.dim % config["pq_m"]:
+            config["pq_m"] = next(m for m in (64, 48, 32, 16, 8) if args.dim % m == 0)
+        started = time.perf_counter()
+        sample = vectors[rng.choice(len(vectors), min(config["train_size"], len(vectors)), replace=False)]
+        index = new_index(config, args.dim, sample, rows=len(vectors))
+        index.add_with_ids(vectors, ids)
+        build_seconds = time.perf_counter() - started
+        size = index_mb(index)
+        (name, values), = params.items()
+        for value in values:
+            set_search_params(index, **{name: value})
+            found, ms = timed_search(index, queries, args.k)
+            print(f"{kind:12}{f'{name}={value}':>16}{recall_at_k(found, truth):>10.3f}{ms:>12.3f}"
+                  f"{build_seconds:>10.1f}{size:>10.0f}")
+    print("=" * 78)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks.synthetic_protocols import generate_protocol_text, load_mk_names  # noqa: E402
+from UtterancesExtraction.protocol_tokenizer import tokenize_protocol  # noqa: E402
+from sentiment_scorers import DEFAULT_TRANSFORMER_MODEL_DIR, TextBlobScorer, TransformerScorer  # noqa: E402
+
+# utterances/sec of every sentiment backend over the same fixed corpus.
+# transformer weights are read from --model-dir only, nothing is downloaded.
+
+
+class IdentityTranslator:
+    """Stands in for LibreTranslate when no --translate-url is given, so only TextBlob itself is timed."""
+
+    def translate_many(self, texts: list) -> list:
+        return list(texts)
+
+
+def build_corpus(size: int, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    mk_names = load_mk_names()
+    utterances = []
+    while len(utterances) < size:
+        text, _ = generate_protocol_text(rng, mk_names, turns=50)
+        utterances += [s.value[1] for s in tokenize_protocol(text) if s.kind == "turn"]
+    return utterances[:size]
+
+
+def measure(scorer, corpus: list) -> float:
+    scorer.score_many(corpus[:8])  # warm up
+    started = time.perf_counter()
+    scorer.score_many(corpus)
+    return len(corpus) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--utterances", type=int, default=1000)
+    parser.add_argument("--model-dir", default=str(project_root / DEFAULT_TRANSFORMER_MODEL_DIR))
+    parser.add_argument("--translate-url", default=None)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    corpus = build_corpus(args.utterances)
+    if args.translate_url:
+        from heb_to_eng_translator import HebToEngTranslator
+        translator = HebToEngTranslator(libre_url=args.translate_url)
+    else:
+        translator = IdentityTranslator()
+
+    backends = [("textblob" + ("" if args.translate_url else " (no translation)"),
+                 lambda: TextBlobScorer(translator))]
+    if os.path.isdir(args.model_dir):
+        backends += [
+            ("transformer fp32", lambda: TransformerScorer(args.model_dir, num_threads=args.threads)),
+            ("transformer int8", lambda: TransformerScorer(args.model_dir, quantize=True, num_threads=args.threads)),
+            ("transformer onnx", lambda: TransformerScorer(args.model_dir, use_onnx=True, num_threads=args.threads)),
+        ]
+    else:
+        print(f"No local model weights in {args.model_dir}, skipping the transformer backends")
+
+    print("=" * 50)
+    for name, factory in backends:
+        try:
+            print(f"{name}: {measure(factory(), corpus):.1f} utterances/sec")
+        except ImportError as e:
+            print(f"{name}: skipped, {e}")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
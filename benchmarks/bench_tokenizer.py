@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks.synthetic_protocols import generate_corpus  # noqa: E402
+from UtterancesExtraction.dover_resolver import DoverResolver  # noqa: E402
+from UtterancesExtraction.utterance_extractor import extract_utterance_from_file  # noqa: E402
+
+# single-pass tokenizer vs the previous regex extraction: time and recall against the generator's ground truth.
+
+
+def legacy_extract_pretext_info(dover_resolver: DoverResolver, text: str) -> tuple:
+    mks_from_list = set()
+    chairs = set()
+    topic = ""
+    topic_match = re.search(
+        r"<< נושא >>\s*(?P<topic>[^<]+?)\s*<< נושא >>", text)
+    if topic_match:
+        topic = topic_match.group("topic").strip()
+
+    chair_matches = re.findall(
+        r"(?P<name>.+?)\s+[–-]\s+(?P<role>יו\"ר|מ\"מ היו\"ר)", text)
+    for name, _ in chair_matches:
+        mks_from_list.add(
+            dover_resolver.extract_name_key_from_dover(name.strip()))
+        chairs.add(name.strip())
+
+    combined_lines = []
+    for section_title in ["חברי הוועדה", "חברי הכנסת"]:
+        section_match = re.search(
+            rf"{section_title}:\s*\n(?P<section>.*?)(?:\n\s*\n|מוזמנים:|חברי הוועדה:|חברי הכנסת:)", text, re.S)
+        if section_match:
+            lines = section_match.group("section").splitlines()
+            combined_lines.extend([line.strip()
+                                  for line in lines if line.strip()])
+
+    for line in combined_lines:
+        mks_from_list.add(dover_resolver.extract_name_key_from_dover(line))
+
+    return mks_from_list, chairs, topic
+
+
+def legacy_extract_utterance_from_file(dover_resolver: DoverResolver, content: str):
+    mks_in_meeting, chairs, title = legacy_extract_pretext_info(dover_resolver,
+                                                                content)
+    speaker_utterances = {}
+    pattern = r'<< (?:דובר|יור) >>\s*(?P<speaker>[^:]+):\s*<< (?:דובר|יור) >>\s*(?P<utterance>[^<]+)'
+
+    for match in re.finditer(pattern, content):
+        speaker = match.group('speaker').strip()
+        utterance = match.group('utterance').strip()
+
+        if speaker and utterance:
+            if speaker not in speaker_utterances:
+                speaker_key, mk_meta = dover_resolver.resolve_mk(
+                    speaker, mks_in_meeting)
+                if mk_meta is not None:
+                    if speaker_utterances.get(speaker_key) is None:
+                        speaker_utterances[speaker_key] = {}
+                        speaker_utterances[speaker_key]["utterances"] = []
+                    speaker_utterances[speaker_key]["metadata"] = mk_meta
+                    speaker_utterances[speaker_key]["utterances"].append(
+                        utterance)
+
+    return title, speaker_utterances
+
+
+def measure(extract, protocols: list, truths: dict) -> dict:
+    dover_resolver = DoverResolver()
+    found = 0
+    expected = 0
+    started = time.perf_counter()
+    results = [(doc_id, extract(dover_resolver, text)) for doc_id, text in protocols]
+    seconds = time.perf_counter() - started
+
+    for doc_id, (_, utterances) in results:
+        truth = Counter((name, u) for name, us in truths[doc_id].items() for u in us)
+        extracted = Counter((name, u) for name, data in utterances.items() for u in data["utterances"])
+        found += sum((truth & extracted).values())
+        expected += sum(truth.values())
+    return {"seconds": seconds, "protocols_per_sec": len(protocols) / seconds, "recall": found / expected}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--protocols", type=int, default=100)
+    args = parser.parse_args()
+    os.chdir(project_root)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        truths = generate_corpus(tmp, protocols=args.protocols)
+        protocols = []
+        for doc_id in truths:
+            with open(os.path.join(tmp, f"{doc_id}.json"), "r", encoding="utf-8") as f:
+                protocols.append((doc_id, json.load(f)["text"]))
+
+    legacy = measure(legacy_extract_utterance_from_file, protocols, truths)
+    tokenizer = measure(extract_utterance_from_file, protocols, truths)
+
+    print("=" * 50)
+    for name, result in (("legacy regexes", legacy), ("tokenizer", tokenizer)):
+        print(f"{name}: {result['protocols_per_sec']:.1f} protocols/sec, recall {result['recall']:.3f}")
+    print(f"speedup: {legacy['seconds'] / tokenizer['seconds']:.1f}x")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
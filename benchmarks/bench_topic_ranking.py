@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from embedding_store import EmbeddingStore, peak_rss_mb  # noqa: E402
+from topic_ranking import TopicRanker  # noqa: E402
+
+# per-query latency of ranking MKs by topic, exact (every utterance) against centroid mode,
+# over a synthetic embedding store where every MK talks mostly about a few of the topics.
+
+SPEAKERS = 120
+TOPICS = 40
+FACTIONS = 8
+# norm of the noise around each topic direction, puts an utterance ~0.65 cosine from its topic
+NOISE = 1.2
+
+
+def build_store(root: str, rows: int, dim: int, dtype: str, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((TOPICS, dim), dtype=np.float32)
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    favourite = rng.integers(0, TOPICS, (SPEAKERS, 3))
+    speakers = rng.integers(0, SPEAKERS, rows)
+    utterance_topics = favourite[speakers, rng.integers(0, 3, rows)]
+
+    def encode(texts):
+        picked = np.array([int(t) for t in texts])
+        noise = rng.standard_normal((len(picked), dim), dtype=np.float32) * (NOISE / np.sqrt(dim))
+        vectors = topics[utterance_topics[picked]] + noise
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    store = EmbeddingStore("synthetic", dim, root, dtype=dtype)
+    store.sync([f"{i:09d}" for i in range(rows)], [str(i) for i in range(rows)], encode)
+    return store, speakers, topics, favourite
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--dtype", default="float32")
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        started = time.perf_counter()
+        store, speakers, topics, favourite = build_store(root, args.rows, args.dim, args.dtype)
+        build_seconds = time.perf_counter() - started
+
+        utter_ids, rows = store.utterance_rows()
+        codes = speakers[np.array([int(u) for u in utter_ids])]
+        ranker = TopicRanker(store, rows, codes, np.array([f"mk{s}" for s in range(SPEAKERS)], dtype=object),
+                             np.array([f"faction{s % FACTIONS}" for s in range(SPEAKERS)], dtype=object),
+                             centroids_path=os.path.join(root, "centroids.npz"))
+        started = time.perf_counter()
+        ranker.centroids()
+        centroid_seconds = time.perf_counter() - started
+
+        results = {}
+        for mode in ("exact", "centroid"):
+            ranker.rank(topics[0], mode=mode)  # warm page cache
+            latencies, hits = [], []
+            for topic in range(args.queries):
+                started = time.perf_counter()
+                table = ranker.rank(topics[topic], top=10, mode=mode)
+                latencies.append(time.perf_counter() - started)
+                # ground truth: MKs that have this topic among their favourites
+                truth = {f"mk{s}" for s in np.flatnonzero((favourite == topic).any(axis=1))}
+                top = list(table["speaker_key"][:max(1, len(truth))])
+                hits.append(len(truth.intersection(top)) / max(1, min(len(truth), len(top))) if truth else 1.0)
+            results[mode] = (np.median(latencies) * 1000, np.mean(hits))
+        store.close()
+
+    print("=" * 60)
+    print(f"{args.rows} utterances x {args.dim} {args.dtype}, {SPEAKERS} MKs "
+          f"(store built in {build_seconds:.1f}s, centroids in {centroid_seconds:.1f}s)")
+    for mode, (ms, precision) in results.items():
+        print(f"{mode:10} median {ms:8.1f} ms/query   precision@MKs on topic {precision:.2f}")
+    print(f"peak RSS {peak_rss_mb():.0f} MB")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import hashlib
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import requests
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from search_service import SERVICE_PORT, SearchEngine, UtteranceMetadata, serve  # noqa: E402
+from translation_client import percentile  # noqa: E402
+from vector_index import index_config, new_index  # noqa: E402
+
+# concurrent clients against the search service for a fixed time, client side QPS and latency
+# next to the service's own /metrics. --synthetic serves random vectors with a hashing encoder
+# in this process, so batching and HTTP overhead can be measured without the model.
+
+QUERIES = ["תקציב הביטחון", "מחירי הדיור", "מערכת החינוך", "יוקר המחיה", "שירות צבאי",
+           "תחבורה ציבורית", "הרפורמה המשפטית", "בריאות הנפש", "משבר האקלים", "ביטחון אישי"]
+FACTIONS = ["הליכוד", "יש עתיד", "המחנה הממלכתי", "ש\"ס", "יהדות התורה"]
+COMMITTEES = ["ועדת_הכספים", "ועדת_החוץ_והביטחון", "ועדת_החינוך,_התרבות_והספורט"]
+DIM = 768
+
+
+def hashing_encoder(texts: list) -> np.ndarray:
+    vectors = np.stack([np.random.default_rng(int(hashlib.md5(t.encode()).hexdigest()[:8], 16))
+                        .standard_normal(DIM, dtype=np.float32) for t in texts])
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def synthetic_engine(rows: int) -> SearchEngine:
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((rows, DIM), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = np.arange(rows, dtype=np.int64)
+    index = new_index(index_config(type="flat"), DIM, vectors[:0])
+    index.add_with_ids(vectors, ids)
+    columns = {
+        "utter_id": np.array([f"u{i}" for i in ids], dtype=object),
+        "speaker_key": np.array([f"mk{i % 120}" for i in ids], dtype=object),
+        "mk_id": np.array([str(i % 120) for i in ids], dtype=object),
+        "faction": np.array([FACTIONS[i % len(FACTIONS)] for i in ids], dtype=object),
+        "committee": np.array([COMMITTEES[i % len(COMMITTEES)] for i in ids], dtype=object),
+        "date": np.array([f"2023-{1 + i % 12:02d}-01" for i in ids], dtype=object),
+        "doc_id": np.array([f"25_ptv_{i // 100}" for i in ids], dtype=object),
+        "text": np.array([f"synthetic utterance {i}" for i in ids], dtype=object),
+    }
+    return SearchEngine(hashing_encoder, index, UtteranceMetadata(columns, ids))
+
+
+def client(url: str, seconds: float, k: int, filtered: float, latencies: list, errors: list, seed: int):
+    rng = random.Random(seed)
+    session = requests.Session()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        body = {"query": rng.choice(QUERIES) + f" {rng.randint(0, 10**6)}", "k": k}
+        if rng.random() < filtered:
+            body["filters"] = {"faction": rng.choice(FACTIONS)}
+        started = time.perf_counter()
+        try:
+            session.post(url + "/search", json=body, timeout=30).raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        except requests.RequestException as e:
+            errors.append(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=f"http://127.0.0.1:{SERVICE_PORT}")
+    parser.add_argument("--synthetic", type=int, default=0, help="serve this many synthetic utterances in-process")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--filtered", type=float, default=0.3, help="share of queries with a faction filter")
+    args = parser.parse_args()
+
+    server = engine = None
+    url = args.url
+    if args.synthetic:
+        engine = synthetic_engine(args.synthetic)
+        server = serve(engine, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    latencies, errors = [], []
+    threads = [threading.Thread(target=client, args=(url, args.seconds, args.k, args.filtered, latencies, errors, i))
+               for i in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    service_metrics = requests.get(url + "/metrics", timeout=10).json()
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        engine.close()
+
+    print("=" * 60)
+    print(f"{args.clients} clients for {elapsed:.1f}s against {url}")
+    print(f"requests: {len(latencies)}  errors: {len(errors)}  QPS: {len(latencies) / elapsed:.1f}")
+    print(f"client latency ms p50 {percentile(latencies, 50) * 1000:.1f}  "
+          f"p95 {percentile(latencies, 95) * 1000:.1f}  p99 {percentile(latencies, 99) * 1000:.1f}")
+    print(f"service metrics: {service_metrics}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
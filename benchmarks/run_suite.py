@@ -0,0 +1,520 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from statistics import median
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks.synthetic_protocols import (MKS_FILE, generate_corpus, generate_protocol_text,  # noqa: E402
+                                            load_mk_names, protocol_docx)
+
+# the whole suite over the deterministic synthetic corpus, one JSON result file per commit:
+#   python benchmarks/run_suite.py run [--scale quick] [--only extract_utterances faiss]
+#   python benchmarks/run_suite.py compare <base commit or file> <new commit or file> [--threshold 0.1]
+# every benchmark runs in its own spawned process inside a fresh temp dir, so global state
+# (installed caches, loaded models, peak RSS) never leaks from one benchmark into another.
+
+RESULTS_DIR = project_root / "benchmarks" / "results"
+SEED = 25
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+SCALES = {
+    "quick": {"protocols": 20, "turns": 60, "vectors": 20_000, "dim": 128, "queries": 200, "e2e_protocols": 8},
+    "full": {"protocols": 300, "turns": 120, "vectors": 200_000, "dim": 768, "queries": 1000, "e2e_protocols": 100},
+}
+INDEX_TYPES = ["flat", "ivf_flat", "hnsw"]
+K = 10
+E2E_COMMITTEE_ID = 1
+E2E_PAGE_SIZE = 10
+# the stub answers instantly, the real per-host limit would only measure sleeping
+E2E_REQUESTS_PER_SECOND = 10_000
+HASH_DIM = 256
+# `python -X importtime` cumulative import time of each entry point, in ms. None of them may load a
+# model or torch at import, the budgets are about 3x what they take on a laptop without a warm cache.
+IMPORT_BUDGETS_MS = {
+    "main": 250,
+    "data_fetcher": 350,
+    "UtterancesExtraction.utterance_extractor": 700,
+    "setminent_analayzer": 1000,
+    "embedder": 800,
+    "search_service": 900,
+}
+HELP_BUDGET_MS = 500
+STARTUP_TRIES = 3
+
+BENCHMARKS = {}
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+def benchmark(name: str):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def metric(value: float, unit: str, better: str = "lower", budget: float = None) -> dict:
+    """
+    better is "lower", "higher" or None for values that are reported but never a regression.
+    A metric with a budget fails the run whenever it is above it, whatever the base results say.
+    """
+    out = {"value": float(value), "unit": unit, "better": better}
+    if budget is not None:
+        out["budget"] = budget
+    return out
+
+
+def timed(fn, *args, **kwargs) -> tuple:
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def synthetic_protocols(scale: dict, seed: int) -> list:
+    rng = random.Random(seed)
+    mk_names = load_mk_names()
+    return [generate_protocol_text(rng, mk_names, scale["turns"]) for _ in range(scale["protocols"])]
+
+
+def load_mks() -> dict:
+    with open(MKS_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@benchmark("extract_utterances")
+def bench_extract_utterances(scale: dict, seed: int) -> dict:
+    from UtterancesExtraction.dover_resolver import DoverResolver
+    from UtterancesExtraction.utterance_extractor import extract_utterance_from_file
+
+    protocols = synthetic_protocols(scale, seed)
+    resolver = DoverResolver(mks=load_mks(), role_aliases={})
+    results, seconds = timed(lambda: [extract_utterance_from_file(resolver, text) for text, _ in protocols])
+    extracted = sum(len(speaker["utterances"]) for _, speakers in results for speaker in speakers.values())
+    expected = sum(len(turns) for _, truth in protocols for turns in truth.values())
+    return {
+        "seconds": metric(seconds, "s"),
+        "protocols_per_second": metric(len(protocols) / seconds, "protocols/s", "higher"),
+        "utterances": metric(extracted, "utterances", None),
+        "mk_utterance_ratio": metric(extracted / expected, "ratio", None),
+    }
+
+
+@benchmark("resolve_mk")
+def bench_resolve_mk(scale: dict, seed: int) -> dict:
+    from UtterancesExtraction.dover_resolver import DoverResolver
+    from UtterancesExtraction.protocol_tokenizer import tokenize_protocol
+    from UtterancesExtraction.utterance_extractor import pretext_info_from_segments
+
+    mks = load_mks()
+    parsing = DoverResolver(mks=mks, role_aliases={})
+    calls = []
+    for text, _ in synthetic_protocols(scale, seed):
+        segments = list(tokenize_protocol(text))
+        mks_in_meeting, chairs, _ = pretext_info_from_segments(parsing, segments)
+        speakers = dict.fromkeys(s.value[0] for s in segments if s.kind == "turn" and s.value[0])
+        calls.extend((speaker, mks_in_meeting, chairs) for speaker in speakers)
+
+    # cold: a new resolver, every fuzzy match and meeting roster computed once; warm: all cached
+    resolver = DoverResolver(mks=mks, role_aliases={})
+    _, cold = timed(lambda: [resolver.resolve_mk(*call) for call in calls])
+    _, warm = timed(lambda: [resolver.resolve_mk(*call) for call in calls])
+    return {
+        "cold_us_per_call": metric(cold * 1e6 / len(calls), "us"),
+        "warm_us_per_call": metric(warm * 1e6 / len(calls), "us"),
+        "calls": metric(len(calls), "calls", None),
+    }
+
+
+@benchmark("load_utterances")
+def bench_load_utterances(scale: dict, seed: int) -> dict:
+    from UtterancesExtraction.utterance_extractor import process_protocols
+
+    shutil.copy(MKS_FILE, "mks_data.json")
+    generate_corpus("committee_data", scale["protocols"], scale["turns"], seed)
+    process_protocols("committee_data", "utterance_store", force_refresh=True)
+    try:
+        import embedder
+    except Exception as e:  # the model dependencies are optional for the rest of the suite
+        raise SkipBenchmark(f"embedder can not be imported: {e!r}")
+    (utter_ids, _), seconds = timed(embedder._load_utternaces_to_vector_space, "utterance_store")
+    return {
+        "seconds": metric(seconds, "s"),
+        "utterances_per_second": metric(len(utter_ids) / seconds, "utterances/s", "higher"),
+        "utterances": metric(len(utter_ids), "utterances", None),
+    }
+
+
+@benchmark("faiss")
+def bench_faiss(scale: dict, seed: int) -> dict:
+    import faiss
+    from benchmarks.bench_index_recall import recall_at_k, synthetic_vectors
+    from vector_index import index_config, new_index, set_search_params
+
+    vectors = synthetic_vectors(scale["vectors"], scale["dim"], seed=seed)
+    queries = synthetic_vectors(scale["queries"], scale["dim"], seed=seed + 1)
+    ids = np.arange(len(vectors), dtype=np.int64)
+    out, truth = {}, None
+    for kind in INDEX_TYPES:
+        started = time.perf_counter()
+        index = new_index(index_config(type=kind), scale["dim"], vectors)
+        index.add_with_ids(vectors, ids)
+        out[f"{kind}_build_seconds"] = metric(time.perf_counter() - started, "s")
+        set_search_params(index)
+        (_, found), seconds = timed(index.search, queries, K)
+        out[f"{kind}_search_ms_per_query"] = metric(seconds * 1000 / len(queries), "ms")
+        truth = found if truth is None else truth
+        out[f"{kind}_recall_at_{K}"] = metric(recall_at_k(found, truth), "recall", "higher")
+        out[f"{kind}_index_mb"] = metric(len(faiss.serialize_index(index)) / 2 ** 20, "MB")
+    return out
+
+
+def import_ms(module: str) -> float:
+    """Cumulative import time of `module` in a fresh interpreter, from the -X importtime report."""
+    env = dict(os.environ, PYTHONPATH=str(project_root))
+    report = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env, check=True).stderr
+    for line in report.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2].startswith("  "):
+            return int(parts[1]) / 1000
+    raise ValueError(f"{module} is not in the -X importtime report")
+
+
+@benchmark("startup")
+def bench_startup(scale: dict, seed: int) -> dict:
+    # best of a few tries, the first run of an interpreter also pays for the cold page cache
+    out = {}
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        out[f"{module}_import_ms"] = metric(min(import_ms(module) for _ in range(STARTUP_TRIES)), "ms",
+                                            budget=budget)
+    help_seconds = min(timed(subprocess.run, [sys.executable, str(project_root / "main.py"), "--help"],
+                             capture_output=True, check=True)[1] for _ in range(STARTUP_TRIES))
+    out["main_help_ms"] = metric(help_seconds * 1000, "ms", budget=HELP_BUDGET_MS)
+    return out
+
+
+class StubKnesset(BaseHTTPRequestHandler):
+    """OData sessions, DOCX downloads and LibreTranslate /translate, all answered from memory."""
+    sessions = []
+    documents = {}
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body: bytes, content_type: str = "application/json", status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith("/KNS_CommitteeSession"):
+            query = parse_qs(url.query)
+            if query.get("$count") == ["true"]:
+                return self.reply(json.dumps({"@odata.count": len(self.sessions), "value": []}).encode())
+            skip, top = int(query["$skip"][0]), int(query["$top"][0])
+            return self.reply(json.dumps({"value": self.sessions[skip:skip + top]}).encode())
+        document = self.documents.get(os.path.basename(url.path))
+        if document is None:
+            return self.reply(b"{}", status=404)
+        self.reply(document, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        # identity "translation", the cost measured is ours, not the translation model's
+        self.reply(json.dumps({"translatedText": payload["q"]}).encode())
+
+
+def start_stub(protocols: list) -> tuple:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubKnesset)
+    base = f"http://127.0.0.1:{server.server_port}"
+    StubKnesset.sessions, StubKnesset.documents = [], {}
+    for i, (text, _) in enumerate(protocols):
+        doc_id = f"25_ptv_{9000000 + i}"
+        date = f"2024-01-{i % 28 + 1:02d}T10:00:00"
+        StubKnesset.documents[f"{doc_id}.docx"] = protocol_docx(text)
+        StubKnesset.sessions.append({
+            "ID": i, "CommitteeID": E2E_COMMITTEE_ID, "StartDate": date, "LastUpdatedDate": date,
+            "KNS_DocumentCommitteeSession": [
+                {"ApplicationDesc": "DOC", "GroupTypeID": 23, "FilePath": f"{base}/docs/{doc_id}.docx"}]})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base
+
+
+def hashing_encoder(dim: int = HASH_DIM):
+    """Deterministic bag-of-words vectors standing in for the sentence transformer."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    vectorizer = HashingVectorizer(n_features=dim, norm="l2", alternate_sign=False)
+    return lambda texts: vectorizer.transform(texts).toarray().astype(np.float32)
+
+
+@benchmark("end_to_end")
+def bench_end_to_end(scale: dict, seed: int) -> dict:
+    rng = random.Random(seed)
+    mk_names = load_mk_names()
+    protocols = [generate_protocol_text(rng, mk_names, scale["turns"]) for _ in range(scale["e2e_protocols"])]
+    server, base = start_stub(protocols)
+    os.environ["LIBRE_TRANSLATE_URL"] = base
+    shutil.copy(MKS_FILE, "mks_data.json")
+
+    import data_fetcher
+    from doc_converter import ConversionPool, PythonTextBackend
+    from embedding_store import EmbeddingStore
+    from metrics import metrics
+    from odata_crawler import ODataCrawler
+    from setminent_analayzer import analyze_sentiment_sampled
+    from utterance_store import UtteranceStore
+    from UtterancesExtraction.utterance_extractor import process_protocols
+
+    # what data_fetcher.init() does, without asking the real API for the committee names;
+    # the HTTP cache goes to the current (temp) directory
+    data_fetcher.install_http_cache()
+    data_fetcher.COMMITTEES[E2E_COMMITTEE_ID] = {"Id": E2E_COMMITTEE_ID, "Name": "ועדת הכספים"}
+    os.makedirs(data_fetcher.TEMP_RESOURCE_FOLDER, exist_ok=True)
+    os.makedirs(data_fetcher.OUTPUT_FOLDER, exist_ok=True)
+    # the pure python DOCX reader stands in for soffice
+    data_fetcher.CONVERSION_POOL = ConversionPool(backend_factory=PythonTextBackend, workers=2).start()
+    crawler = ODataCrawler(base_uri=base, page_size=E2E_PAGE_SIZE, requests_per_second=E2E_REQUESTS_PER_SECOND)
+    try:
+        with metrics.stage("fetch"):
+            data_fetcher.fetch_all_committees_from_knesset(25, True, False, crawler=crawler)
+        with metrics.stage("extract"):
+            process_protocols(data_fetcher.OUTPUT_FOLDER, "utterance_store", force_refresh=True)
+        with metrics.stage("sentiment"):
+            analyze_sentiment_sampled("utterance_store")
+        with metrics.stage("embed"):
+            df = UtteranceStore("utterance_store").read_pandas(columns=["utter_id", "committee", "text"])
+            store = EmbeddingStore("hashing", HASH_DIM, "embedding_store")
+            store.sync(df["utter_id"].tolist(), (df["committee"] + ": " + df["text"]).tolist(), hashing_encoder())
+            store.load_index()
+            store.close()
+    finally:
+        data_fetcher.close_conversion_pool()
+        server.shutdown()
+
+    out = {f"{s['stage']}_seconds": metric(s["seconds"], "s") for s in metrics.report()["stages"]}
+    out["total_seconds"] = metric(sum(s["seconds"] for s in metrics.report()["stages"]), "s")
+    out["documents"] = metric(len(os.listdir(data_fetcher.OUTPUT_FOLDER)), "documents", None)
+    out["utterances"] = metric(len(df), "utterances", None)
+    return out
+
+
+def run_in_temp_dir(name: str, scale: dict, seed: int, results):
+    """Spawned child: runs one benchmark in a fresh working directory and sends back its metrics."""
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    os.chdir(workdir)
+    try:
+        import faiss
+        from metrics import peak_rss_mb
+
+        faiss.omp_set_num_threads(1)
+        out = BENCHMARKS[name](scale, seed)
+        out["peak_rss_mb"] = metric(peak_rss_mb(), "MB")
+        results.put(("ok", out))
+    except SkipBenchmark as e:
+        results.put(("skipped", str(e)))
+    except Exception:
+        results.put(("failed", traceback.format_exc()))
+    finally:
+        os.chdir(project_root)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_isolated(name: str, scale: dict, seed: int) -> tuple:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_in_temp_dir, args=(name, scale, seed, results))
+    process.start()
+    while True:
+        try:
+            outcome = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    outcome = results.get(timeout=1)
+                except queue.Empty:
+                    outcome = ("failed", f"benchmark process exited with code {process.exitcode}")
+                break
+    process.join()
+    return outcome
+
+
+def run_benchmark(name: str, scale: dict, seed: int, repeat: int) -> dict:
+    """Median of each metric over `repeat` runs, the individual runs are kept next to it."""
+    runs = []
+    for _ in range(repeat):
+        status, out = run_isolated(name, scale, seed)
+        if status != "ok":
+            return {"status": status, "reason": out}
+        runs.append(out)
+    merged = {}
+    for key, first in runs[0].items():
+        values = [run[key]["value"] for run in runs]
+        merged[key] = dict(first, value=median(values), runs=values)
+    return {"status": "ok", "metrics": merged}
+
+
+def git_commit() -> tuple:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=project_root, capture_output=True, text=True).stdout.strip()
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    return commit, bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def run_suite(names: list, scale_name: str, repeat: int, seed: int = SEED) -> dict:
+    commit, dirty = git_commit()
+    scale = SCALES[scale_name]
+    result = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "scale": scale_name,
+        "scale_params": scale,
+        "seed": seed,
+        "repeat": repeat,
+        "platform": {"python": platform.python_version(), "machine": platform.machine(),
+                     "system": platform.system(), "cpus": os.cpu_count()},
+        "benchmarks": {},
+    }
+    for name in names:
+        started = time.perf_counter()
+        outcome = run_benchmark(name, scale, seed, repeat)
+        result["benchmarks"][name] = outcome
+        summary = outcome["status"] if outcome["status"] != "ok" else ", ".join(
+            f"{key} {m['value']:.4g}" for key, m in outcome["metrics"].items())
+        print(f"{name:<20} {time.perf_counter() - started:6.1f}s  {summary}")
+        if outcome["status"] != "ok":
+            print(f"    {outcome['reason'].strip().splitlines()[-1]}")
+    return result
+
+
+def resolve_results_path(ref: str) -> Path:
+    path = Path(ref)
+    if path.exists():
+        return path
+    matches = sorted(RESULTS_DIR.glob(f"{ref}*.json"))
+    if not matches:
+        raise FileNotFoundError(f"No results file {ref} and nothing matching {RESULTS_DIR / ref}*.json")
+    return matches[-1]
+
+
+def compare(base: dict, new: dict, threshold: float = DEFAULT_THRESHOLD) -> list:
+    """Rows of (benchmark, metric, base, new, relative change, verdict)."""
+    rows = []
+    for name, new_bench in new["benchmarks"].items():
+        base_bench = base["benchmarks"].get(name)
+        if base_bench is None or base_bench["status"] != "ok" or new_bench["status"] != "ok":
+            rows.append((name, "-", None, None, None, "not comparable"))
+            continue
+        for key, m in new_bench["metrics"].items():
+            old = base_bench["metrics"].get(key)
+            if old is None:
+                rows.append((name, key, None, m["value"], None, "new"))
+                continue
+            change = (m["value"] - old["value"]) / old["value"] if old["value"] else 0.0
+            if m["better"] is None:
+                verdict = "changed" if m["value"] != old["value"] else ""
+            else:
+                worse = change if m["better"] == "lower" else -change
+                verdict = "REGRESSION" if worse > threshold else "improved" if worse < -threshold else ""
+            rows.append((name, key, old["value"], m["value"], change, verdict))
+    return rows
+
+
+def print_comparison(base: dict, new: dict, rows: list):
+    print(f"base {base['commit']}{' (dirty)' if base['dirty'] else ''} {base['created_at']}  ->  "
+          f"new {new['commit']}{' (dirty)' if new['dirty'] else ''} {new['created_at']}")
+    if base["scale"] != new["scale"] or base["platform"] != new["platform"]:
+        print(f"warning: comparing {base['scale']} on {base['platform']} with {new['scale']} on {new['platform']}")
+    print(f"{'benchmark':<20}{'metric':<30}{'base':>12}{'new':>12}{'change':>9}  verdict")
+    for name, key, old, value, change, verdict in rows:
+        old = f"{old:12.4g}" if old is not None else f"{'-':>12}"
+        value = f"{value:12.4g}" if value is not None else f"{'-':>12}"
+        change = f"{change:+9.1%}" if change is not None else f"{'-':>9}"
+        print(f"{name:<20}{key:<30}{old}{value}{change}  {verdict}")
+
+
+def report_over_budget(result: dict) -> bool:
+    over = [(name, key, m["value"], m["budget"]) for name, bench in result["benchmarks"].items()
+            if bench["status"] == "ok" for key, m in bench["metrics"].items()
+            if "budget" in m and m["value"] > m["budget"]]
+    for name, key, value, budget in over:
+        print(f"OVER BUDGET {name} {key}: {value:.4g} > {budget:.4g}")
+    return bool(over)
+
+
+def load_results(ref: str) -> dict:
+    with open(resolve_results_path(ref), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the suite and store the results of this commit")
+    run.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    run.add_argument("--scale", choices=list(SCALES), default="full")
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run.add_argument("--seed", type=int, default=SEED)
+    run.add_argument("--output", default=None, help=f"results file, default {RESULTS_DIR}/<commit>.json")
+    run.add_argument("--compare-to", default=None, help="commit or results file to compare the new results with")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    cmp = commands.add_parser("compare", help="compare two stored results, exits with 1 on a regression")
+    cmp.add_argument("base")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                     help="relative change in the worse direction that counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = run_suite(args.only, args.scale, args.repeat, args.seed)
+        suffix = "-dirty" if result["dirty"] else ""
+        output = Path(args.output or RESULTS_DIR / f"{result['commit']}{suffix}-{args.scale}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"results written to {output}")
+        failed = any(b["status"] == "failed" for b in result["benchmarks"].values())
+        failed = report_over_budget(result) or failed
+        if args.compare_to is None:
+            sys.exit(1 if failed else 0)
+        base, new = load_results(args.compare_to), result
+    else:
+        base, new = load_results(args.base), load_results(args.new)
+        failed = report_over_budget(new)
+
+    rows = compare(base, new, args.threshold)
+    print_comparison(base, new, rows)
+    regressions = [row for row in rows if row[-1] == "REGRESSION"]
+    print(f"{len(regressions)} regressions above {args.threshold:.0%}")
+    sys.exit(1 if regressions or failed else 0)
+
+
+if __name__ == "__main__":
+    main()
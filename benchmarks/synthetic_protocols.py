@@ -0,0 +1,116 @@
+import json
+import os
+import random
+import sys
+import zipfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+MKS_FILE = project_root / "mks_data.json"
+COMMITTEES = ["ועדת הכספים", "ועדת החוקה, חוק ומשפט", "ועדת החינוך, התרבות והספורט",
+              "ועדת הכלכלה", "ועדת החוץ והביטחון", "ועדת הפנים והגנת הסביבה"]
+TOPICS = ["הצעת חוק התקציב לשנת הכספים", "דיון מהיר בנושא יוקר המחיה", "הסדרת שוק החשמל",
+          "מצב מערכת החינוך לקראת פתיחת שנת הלימודים", "תקנות ההגנה על הצרכן"]
+FACTIONS = ["הליכוד", "יש עתיד", "ש\"ס", "המחנה הממלכתי"]
+GUESTS = ["דוד כהן", "מיכל לוי", "יוסי אברהם", "רונית פרץ", "אבי ביטון"]
+WORDS = ["אני", "חושב", "שהממשלה", "צריכה", "לפעול", "מיד", "בנושא", "הזה", "כי", "הציבור",
+         "מחכה", "לתשובות", "ואנחנו", "לא", "נסכים", "להמשיך", "ככה", "התקציב", "החוק", "הוועדה",
+         "תודה", "רבה", "אדוני", "היושב", "ראש", "בבקשה", "אבל", "גם", "עם", "על"]
+WORD_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+def load_mk_names(mks_file=MKS_FILE) -> list:
+    with open(mks_file, "r", encoding="utf-8") as f:
+        mks = json.load(f)
+    return [f"{mk['FirstName']} {mk['LastName']}" for mk in mks.values()]
+
+
+def _sentence(rng: random.Random, min_words=6, max_words=40) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))) + "."
+
+
+def generate_protocol_text(rng: random.Random, mk_names: list, turns: int) -> tuple:
+    """
+    Returns the protocol text and the ground truth {mk name: [utterances]} of the MK turns in it,
+    in the same format as the protocols converted from the Knesset DOC files.
+    """
+    members = rng.sample(mk_names, k=min(len(mk_names), rng.randint(4, 12)))
+    chair = members[0]
+    visiting = rng.sample([n for n in mk_names if n not in members], k=2)
+    lines = [
+        "הכנסת העשרים וחמש",
+        f"פרוטוקול מס' {rng.randint(1, 900)}",
+        f"<< נושא >> {rng.choice(TOPICS)} << נושא >>",
+        "",
+        "חברי הוועדה:",
+        f"{chair} – היו\"ר",
+        *members[1:],
+        "",
+        "חברי הכנסת:",
+        *visiting,
+        "",
+        "מוזמנים:",
+        *[f"{g} – משרד האוצר" for g in GUESTS[:rng.randint(1, len(GUESTS))]],
+        "",
+    ]
+    speakers = members + visiting
+    truth = {}
+    for _ in range(turns):
+        roll = rng.random()
+        text = " ".join(_sentence(rng) for _ in range(rng.randint(1, 6)))
+        if roll < 0.2:
+            lines.append(f"<< יור >> היו\"ר {chair}: << יור >>")
+            truth.setdefault(chair, []).append(text)
+        elif roll < 0.9:
+            speaker = rng.choice(speakers)
+            suffix = f" ({rng.choice(FACTIONS)})" if rng.random() < 0.5 else ""
+            lines.append(f"<< דובר >> {speaker}{suffix}: << דובר >>")
+            truth.setdefault(speaker, []).append(text)
+        else:
+            lines.append(f"<< דובר >> {rng.choice(GUESTS)}: << דובר >>")
+        lines.append(text)
+        lines.append("")
+    return "\n".join(lines), truth
+
+
+def generate_corpus(out_dir: str, protocols: int = 200, turns_per_protocol: int = 120, seed: int = 25,
+                    mk_names: list = None) -> dict:
+    """
+    Writes `protocols` committee_data style JSON files into out_dir.
+    The same seed always produces the same corpus. Returns {doc_id: ground truth}.
+    """
+    rng = random.Random(seed)
+    mk_names = mk_names or load_mk_names()
+    os.makedirs(out_dir, exist_ok=True)
+    truths = {}
+    for i in range(protocols):
+        doc_id = f"25_ptv_{9000000 + i}"
+        text, truth = generate_protocol_text(
+            rng, mk_names, rng.randint(turns_per_protocol // 2, turns_per_protocol * 3 // 2))
+        data = {
+            "knesset_num": 25,
+            "committee": rng.choice(COMMITTEES).replace(" ", "_"),
+            "doc_id": doc_id,
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T10:00:00",
+            "source_file": f"https://fs.knesset.gov.il/25/Committees/{doc_id}.doc",
+            "text": text,
+        }
+        with open(os.path.join(out_dir, f"{doc_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        truths[doc_id] = truth
+    return truths
+
+
+def protocol_docx(text: str) -> bytes:
+    """The protocol text as a minimal DOCX, one paragraph per line, as served for the stubbed downloads."""
+    paragraphs = "".join(f"<w:p><w:r><w:t xml:space=\"preserve\">{escape(line)}</w:t></w:r></w:p>"
+                         for line in text.split("\n"))
+    document = f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{WORD_NS}"><w:body>{paragraphs}</w:body></w:document>'
+    out = BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("word/document.xml", document)
+    return out.getvalue()
@@ -0,0 +1,279 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from embedding_store import BLOCK_ROWS, EmbeddingView
+from logger_config import get_logger
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+
+CLUSTER_DIR = "clusters"
+MODEL_FILE = "model.npz"
+MODEL_META_FILE = "model.json"
+LABELS_FILE = "labels.parquet"
+SUMMARY_FILE = "clusters.json"
+REDUCERS = ["pca", "random"]
+DEFAULT_CLUSTER_CONFIG = {
+    "reducer": "pca",
+    "dim": 64,
+    # kmeans over-clusters into this many micro clusters, HDBSCAN then groups the micro clusters into topics
+    "micro_clusters": 1024,
+    "kmeans_epochs": 2,
+    "min_cluster_size": 5,
+    "min_samples": 3,
+}
+# refit from scratch once the store grew this many times past the rows the model was fitted on
+REFIT_GROWTH = 2
+REPRESENTATIVES = 5
+KEYWORDS = 8
+# a keyword has to show up at least this many times in the cluster to count
+MIN_KEYWORD_COUNT = 3
+WORD_RE = re.compile(r"[֐-׿A-Za-z\"']{3,}")
+
+logger = get_logger(__name__)
+
+
+def cluster_config(**overrides) -> dict:
+    config = dict(DEFAULT_CLUSTER_CONFIG)
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    if config["reducer"] not in REDUCERS:
+        raise ValueError(f"Unknown reducer {config['reducer']}, expected one of {REDUCERS}")
+    return config
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ClusterModel:
+    """
+    The fitted pieces needed to label an utterance without refitting:
+    a linear projection to a few dimensions, the kmeans micro cluster centers in that space,
+    and the topic (HDBSCAN label, -1 for noise) of every micro cluster.
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, centers: np.ndarray,
+                 micro_topics: np.ndarray, config: dict, fitted_rows: int):
+        self.mean = mean.astype(np.float32)
+        self.components = components.astype(np.float32)
+        self.centers = centers.astype(np.float32)
+        self.micro_topics = micro_topics.astype(np.int32)
+        self.config = config
+        self.fitted_rows = fitted_rows
+        self.topic_centroids = np.zeros((0, self.centers.shape[1]), dtype=np.float32)
+
+    @property
+    def num_topics(self) -> int:
+        return int(self.micro_topics.max()) + 1 if len(self.micro_topics) else 0
+
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        return _normalize((vectors - self.mean) @ self.components.T)
+
+    def set_topic_centroids(self, micro_sizes: np.ndarray):
+        """A topic's centroid is the mean of its micro cluster centers, weighted by their sizes."""
+        sums = np.zeros((self.num_topics, self.centers.shape[1]), dtype=np.float64)
+        topics = self.micro_topics >= 0
+        np.add.at(sums, self.micro_topics[topics], self.centers[topics] * micro_sizes[topics, None])
+        self.topic_centroids = _normalize(sums).astype(np.float32)
+
+    def nearest_micro(self, reduced: np.ndarray) -> np.ndarray:
+        # centers are not normalized, nearest center by squared distance: |c|^2 - 2 x.c
+        distances = (self.centers ** 2).sum(axis=1) - 2 * reduced @ self.centers.T
+        return distances.argmin(axis=1).astype(np.int32)
+
+    def assign(self, vectors: np.ndarray) -> tuple:
+        """(micro cluster, topic, similarity to the topic centroid) of every vector."""
+        reduced = self.reduce(vectors)
+        micro = self.nearest_micro(reduced)
+        topics = self.micro_topics[micro]
+        own = np.where(topics[:, None] >= 0, self.topic_centroids[np.maximum(topics, 0)],
+                       _normalize(self.centers[micro]))
+        return micro, topics, np.einsum("ij,ij->i", reduced, own).astype(np.float32)
+
+    def save(self, directory: str, fingerprint: str):
+        os.makedirs(directory, exist_ok=True)
+        np.savez(os.path.join(directory, MODEL_FILE), mean=self.mean, components=self.components,
+                 centers=self.centers, micro_topics=self.micro_topics, topic_centroids=self.topic_centroids)
+        with open(os.path.join(directory, MODEL_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "config": self.config, "fitted_rows": self.fitted_rows}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory: str, fingerprint: str):
+        """The saved model, or None when there is none or it was fitted for another model or config."""
+        meta_path = os.path.join(directory, MODEL_META_FILE)
+        if not os.path.exists(meta_path) or not os.path.exists(os.path.join(directory, MODEL_FILE)):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != fingerprint:
+            return None
+        saved = np.load(os.path.join(directory, MODEL_FILE))
+        model = cls(saved["mean"], saved["components"], saved["centers"], saved["micro_topics"],
+                    meta["config"], meta["fitted_rows"])
+        model.topic_centroids = saved["topic_centroids"]
+        return model
+
+
+def _shuffled_blocks(view, rng, block_rows: int = BLOCK_ROWS):
+    """Blocks of the view in random order, so partial fits do not see one protocol after another."""
+    order = rng.permutation(len(view))
+    for start in range(0, len(order), block_rows):
+        picked = np.sort(order[start:start + block_rows])
+        yield view[picked]
+
+
+def fit(view, config: dict, seed: int = 0) -> ClusterModel:
+    """
+    Streams the embeddings three times, never holding more than one block of them:
+    fit the projection, fit MiniBatchKMeans on the projected blocks, then run HDBSCAN over
+    the micro cluster centers only, which is about a thousand points instead of the whole corpus.
+    """
+    # sklearn is only needed to fit, labelling with a saved model is numpy only
+    from sklearn.cluster import HDBSCAN, MiniBatchKMeans
+    from sklearn.decomposition import IncrementalPCA
+    from sklearn.random_projection import GaussianRandomProjection
+
+    rng = np.random.default_rng(seed)
+    rows, dim = view.shape
+    n_components = min(config["dim"], dim, rows)
+    if config["reducer"] == "pca":
+        pca = IncrementalPCA(n_components=n_components)
+        for start, block in view.iter_blocks():
+            # every partial fit needs at least n_components rows, a shorter tail block is left out
+            if len(block) >= n_components:
+                pca.partial_fit(block)
+        mean, components = pca.mean_, pca.components_
+    else:
+        projection = GaussianRandomProjection(n_components=n_components, random_state=seed)
+        projection.fit(np.zeros((1, dim), dtype=np.float32))
+        mean, components = np.zeros(dim, dtype=np.float32), projection.components_
+    logger.info(f"Fitted {config['reducer']} projection {dim} -> {n_components}")
+
+    micro_clusters = min(config["micro_clusters"], rows)
+    kmeans = MiniBatchKMeans(n_clusters=micro_clusters, random_state=seed, n_init=1,
+                             batch_size=min(BLOCK_ROWS, rows))
+    reducer = ClusterModel(mean, components, np.zeros((0, n_components)), np.zeros(0), config, rows)
+    for _ in range(config["kmeans_epochs"]):
+        for block in _shuffled_blocks(view, rng):
+            if len(block) >= micro_clusters:
+                kmeans.partial_fit(reducer.reduce(block))
+    centers = kmeans.cluster_centers_
+    logger.info(f"Fitted {micro_clusters} micro clusters")
+
+    if micro_clusters > config["min_cluster_size"]:
+        micro_topics = HDBSCAN(min_cluster_size=config["min_cluster_size"], min_samples=config["min_samples"],
+                               copy=True).fit_predict(centers)
+    else:
+        micro_topics = np.zeros(micro_clusters, dtype=np.int32)
+    model = ClusterModel(mean, components, centers, micro_topics, config, rows)
+    logger.info(f"HDBSCAN grouped {micro_clusters} micro clusters into {model.num_topics} topics, "
+                f"{int((micro_topics < 0).sum())} left as noise")
+    return model
+
+
+def _label_rows(model: ClusterModel, utter_ids: list, view) -> pd.DataFrame:
+    micro = np.empty(len(view), dtype=np.int32)
+    topics = np.empty(len(view), dtype=np.int32)
+    scores = np.empty(len(view), dtype=np.float32)
+    for start, block in view.iter_blocks():
+        end = start + len(block)
+        micro[start:end], topics[start:end], scores[start:end] = model.assign(block)
+    return pd.DataFrame({"utter_id": utter_ids, "micro": micro, "cluster": topics, "score": scores})
+
+
+def _keywords(values: pd.Series, members: np.ndarray, top: int = KEYWORDS) -> list:
+    """Values over represented in the cluster, ranked by lift over their corpus wide share."""
+    overall = values.value_counts(normalize=True)
+    inside = values[members].value_counts()
+    lift = (inside / inside.sum()) / overall[inside.index]
+    keep = (inside >= MIN_KEYWORD_COUNT) & (lift > 1)
+    ranked = pd.DataFrame({"count": inside[keep], "lift": lift[keep]}).sort_values(["lift", "count"], ascending=False)
+    return [{"keyword": k, "count": int(r["count"]), "lift": round(float(r["lift"]), 2)}
+            for k, r in ranked.head(top).iterrows()]
+
+
+def summarize(labels: pd.DataFrame, store_dir: str = UTTERANCE_STORE_DIR) -> dict:
+    """Size, representative utterances and committee / subject keywords of every topic."""
+    df = UtteranceStore(store_dir).read_pandas(columns=["utter_id", "committee", "subject"])
+    df = labels.merge(df, on="utter_id", how="left")
+    subject_words = df["subject"].fillna("").str.findall(WORD_RE).apply(set)
+    words = subject_words.explode().dropna()
+
+    representatives = (labels[labels["cluster"] >= 0].sort_values("score", ascending=False)
+                       .groupby("cluster").head(REPRESENTATIVES))
+    texts = UtteranceStore(store_dir).read_pandas(
+        columns=["utter_id", "committee", "text"],
+        filter=pc.field("utter_id").isin(representatives["utter_id"].tolist()))
+    texts = dict(zip(texts["utter_id"], texts["committee"] + ": " + texts["text"]))
+
+    summary = {}
+    for cluster, members in df.groupby("cluster").groups.items():
+        if cluster < 0:
+            summary["noise"] = {"size": len(members)}
+            continue
+        member_mask = np.zeros(len(df), dtype=bool)
+        member_mask[members] = True
+        reps = representatives[representatives["cluster"] == cluster]
+        summary[str(cluster)] = {
+            "size": len(members),
+            "committees": _keywords(df["committee"], member_mask),
+            "subject_keywords": _keywords(words, member_mask[words.index]),
+            "representatives": [{"utter_id": u, "score": round(float(s), 3), "text": texts.get(u, "")}
+                                for u, s in zip(reps["utter_id"], reps["score"])],
+        }
+    return summary
+
+
+def cluster_embeddings(store, store_dir: str = UTTERANCE_STORE_DIR, directory: str = CLUSTER_DIR,
+                       config: dict = None, refit: bool = False, seed: int = 0) -> pd.DataFrame:
+    """
+    Labels every utterance of the embedding store with a topic, written to <directory>/labels.parquet.
+    A saved model is reused and only utterances without a label are assigned,
+    until the store outgrows the fitted model by REFIT_GROWTH or refit is asked for.
+    """
+    config = config or cluster_config()
+    fingerprint = json.dumps({"model": store.model_name, "dim": store.dim, "config": config}, sort_keys=True)
+    utter_ids, rows = store.utterance_rows()
+    view = EmbeddingView(store, rows)
+    labels_path = os.path.join(directory, LABELS_FILE)
+
+    model = None if refit else ClusterModel.load(directory, fingerprint)
+    if model is not None and len(rows) > model.fitted_rows * REFIT_GROWTH:
+        logger.info(f"Store grew from {model.fitted_rows} to {len(rows)} utterances, refitting clusters")
+        model = None
+
+    if model is None:
+        if not len(rows):
+            return pd.DataFrame(columns=["utter_id", "micro", "cluster", "score"])
+        model = fit(view, config, seed)
+        # topic centroids weigh micro clusters by their sizes, one more pass to count them
+        micro_sizes = np.zeros(len(model.centers))
+        for _, block in view.iter_blocks():
+            micro_sizes += np.bincount(model.nearest_micro(model.reduce(block)), minlength=len(model.centers))
+        model.set_topic_centroids(micro_sizes)
+        labels = _label_rows(model, utter_ids, view)
+        model.save(directory, fingerprint)
+    else:
+        labels = pq.read_table(labels_path).to_pandas() if os.path.exists(labels_path) else \
+            pd.DataFrame(columns=["utter_id", "micro", "cluster", "score"])
+        labels = labels[labels["utter_id"].isin(set(utter_ids))]
+        new = ~pd.Series(utter_ids).isin(set(labels["utter_id"])).to_numpy()
+        logger.info(f"Assigning {int(new.sum())} new utterances to {model.num_topics} existing topics")
+        if new.any():
+            new_labels = _label_rows(model, [u for u, n in zip(utter_ids, new) if n], EmbeddingView(store, rows[new]))
+            labels = pd.concat([labels, new_labels], ignore_index=True)
+        labels = labels.sort_values("utter_id", kind="stable").reset_index(drop=True)
+
+    tmp_path = labels_path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(labels, preserve_index=False), tmp_path)
+    os.replace(tmp_path, labels_path)
+    with open(os.path.join(directory, SUMMARY_FILE), "w", encoding="utf-8") as f:
+        json.dump(summarize(labels, store_dir), f, ensure_ascii=False, indent=2)
+    logger.info(f"Clustered {len(labels)} utterances into {model.num_topics} topics")
+    return labels
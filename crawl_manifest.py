@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+MANIFEST_FILE = "crawl_manifest.sqlite"
+MANIFEST_LOCK_TIMEOUT = 60
+
+STATUS_CONVERTED = "converted"
+STATUS_NOT_MODIFIED = "not_modified"
+STATUS_UNCHANGED = "unchanged"
+STATUS_FAILED = "failed"
+DONE_STATUSES = (STATUS_CONVERTED, STATUS_NOT_MODIFIED, STATUS_UNCHANGED)
+
+
+class CrawlManifest:
+    """
+    Durable record of every document the crawler has seen, keyed by document id,
+    plus the per-knesset high-water mark of the sessions already crawled.
+    """
+
+    def __init__(self, path: str = MANIFEST_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        # shard workers in other processes write to the same manifest, wait for their transactions
+        self.conn = sqlite3.connect(path, timeout=MANIFEST_LOCK_TIMEOUT, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    doc_id TEXT PRIMARY KEY,
+                    source_url TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    content_hash TEXT,
+                    converter_version TEXT,
+                    status TEXT,
+                    meta TEXT,
+                    updated_at TEXT
+                )""")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS high_water_marks (
+                    knesset INTEGER PRIMARY KEY,
+                    last_updated TEXT
+                )""")
+
+    def get(self, doc_id: str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, doc_id: str, status: str, **fields):
+        """Insert or update a document entry, fields that are not passed keep their stored value."""
+        fields["status"] = status
+        fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        if "meta" in fields:
+            fields["meta"] = json.dumps(fields["meta"], ensure_ascii=False)
+        columns = ", ".join(["doc_id", *fields])
+        placeholders = ", ".join("?" * (len(fields) + 1))
+        updates = ", ".join(f"{c} = excluded.{c}" for c in fields)
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO documents ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT(doc_id) DO UPDATE SET {updates}",
+                (doc_id, *fields.values()))
+
+    def conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry is None or entry["status"] not in DONE_STATUSES:
+            return headers
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def documents_with_status(self, status: str) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM documents WHERE status = ?", (status,)).fetchall()
+        entries = [dict(row) for row in rows]
+        for entry in entries:
+            entry["meta"] = json.loads(entry["meta"]) if entry["meta"] else None
+        return entries
+
+    def get_high_water_mark(self, knesset: int):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_updated FROM high_water_marks WHERE knesset = ?", (knesset,)).fetchone()
+        return row["last_updated"] if row else None
+
+    def set_high_water_mark(self, knesset: int, last_updated: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO high_water_marks (knesset, last_updated) VALUES (?, ?) "
+                "ON CONFLICT(knesset) DO UPDATE SET last_updated = excluded.last_updated",
+                (knesset, last_updated))
+
+    def close(self):
+        self.conn.close()
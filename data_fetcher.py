@@ -4,50 +4,82 @@ import json
 from urllib.parse import urlparse
 import re
 import requests_cache
-from subprocess import run
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import hashlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from logger_config import get_logger
+from metrics import metrics
+from crawl_manifest import CrawlManifest, MANIFEST_FILE, STATUS_CONVERTED, STATUS_FAILED, STATUS_NOT_MODIFIED, STATUS_UNCHANGED
+from doc_converter import ConversionPool, ConverterFailure, SCRATCH_ROOT
+from odata_crawler import (ODataCrawler, ODATA_BASE_URI, MAX_DOC_WORKERS, MAX_PAGE_WORKERS, REQUESTS_PER_SECOND_PER_HOST,
+                           build_pooled_session, retryable_http_error)
+from retry_policy import RetryPolicy, circuit_breaker
+from UtterancesExtraction.mk_name_index import ROLES_FILE
 
 CACHE_FILE = "knesset_cache.sqlite"
 TEMP_RESOURCE_FOLDER = "temp"
 OUTPUT_FOLDER = "committee_data"
 FILE_BUFFER_SIZE = 8192
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
 COMMITTEE_SESSION_STR = "KNS_DocumentCommitteeSession"
 COMMITTEE_URI = "https://knesset.gov.il/OdataV4/ParliamentInfo/?committee_id"
-COMMITTEE_SESSION_COUNT_URI = "https://knesset.gov.il/OdataV4/ParliamentInfo/KNS_CommitteeSession?$filter=KnessetNum eq ~knesset_num~ &$count=true&$top=0"
 COMMITTEES_DATA_URI = "https://knesset.gov.il/OdataV4/ParliamentInfo/KNS_Committee?committee_id"
 
-requests_cache.install_cache(CACHE_FILE, backend='sqlite', expire_after=3600)
-MAX_CAST_TRIES_FOR_DOC = 10
+MAX_DOWNLOAD_TRIES = 5
+MAX_CONVERSION_TRIES = 3
+# all conversions go through the one local pool, so it is a single breaker endpoint
+CONVERTER_ENDPOINT = "converter"
+DOWNLOAD_RETRY = RetryPolicy("download", MAX_DOWNLOAD_TRIES, retryable=retryable_http_error)
+# a document the converter can not read fails the same way every time, it is dead-lettered on the first try
+# and counts as a success on the converter's breaker; crashes, timeouts and start failures are retried
+CONVERSION_RETRY = RetryPolicy("conversion", MAX_CONVERSION_TRIES,
+                               retryable=lambda error: isinstance(error, ConverterFailure))
+DEAD_LETTER_WORKERS = 8
+CONVERTER_WORKERS = int(os.getenv("CONVERTER_WORKERS", "4"))
+CONVERSION_POOL = None
+CONVERSION_POOL_LOCK = threading.Lock()
+MANIFEST = None
+MANIFEST_LOCK = threading.Lock()
 COMMITTEES = {}
-MKS = {}
+MKS_FILE = "mks_data.json"
 logger = get_logger(__name__)
 
 
-def read_doc_as_txt(doc: str, to_save_txt: bool):
-    # todo: install on setup+move to docker
-    cmd = [
-        "soffice.com",
-        "--convert-to",
-        "txt:Text (encoded):UTF8",
-        "--outdir",
-        TEMP_RESOURCE_FOLDER,
-        doc,
-    ]
-    run(cmd, check=True)
+def get_conversion_pool() -> ConversionPool:
+    global CONVERSION_POOL
+    with CONVERSION_POOL_LOCK:
+        if CONVERSION_POOL is None:
+            CONVERSION_POOL = ConversionPool(workers=CONVERTER_WORKERS).start()
+    return CONVERSION_POOL
 
-    doc_path = Path(doc)
-    txt_doc_path = doc_path.stem + ".txt"
-    output_file = Path(os.path.join(TEMP_RESOURCE_FOLDER, txt_doc_path))
 
-    with open(output_file, "r", encoding="utf-8") as f:
-        text_content = f.read()
+def close_conversion_pool():
+    global CONVERSION_POOL
+    with CONVERSION_POOL_LOCK:
+        if CONVERSION_POOL is not None:
+            CONVERSION_POOL.close()
+            CONVERSION_POOL = None
 
-    if not to_save_txt:
-        output_file.unlink(missing_ok=True)
+
+def get_manifest() -> CrawlManifest:
+    global MANIFEST
+    with MANIFEST_LOCK:
+        if MANIFEST is None:
+            MANIFEST = CrawlManifest(MANIFEST_FILE)
+    return MANIFEST
+
+
+def read_doc_as_txt(doc_name: str, doc_stream, to_save_txt: bool):
+    text_content = get_conversion_pool().convert_stream(doc_name, doc_stream)
+
+    if to_save_txt:
+        output_file = Path(TEMP_RESOURCE_FOLDER) / (Path(doc_name).stem + ".txt")
+        output_file.write_text(text_content, encoding="utf-8")
 
     return text_content
 
@@ -74,7 +106,7 @@ def save_doc_as_json(text: str, meta: dict, knesset_num: int, out_path: str):
     }
 
     with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+        json.dump(data, f, ensure_ascii=False)
 
 
 def get_committees_data():
@@ -85,62 +117,116 @@ def get_committees_data():
     return COMMITTEES
 
 
-def read_resource_from_remote(uri: str):
+def read_resource_from_remote(uri: str, crawler: ODataCrawler = None, headers: dict = None):
+    """
+    Streams the document body into memory, spilling to a temp file only above SPOOL_MAX_BYTES.
+    Returns the file name, the spooled file object (positioned at its start), the content hash
+    and the response validators, or None when the server answered 304 Not Modified.
+    """
     cleaned_url = re.sub(r'(?<!:)//', '/', uri)
 
-    with requests_cache.disabled():
-        response = requests.get(cleaned_url)
+    if crawler is not None:
+        response = crawler.download(cleaned_url, headers=headers)
+    else:
+        with requests_cache.disabled():
+            response = requests.get(cleaned_url, stream=True, headers=headers)
 
-    file_name = os.path.basename(urlparse(cleaned_url).path)
-    current_path = os.path.join(TEMP_RESOURCE_FOLDER, file_name)
+    if response.status_code == 304:
+        response.close()
+        return None
+    if not response.ok:
+        # an error page must not be saved as the document
+        response.close()
+        response.raise_for_status()
 
-    with open(current_path, "wb") as f:
+    file_name = os.path.basename(urlparse(cleaned_url).path)
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, dir=SCRATCH_ROOT)
+    content_hash = hashlib.sha256()
+    try:
         for chunk in response.iter_content(chunk_size=FILE_BUFFER_SIZE):
             if chunk:
-                f.write(chunk)
-    return os.path.abspath(current_path)
-
-
-def remove_resource_after_reading(doc_path: str):
-    if os.path.exists(doc_path):
-        try:
-            os.remove(doc_path)
-            return True
-        except OSError as e:
-            logger.error(f"Error removing file {doc_path}: {e}")
-    return False
+                spool.write(chunk)
+                content_hash.update(chunk)
+    except Exception:
+        spool.close()
+        raise
+    finally:
+        response.close()
+    spool.seek(0)
+    validators = {"etag": response.headers.get("ETag"),
+                  "last_modified": response.headers.get("Last-Modified")}
+    return file_name, spool, content_hash.hexdigest(), validators
 
 
-def process_document(doc, committee_name, date, knesset,  force_refresh: bool, to_save_txt, tries=0):
+def process_document(doc, committee_name, date, knesset,  force_refresh: bool, to_save_txt, crawler: ODataCrawler = None,
+                     output_dir: str = OUTPUT_FOLDER):
+    """
+    Downloads and converts one protocol. Download and conversion are retried separately,
+    a conversion retry converts the bytes already downloaded. A document that still fails
+    is recorded as STATUS_FAILED with what is needed to retry it, see retry_dead_letters.
+    """
     doc["CommitteeName"] = committee_name
     doc["SessionDate"] = date
-    doc_path = ""
+    doc_stream = None
+    doc_id = Path(urlparse(doc["FilePath"]).path).stem
+    manifest = get_manifest()
+    stage = "download"
     try:
-        out_path = extract_json_path(doc, output_dir=OUTPUT_FOLDER)
-        if force_refresh or not os.path.exists(out_path):
-            doc_path = read_resource_from_remote(doc["FilePath"])
-            text = read_doc_as_txt(doc_path, to_save_txt)
-            save_doc_as_json(text, doc, knesset, out_path)
+        out_path = extract_json_path(doc, output_dir=output_dir)
+        out_exists = os.path.exists(out_path)
+        entry = manifest.get(doc_id)
+        if entry is None and out_exists and not force_refresh:
+            # converted by a run that predates the manifest
+            metrics.inc("documents_total", status="skipped")
+            return
+
+        headers = manifest.conditional_headers(
+            entry) if out_exists and not force_refresh else {}
+        with metrics.timer("download_seconds"):
+            resource = DOWNLOAD_RETRY.run(lambda: read_resource_from_remote(doc["FilePath"], crawler, headers),
+                                          circuit_breaker(urlparse(doc["FilePath"]).netloc))
+        if resource is None:
+            manifest.record(doc_id, STATUS_NOT_MODIFIED)
+            metrics.inc("documents_total", status=STATUS_NOT_MODIFIED)
+            return
+
+        doc_name, doc_stream, content_hash, validators = resource
+        converter_version = get_conversion_pool().backend_version
+        if (not force_refresh and out_exists and entry is not None
+                and entry["content_hash"] == content_hash
+                and entry["converter_version"] == converter_version):
+            manifest.record(doc_id, STATUS_UNCHANGED, **validators)
+            metrics.inc("documents_total", status=STATUS_UNCHANGED)
+            return
+
+        stage = "conversion"
+        text = CONVERSION_RETRY.run(lambda: read_doc_as_txt(doc_name, doc_stream, to_save_txt),
+                                    circuit_breaker(CONVERTER_ENDPOINT))
+        save_doc_as_json(text, doc, knesset, out_path)
+        manifest.record(doc_id, STATUS_CONVERTED, source_url=doc["FilePath"], content_hash=content_hash,
+                        converter_version=converter_version, **validators)
+        metrics.inc("documents_total", status=STATUS_CONVERTED)
     except Exception as e:
-        if tries < MAX_CAST_TRIES_FOR_DOC:
-            logger.info(
-                f"Error processing {doc['FilePath']}, Trying Again. {e}")
-            process_document(doc, committee_name, date,
-                             knesset, force_refresh, to_save_txt, tries=tries+1)
-        else:
-            logger.error(f"Error processing {doc['FilePath']} OUT OF TRIES")
+        logger.error(f"Error processing {doc['FilePath']}, {stage} failed for good, dead-lettered: {e}")
+        metrics.inc("documents_total", status=STATUS_FAILED)
+        metrics.inc("dead_letters_total", stage=stage)
+        manifest.record(doc_id, STATUS_FAILED, source_url=doc["FilePath"],
+                        meta={"doc": doc, "committee_name": committee_name, "date": date, "knesset": knesset,
+                              "output_dir": output_dir, "stage": stage, "error": f"{type(e).__name__}: {e}"})
     finally:
-        remove_resource_after_reading(doc_path)
+        if doc_stream is not None:
+            doc_stream.close()
 
 
-def fetch_MKs_data(knesset: int):
+def fetch_MKs_data(knesset: int, file_path=MKS_FILE):
     uri_for_person_id = f"""https://knesset.gov.il/OdataV4/ParliamentInfo/KNS_PersonToPosition?
     $filter=KnessetNum%20eq%20{knesset}%20
     and%20FactionName%20ne%20null&$expand=KNS_Person"""
     res = requests.get(uri_for_person_id)
     mks_list = res.json()['value']
+    mks = {}
     for mk in mks_list:
-        MKS[mk["PersonID"]] = {
+        mks[mk["PersonID"]] = {
             "Id": mk["KNS_Person"]["Id"],
             # saave only first name,
             "FirstName": mk["KNS_Person"]["FirstName"],
@@ -150,11 +236,39 @@ def fetch_MKs_data(knesset: int):
         }
 
     # Save MKs data to a JSON file for reference
-    save_mks_to_file(MKS)
-    return MKS
+    save_mks_to_file(mks, file_path)
+    return mks
+
+
+def fetch_MK_roles(knesset: int, file_path=ROLES_FILE):
+    """
+    Knesset-wide role titles (ministers, deputy ministers) to the person holding them,
+    so speakers written only by their role can still be resolved.
+    """
+    uri_for_roles = f"""https://knesset.gov.il/OdataV4/ParliamentInfo/KNS_PersonToPosition?
+    $filter=KnessetNum%20eq%20{knesset}%20
+    and%20GovMinistryName%20ne%20null"""
+    res = requests.get(uri_for_roles)
+    res.raise_for_status()
+    roles = {}
+    started = {}
+    for position in res.json()['value']:
+        title = position.get("DutyDesc") or "שר " + \
+            position["GovMinistryName"].replace("משרד ", "", 1)
+        start_date = position.get("StartDate") or ""
+        # the latest holder of the role wins
+        for alias in (title, "ה" + title):
+            if start_date >= started.get(alias, ""):
+                roles[alias] = str(position["PersonID"])
+                started[alias] = start_date
 
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(roles, f, ensure_ascii=False, indent=2)
+    logger.info(f"{len(roles)} MK roles saved to {file_path}")
+    return roles
 
-def save_mks_to_file(mks_data, file_path="mks_data.json"):
+
+def save_mks_to_file(mks_data, file_path=MKS_FILE):
     """
     Save the MKs data to a JSON file for reference by other modules.
 
@@ -167,65 +281,106 @@ def save_mks_to_file(mks_data, file_path="mks_data.json"):
     logger.info(f"MKs data saved to {file_path}")
 
 
-def fetch_all_committees_from_knesset(knesset: int, force_refresh: bool, to_save_txt: bool):
-    # TODO: figure out threads here
-    # Add debug parameter with default False
-    debug = os.getenv('DEBUG', 'false').lower() == 'true'
-    page_size = 50
-    skip = 0
+def build_crawler(base_uri: str = ODATA_BASE_URI, requests_per_second: float = REQUESTS_PER_SECOND_PER_HOST) -> ODataCrawler:
+    # OData pages go through the installed requests_cache, documents are always downloaded fresh;
+    # both pools are sized for every page and document thread, so keep-alive connections are reused
+    pool_size = MAX_PAGE_WORKERS + MAX_DOC_WORKERS
+    session = build_pooled_session(pool_size)
+    with requests_cache.disabled():
+        download_session = build_pooled_session(pool_size)
+    return ODataCrawler(base_uri=base_uri, session=session, download_session=download_session,
+                        requests_per_second=requests_per_second)
 
-    while True:
-        logger.debug(
-            f"Fetching committee sessions from Knesset {knesset}: skip={skip}, limit={page_size}")
 
-        is_end = fetch_paginated_committees_from_knesset(
-            knesset, page_size, skip, force_refresh, to_save_txt)
+def document_jobs_for_session(session: dict, knesset: int, force_refresh: bool, to_save_txt: bool, crawler: ODataCrawler,
+                              output_dir: str = OUTPUT_FOLDER):
+    committee_name = COMMITTEES.get(session["CommitteeID"], {}).get(
+        "Name", "unknown_committee")
+    date = session.get("StartDate", None)
 
-        if not is_end or debug:
-            break
+    for doc in session.get(COMMITTEE_SESSION_STR, []):
+        if doc['ApplicationDesc'] == 'DOC' and doc["GroupTypeID"] == 23:
+            yield process_document, (doc, committee_name, date, knesset, force_refresh, to_save_txt, crawler, output_dir)
 
-        skip += page_size
+
+def fetch_all_committees_from_knesset(knesset: int, force_refresh: bool, to_save_txt: bool, crawler: ODataCrawler = None):
+    # Add debug parameter with default False
+    debug = os.getenv('DEBUG', 'false').lower() == 'true'
+    crawler = crawler or build_crawler()
+    manifest = get_manifest()
+    since = None if force_refresh else manifest.get_high_water_mark(knesset)
+    if since:
+        logger.info(
+            f"Incremental crawl of Knesset {knesset}: sessions updated after {since}")
+
+    sessions_seen = crawler.crawl(
+        knesset,
+        lambda session: document_jobs_for_session(
+            session, knesset, force_refresh, to_save_txt, crawler),
+        max_pages=1 if debug else None,
+        since=since)
+    logger.info(
+        f"Finished crawling {sessions_seen} committee sessions of Knesset {knesset}")
+
+    # a partial crawl must not move the mark, or the pages we missed would never be revisited
+    if not debug and crawler.failed_pages == 0 and crawler.max_last_updated:
+        manifest.set_high_water_mark(knesset, max(
+            crawler.max_last_updated, since or ""))
 
     if debug:
         logger.info("Debug mode: Only fetched first page")
 
 
-def build_committees_uri(knesset: int, top: int, skip: int):
-    expand_part = "$expand=KNS_CmtSessionItem%2CKNS_DocumentCommitteeSession"
-    filter_part = f"$filter=KnessetNum%20eq%20{knesset}"
-    pagination_part = f"$top={top}&$skip={skip}&$orderby=ID"
-    return f"https://knesset.gov.il/OdataV4/ParliamentInfo/KNS_CommitteeSession?{filter_part}&{expand_part}&{pagination_part}"
-
-
-def fetch_paginated_committees_from_knesset(knesset: int, top: int, skip: int, force_refresh: bool, to_save_txt: bool) -> bool:
-    uri = build_committees_uri(knesset, top, skip)
-    response = requests.get(uri)
-    committees_data = response.json()['value']
-    if len(committees_data) == 0:
-        return False
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        futures = []
-        for session in committees_data:
-            committee_name = COMMITTEES[session["CommitteeID"]].get(
-                "Name", "unknown_committee")
-            date = session.get("StartDate", None)
-
-            if COMMITTEE_SESSION_STR in session:
-                for doc in session[COMMITTEE_SESSION_STR]:
-                    if doc['ApplicationDesc'] == 'DOC' and doc["GroupTypeID"] == 23:
-                        futures.append(executor.submit(
-                            process_document, doc, committee_name, date, knesset, force_refresh, to_save_txt))
-
-        for future in as_completed(futures):
+def fetch_shard(knesset: int, scope: dict, output_dir: str, force_refresh=False, to_save_txt=False,
+                crawler: ODataCrawler = None) -> int:
+    """
+    Downloads the documents of one shard's sessions into output_dir.
+    Shards are re-crawled whole and leave the Knesset's high-water mark alone, unchanged documents
+    are still skipped through the manifest.
+    """
+    crawler = crawler or build_crawler()
+    os.makedirs(output_dir, exist_ok=True)
+    sessions_seen = crawler.crawl(
+        knesset,
+        lambda session: document_jobs_for_session(
+            session, knesset, force_refresh, to_save_txt, crawler, output_dir),
+        scope=scope)
+    if crawler.failed_pages:
+        raise RuntimeError(f"{crawler.failed_pages} session pages of Knesset {knesset} {scope} failed")
+    return sessions_seen
+
+
+def dead_letters(stage: str = None) -> list:
+    """Manifest entries of the documents that failed for good, of one stage (download/conversion) or all."""
+    return [entry for entry in get_manifest().documents_with_status(STATUS_FAILED)
+            if entry["meta"] and (stage is None or entry["meta"].get("stage") == stage)]
+
+
+def retry_dead_letters(stage: str = None, crawler: ODataCrawler = None, to_save_txt=False) -> dict:
+    """Processes the dead-lettered documents again, returns how many ended in each status."""
+    entries = dead_letters(stage)
+    if not entries:
+        return {}
+    crawler = crawler or build_crawler()
+    logger.info(f"Retrying {len(entries)} dead-lettered documents")
+    with ThreadPoolExecutor(max_workers=DEAD_LETTER_WORKERS) as executor:
+        futures = [executor.submit(process_document, meta["doc"], meta["committee_name"], meta["date"],
+                                   meta["knesset"], False, to_save_txt, crawler,
+                                   meta.get("output_dir", OUTPUT_FOLDER))
+                   for meta in (entry["meta"] for entry in entries)]
+        for future in futures:
             future.result()
-            # try:
-            #     future.result()
-            # except Exception as e:
-            #     logger.error(f"Thread raised exception: {e}")
-    return True
+    manifest = get_manifest()
+    return dict(Counter(manifest.get(entry["doc_id"])["status"] for entry in entries))
+
+
+def install_http_cache():
+    # process wide, every plain requests call goes through it from here on; importing this module does not
+    requests_cache.install_cache(CACHE_FILE, backend='sqlite', expire_after=3600)
 
 
 def init():
+    install_http_cache()
     get_committees_data()
     os.makedirs(TEMP_RESOURCE_FOLDER, exist_ok=True)
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
@@ -234,7 +389,17 @@ def init():
 def process_knesset_data(knesset: int, force_refresh=False, to_save_txt=False):
     init()
     fetch_MKs_data(knesset)
-    fetch_all_committees_from_knesset(knesset, force_refresh, to_save_txt)
+    try:
+        fetch_MK_roles(knesset)
+    except Exception as e:
+        # roles only add chair/minister aliases, extraction runs without them
+        fallback = "keeping the existing roles file" if os.path.exists(ROLES_FILE) else "no role aliases"
+        logger.error(f"Fetching the MK roles of Knesset {knesset} failed, {fallback}: {e}")
+        metrics.inc("roles_fetch_failures_total")
+    try:
+        fetch_all_committees_from_knesset(knesset, force_refresh, to_save_txt)
+    finally:
+        close_conversion_pool()
 
 
 if __name__ == "__main__":
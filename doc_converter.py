@@ -0,0 +1,399 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from xml.etree import ElementTree
+
+from logger_config import get_logger
+from metrics import metrics
+
+SOFFICE_CANDIDATES = ["soffice.com", "soffice", "libreoffice"]
+SOFFICE_TIMEOUT_SECONDS = 300
+DEFAULT_POOL_WORKERS = 4
+DEFAULT_BATCH_SIZE = 8
+# a job can wait for the batch ahead of it, then its own batch, then each document of it alone after a crash
+RESULT_TIMEOUT_SECONDS = SOFFICE_TIMEOUT_SECONDS * (DEFAULT_BATCH_SIZE + 2)
+BATCH_WAIT_SECONDS = 0.05
+TXT_FILTER = "txt:Text (encoded):UTF8"
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# per-worker scratch dirs live in memory where the OS gives us a tmpfs
+SCRATCH_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") else None
+SCRATCH_PREFIX = "converter_"
+
+logger = get_logger(__name__)
+
+
+class ConversionError(Exception):
+    pass
+
+
+class ConverterFailure(ConversionError):
+    """The converter failed, not the document: a crash, a timeout or a backend that did not start."""
+
+
+def find_soffice():
+    for candidate in SOFFICE_CANDIDATES:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+
+class ConverterBackend:
+    """
+    A converter turns a batch of documents into text.
+    Each pool worker owns its own backend instance and its own work dir.
+    """
+    name = "base"
+    version = "0"
+
+    def start(self, workdir: str):
+        pass
+
+    def convert(self, doc_paths: list, workdir: str) -> dict:
+        """Returns {doc_path: text}; documents missing from the result are counted as failed."""
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class LibreOfficeBackend(ConverterBackend):
+    name = "libreoffice"
+    version = "soffice-txt-utf8-1"
+
+    def __init__(self, binary: str = None, timeout: int = SOFFICE_TIMEOUT_SECONDS):
+        self.binary = binary or find_soffice()
+        if self.binary is None:
+            raise ConversionError("LibreOffice (soffice) was not found on PATH")
+        self.timeout = timeout
+        self.profile_dir = None
+
+    def start(self, workdir: str):
+        # an isolated profile per worker - concurrent instances sharing one profile lock each other out
+        self.profile_dir = os.path.join(workdir, "profile")
+        os.makedirs(self.profile_dir, exist_ok=True)
+
+    def convert(self, doc_paths: list, workdir: str) -> dict:
+        outdir = os.path.join(workdir, "out")
+        os.makedirs(outdir, exist_ok=True)
+        cmd = [
+            self.binary,
+            f"-env:UserInstallation={Path(self.profile_dir).absolute().as_uri()}",
+            "--headless",
+            "--convert-to",
+            TXT_FILTER,
+            "--outdir",
+            outdir,
+            *doc_paths,
+        ]
+        subprocess.run(cmd, check=True, timeout=self.timeout,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        results = {}
+        for doc_path in doc_paths:
+            output_file = Path(outdir) / (Path(doc_path).stem + ".txt")
+            if output_file.exists():
+                results[doc_path] = output_file.read_text(encoding="utf-8")
+                output_file.unlink()
+        return results
+
+    def stop(self):
+        # a crashed soffice can leave a corrupted profile behind, start the next one clean
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class PythonTextBackend(ConverterBackend):
+    """
+    Pure python fallback for when LibreOffice is missing.
+    Reads DOCX with the standard library; legacy binary DOC files are not supported.
+    """
+    name = "python-docx-xml"
+    version = "1"
+
+    def convert(self, doc_paths: list, workdir: str) -> dict:
+        results = {}
+        for doc_path in doc_paths:
+            if zipfile.is_zipfile(doc_path):
+                results[doc_path] = self.read_docx(doc_path)
+            else:
+                logger.error(
+                    f"{doc_path} is not a DOCX file, can't convert it without LibreOffice")
+        return results
+
+    @staticmethod
+    def read_docx(doc_path: str) -> str:
+        with zipfile.ZipFile(doc_path) as docx:
+            root = ElementTree.fromstring(docx.read("word/document.xml"))
+        paragraphs = []
+        for paragraph in root.iter(f"{WORD_NS}p"):
+            paragraphs.append("".join(node.text or "" for node in paragraph.iter(f"{WORD_NS}t")))
+        return "\n".join(paragraphs)
+
+
+def default_backend_factory():
+    if find_soffice() is not None:
+        return LibreOfficeBackend()
+    logger.error("LibreOffice not found, falling back to the pure python DOCX reader")
+    return PythonTextBackend()
+
+
+def remove_stale_scratch_dirs(scratch_root: str = SCRATCH_ROOT):
+    """Scratch dirs are named after the owning pid, remove the ones whose process is gone."""
+    if os.name != "posix":
+        return
+    root = scratch_root or tempfile.gettempdir()
+    for entry in os.listdir(root):
+        if not entry.startswith(SCRATCH_PREFIX):
+            continue
+        try:
+            pid = int(entry[len(SCRATCH_PREFIX):].split("_")[0])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+        except PermissionError:
+            pass
+
+
+class _Job:
+    def __init__(self, doc_path: str = None, name: str = None, stream=None):
+        self.doc_path = doc_path
+        self.name = name or (Path(doc_path).name if doc_path else None)
+        self.stream = stream
+        self.future = Future()
+
+    def materialize(self, workdir: str):
+        """Stream jobs are written into the worker scratch dir only right before conversion."""
+        if self.doc_path is not None:
+            return
+        indir = os.path.join(workdir, "in")
+        os.makedirs(indir, exist_ok=True)
+        self.doc_path = os.path.join(indir, self.name)
+        self.stream.seek(0)
+        with open(self.doc_path, "wb") as f:
+            shutil.copyfileobj(self.stream, f)
+
+    def release(self):
+        if self.stream is not None and self.doc_path is not None:
+            Path(self.doc_path).unlink(missing_ok=True)
+
+
+class ConversionPool:
+    """
+    N long-lived converter workers fed from one queue.
+    Jobs that arrive together are converted in one backend invocation (up to batch_size),
+    and a worker whose backend crashes is restarted with a fresh work dir.
+    """
+
+    def __init__(self, backend_factory=default_backend_factory, workers: int = DEFAULT_POOL_WORKERS,
+                 batch_size: int = DEFAULT_BATCH_SIZE, batch_wait: float = BATCH_WAIT_SECONDS,
+                 scratch_root: str = SCRATCH_ROOT):
+        self.backend_factory = backend_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.scratch_root = scratch_root
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.converted = 0
+        self.failed = 0
+        self.restarts = 0
+        self.started_at = None
+        self.backend_version = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        probe = self.backend_factory()
+        self.backend_version = f"{probe.name}:{probe.version}"
+        remove_stale_scratch_dirs(self.scratch_root)
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop, name=f"converter-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, doc_path: str) -> Future:
+        job = _Job(doc_path)
+        self.jobs.put(job)
+        return job.future
+
+    def convert(self, doc_path: str) -> str:
+        return self._result(self.submit(doc_path), doc_path)
+
+    def submit_stream(self, name: str, stream) -> Future:
+        """Convert a seekable binary file object (e.g. a SpooledTemporaryFile) saved as `name`."""
+        job = _Job(name=name, stream=stream)
+        self.jobs.put(job)
+        return job.future
+
+    def convert_stream(self, name: str, stream) -> str:
+        return self._result(self.submit_stream(name, stream), name)
+
+    @staticmethod
+    def _result(future: Future, name: str) -> str:
+        try:
+            return future.result(timeout=RESULT_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            # a job still in the queue is dropped by the worker, its stream is closed once we return
+            future.cancel()
+            raise ConverterFailure(f"No conversion of {name} after {RESULT_TIMEOUT_SECONDS}s") from None
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        logger.info(f"Conversion pool closed: {self.stats()}")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            elapsed = time.monotonic() - self.started_at if self.started_at else 0
+            return {
+                "converted": self.converted,
+                "failed": self.failed,
+                "restarts": self.restarts,
+                "elapsed_seconds": elapsed,
+                "conversions_per_sec": self.converted / elapsed if elapsed else 0.0,
+            }
+
+    def _next_batch(self, pending: list) -> list:
+        batch = []
+        stems = set()
+        while len(batch) < self.batch_size:
+            if pending:
+                job = pending.pop(0)
+            else:
+                try:
+                    # block for the first job only, then collect whatever else is already waiting
+                    job = self.jobs.get(timeout=None if not batch else self.batch_wait)
+                except queue.Empty:
+                    break
+            if job is None:
+                pending.append(None)
+                break
+            stem = Path(job.name).stem
+            if stem in stems:
+                # same output name would collide inside one invocation
+                pending.append(job)
+                break
+            if not job.future.set_running_or_notify_cancel():
+                # its caller timed out and cancelled it
+                continue
+            stems.add(stem)
+            batch.append(job)
+        return batch
+
+    def _start_backend(self, workdir: str):
+        backend = self.backend_factory()
+        backend.start(workdir)
+        self.backend_version = f"{backend.name}:{backend.version}"
+        return backend
+
+    def _try_start_backend(self, workdir: str, batch: list):
+        """A started backend, or None after failing the batch's jobs when it does not start."""
+        try:
+            return self._start_backend(workdir)
+        except Exception as e:
+            logger.error(f"Converter backend failed to start, failing a batch of {len(batch)}: {e}")
+            metrics.inc("converter_start_failures_total")
+            for job in batch:
+                job.release()
+                with self.stats_lock:
+                    self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(ConverterFailure(f"The converter could not be started: {e}"))
+            return None
+
+    def _worker_loop(self):
+        workdir = tempfile.mkdtemp(
+            prefix=f"{SCRATCH_PREFIX}{os.getpid()}_", dir=self.scratch_root)
+        # a worker whose backend does not start keeps serving its queue, trying again on every batch
+        backend = self._try_start_backend(workdir, [])
+        pending = []
+        try:
+            while True:
+                batch = self._next_batch(pending)
+                if batch:
+                    backend = self._convert_batch(backend, batch, workdir)
+                if pending and pending[0] is None:
+                    return
+        finally:
+            if backend is not None:
+                backend.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _convert_batch(self, backend: ConverterBackend, batch: list, workdir: str) -> ConverterBackend:
+        if backend is None:
+            backend = self._try_start_backend(workdir, batch)
+            if backend is None:
+                return None
+        ready = []
+        for job in batch:
+            try:
+                job.materialize(workdir)
+            except Exception as e:
+                # an unreadable stream fails its own job, the backend is fine
+                self._fail(job, backend, ConversionError(f"Could not read {job.name}: {e}"))
+            else:
+                ready.append(job)
+        batch = ready
+        if not batch:
+            return backend
+        try:
+            with metrics.timer("conversion_batch_seconds", backend=backend.name):
+                results = backend.convert([job.doc_path for job in batch], workdir)
+        except Exception as e:
+            logger.error(
+                f"Converter {backend.name} crashed on a batch of {len(batch)}, restarting it: {e}")
+            backend.stop()
+            with self.stats_lock:
+                self.restarts += 1
+            metrics.inc("converter_restarts_total", backend=backend.name)
+            backend = self._try_start_backend(workdir, batch)
+            if backend is None:
+                return None
+            if len(batch) > 1:
+                # find the offending document instead of failing the whole batch
+                for job in batch:
+                    backend = self._convert_batch(backend, [job], workdir)
+            else:
+                self._fail(batch[0], backend,
+                           ConverterFailure(f"{backend.name} crashed converting {batch[0].name}: {e}"))
+            return backend
+
+        for job in batch:
+            text = results.get(job.doc_path)
+            if text is None:
+                self._fail(job, backend, ConversionError(f"{backend.name} failed to convert {job.doc_path}"))
+            else:
+                job.release()
+                with self.stats_lock:
+                    self.converted += 1
+                metrics.inc("conversions_total", backend=backend.name, result="converted")
+                job.future.set_result(text)
+        return backend
+
+    def _fail(self, job: _Job, backend: ConverterBackend, error: ConversionError):
+        job.release()
+        with self.stats_lock:
+            self.failed += 1
+        metrics.inc("conversions_total", backend=backend.name, result="failed")
+        job.future.set_exception(error)
@@ -1,86 +1,98 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-
-from sklearn.decomposition import PCA
-import plotly.express as px
-import pandas as pd
 import os
 import numpy as np
+import pyarrow.compute as pc
 import json
-import faiss
-from faiss import IndexFlatIP
 from logger_config import get_logger
-
-model = SentenceTransformer(
-    'sentence-transformers/paraphrase-multilingual-mpnet-base-v2',
-)
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+from embedding_store import EMBEDDING_STORE_DIR, EmbeddingStore, peak_rss_mb
+from model_registry import get_model, register_model
+from vector_index import DEFAULT_EF_SEARCH, DEFAULT_NPROBE, set_search_params
+from clustering import cluster_embeddings
+from utterance_graph import SAMPLE_SIZE, graph_utterances
+
+MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+# known without loading the model, so stages that only read the store never load it
+MODEL_DIM = 768
+SEARCH_K = 100
+MK_UTTERANCES_FILE = "mk_utterances.jsonl"
+# float16 halves the embedding store on disk and in page cache
+EMBEDDING_DTYPE = os.environ.get("EMBEDDING_DTYPE", "float32")
 logger = get_logger(__name__)
 
 
-def _load_utternaces_to_vector_space(dir: str) -> list:
-    utterances = []
-    mk_utternces = {}
-    mk_for_df = []
-    for file in os.listdir(dir):
-        filepath = os.path.join(dir, file)
-        with open(filepath, "r", encoding="utf-8") as file_content:
-            utterances_obj = json.loads(file_content.read())
-
-            for speaker_key, values in utterances_obj["utterances"].items():
-                if (mk_utternces.get(speaker_key) is None):
-                    mk_utternces[speaker_key] = {
-                        "utterances": [], "metadata": values["metadata"], "sentiment": {}}
-
-                mk_utternces[speaker_key]["utterances"] += values["utterances"]
-                committee_prefixed_utterances = [
-                    f"{utterances_obj['committee']}: {u}" for u in values["utterances"]]
-                utterances += committee_prefixed_utterances
-
-                if values.get("sentiment") is not None:
-                    for prop_key, prop_val in values["sentiment"].items():
-                        if (mk_utternces[speaker_key]["sentiment"].get(prop_key) is None):
-                            mk_utternces[speaker_key]["sentiment"][prop_key] = 0
-
-                        mk_utternces[speaker_key]["sentiment"][prop_key] += prop_val
-
-                for i, u in enumerate(values["utterances"]):
-                    mk_for_df.append(
-                        {'text': u, "mk": speaker_key, "src": file, "utter_id": f"{file}_{speaker_key}_{i}"})
-
-    df = pd.DataFrame(mk_for_df)
-    df.to_pickle("utterances_data.pkl")
-    with open("mk_utterances.jsonl", "w", encoding="utf-8") as f:
-        for speaker_key, data in mk_utternces.items():
-            entry = {"speaker_key": speaker_key, **data}
+def _load_sentence_model():
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(MODEL_NAME)
+    if model.get_sentence_embedding_dimension() != MODEL_DIM:
+        raise ValueError(f"{MODEL_NAME} embeds to {model.get_sentence_embedding_dimension()} dimensions, "
+                         f"MODEL_DIM is {MODEL_DIM}")
+    return model
+
+
+register_model(MODEL_NAME, _load_sentence_model)
+
+
+def get_sentence_model():
+    """The sentence transformer, loaded on first use and shared by every caller in the process."""
+    return get_model(MODEL_NAME)
+
+
+def encode_queries(queries: list) -> np.ndarray:
+    return get_sentence_model().encode(queries, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def _utterance_texts(df) -> list:
+    # the committee prefix is part of the embedded text, and so of the content key
+    return (df["committee"] + ": " + df["text"]).tolist()
+
+
+def _load_utternaces_to_vector_space(dir: str) -> tuple:
+    # only the columns the embedder needs are read from the store
+    df = UtteranceStore(dir).read_pandas(
+        columns=["utter_id", "committee", "speaker_key", "mk_id", "faction", "text"])
+    utterances = _utterance_texts(df)
+
+    with open(MK_UTTERANCES_FILE, "w", encoding="utf-8") as f:
+        for speaker_key, group in df.groupby("speaker_key", sort=False):
+            entry = {"speaker_key": speaker_key,
+                     "metadata": {"Id": group["mk_id"].iloc[0], "FactionName": group["faction"].iloc[0]},
+                     "utterances": group["text"].tolist()}
             f.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
-    return utterances
+    return df["utter_id"].tolist(), utterances
+
 
+def get_embedding_store(root: str = EMBEDDING_STORE_DIR) -> EmbeddingStore:
+    return EmbeddingStore(MODEL_NAME, MODEL_DIM, root, dtype=EMBEDDING_DTYPE)
 
-def build_faiss_from_embeddings(embeddings: np.ndarray, force_reload: bool) -> IndexFlatIP:
-    d = embeddings.shape[1]  # get dim from embeddings
 
-    # Try to load existing index if not forcing reload
-    if not force_reload and os.path.exists("committie_index"):
-        try:
-            logger.info("Loading existing FAISS index from file...")
-            index = faiss.read_index("committie_index")
-            return index
-        except Exception as e:
-            logger.error(f"Error loading index: {e}. Building new index...")
+def embed_shard(dir: str, root: str) -> dict:
+    """Encodes one shard's utterance store into the shard's own embedding store, see sharding.merge_shards."""
+    df = UtteranceStore(dir).read_pandas(columns=["utter_id", "committee", "text"])
+    store = get_embedding_store(root)
+    try:
+        return store.sync(df["utter_id"].tolist(), _utterance_texts(df), _embed_in_vector_space)
+    finally:
+        store.close()
+
 
-    # Build new index if needed
-    logger.info("Building new FAISS index...")
-    index = faiss.IndexFlatIP(d)
-    index.add(embeddings)
-    faiss.write_index(index, "committie_index")
+def build_faiss_index(force_reload: bool = False, config: dict = None, nprobe: int = DEFAULT_NPROBE,
+                      ef_search: int = DEFAULT_EF_SEARCH):
+    """IndexIDMap2 over the embedding store, search results are store ids, see EmbeddingStore.utter_ids_for."""
+    store = get_embedding_store()
+    try:
+        index = store.load_index(force_reload, config)
+    finally:
+        store.close()
+    set_search_params(index, nprobe, ef_search)
     return index
 
 
 def _embed_in_vector_space(utternces: list) -> np.ndarray:
 
     print(f"Encoding {len(utternces)} utterances...")
-    embeddings = model.encode(utternces,
+    embeddings = get_sentence_model().encode(utternces,
                               # we want to use cosine sim in FAISS, not L2, to be faster.
                               # we also dont care about the norm, as its prone to be large as the utterance grows in length,
                               # but we dont care about that too.
@@ -90,78 +102,71 @@ def _embed_in_vector_space(utternces: list) -> np.ndarray:
                               convert_to_numpy=True,)
     print("Encoding completed!")
 
-    embeddings_array = embeddings.astype(np.float32)
-
-    np.save("embeddings.npy", embeddings_array)
-
-    return embeddings_array
-
+    return embeddings.astype(np.float32)
 
-def _graph_utterances(embeddings, sentences):
-    pca = PCA(n_components=3)
-    indices = np.random.choice(len(embeddings), 100)
-    sentences_arr = np.array(sentences)
-    embeddings_3d = pca.fit_transform(embeddings[indices])
-    cosine_sims = cosine_similarity(embeddings)
-    df = pd.DataFrame({
-        'x': embeddings_3d[:, 0],  # x coords for sentences
-        'y': embeddings_3d[:, 1],
-        'z': embeddings_3d[:, 2],
-        'text': sentences_arr[indices]
-    })
 
-    fig = px.scatter(df,  x='x', y='y', text='text',
-                     color="z", color_continuous_scale="aggrnyl")  # i dont have good area comprehnsion so this is a middle ground
-    fig.update_traces(
-        marker=dict(size=14),
-        textposition='bottom center'
-    )
-    fig.show()
-    fig.write_html("PCA_plotly_SBert.html")
+def graph(dir=UTTERANCE_STORE_DIR, config: dict = None, sample_size: int = SAMPLE_SIZE):
+    """Writes GRAPH_FILE from a stratified sample, see utterance_graph. Run after embed."""
+    index = build_faiss_index(config=config)
+    store = get_embedding_store()
+    try:
+        return graph_utterances(store, index, dir, size=sample_size)
+    finally:
+        store.close()
 
 
 def load_embeddings(dir: str, force_reload=False):
+    """
+    Only utterances the embedding store has never seen are encoded, unless force_reload.
+    The embeddings are returned as a view over the store's memory-mapped shards, not loaded into memory.
+    """
+    utter_ids, utternaces = _load_utternaces_to_vector_space(dir)
+    store = get_embedding_store()
     if force_reload:
-        utternaces = _load_utternaces_to_vector_space(dir)
-        embeddings = _embed_in_vector_space(utternaces)
-        return utternaces, embeddings
-
-    try:
-        embeddings = np.load("embeddings.npy")
-        df = pd.read_pickle("utterances_data.pkl")
-        utternaces = df["text"].tolist()
-        print(f"Loaded {len(embeddings)} embeddings from file.")
-    except FileNotFoundError:
-        print("Embeddings file not found. Generating new embeddings...")
-        utternaces = _load_utternaces_to_vector_space(dir)
-        embeddings = _embed_in_vector_space(utternaces)
+        store.clear()
+    changes = store.sync(utter_ids, utternaces, _embed_in_vector_space)
+    logger.info(f"Embedding store sync: {changes}, peak RSS {peak_rss_mb():.0f} MB")
+    embeddings = store.view(utter_ids)
+    print(f"Loaded {len(embeddings)} embeddings.")
     return utternaces, embeddings
 
 
-def embed(dir="./utterances", force_refresh=False):
+def embed(dir=UTTERANCE_STORE_DIR, force_refresh=False):
     utternaces, embeddings = load_embeddings(dir, force_refresh)
     print("done loading!")
     return utternaces, embeddings
 
-#    _graph_utterances(embeddings, utternaces)
-
 
-if __name__ == "__main__":
-    utternaces, embeddings = embed(force_refresh=False)
-    database = build_faiss_from_embeddings(embeddings)
+def cluster(dir=UTTERANCE_STORE_DIR, refit=False, config: dict = None):
+    """Topic label per utter_id, see clustering.cluster_embeddings. Run after embed."""
+    store = get_embedding_store()
+    try:
+        return cluster_embeddings(store, dir, config=config, refit=refit)
+    finally:
+        store.close()
 
-    while True:
-        query = input("search for intresting sentence: ")
 
-        query_embedding = model.encode(
-            [query], normalize_embeddings=True).astype(np.float32)
+def search(queries: list, k: int = SEARCH_K, config: dict = None, dir=UTTERANCE_STORE_DIR) -> list:
+    """The k nearest utterances of every query, as [(utter_id, score, text)] lists. Run after embed."""
+    index = build_faiss_index(config=config)
+    store = get_embedding_store()
+    try:
+        scores, ids = index.search(encode_queries(queries), k)
+        utter_ids = [store.utter_ids_for(row) for row in ids]
+    finally:
+        store.close()
+    wanted = {u for row in utter_ids for u in row if u}
+    df = UtteranceStore(dir).read_pandas(columns=["utter_id", "committee", "text"],
+                                         filter=pc.field("utter_id").isin(list(wanted)))
+    texts = dict(zip(df["utter_id"], df["committee"] + ": " + df["text"]))
+    return [[(u, float(score), texts.get(u, "")) for u, score in zip(row_ids, row_scores) if u]
+            for row_ids, row_scores in zip(utter_ids, scores)]
 
-        k = 100  # Number of nearest neighbors to retrieve
-        # No need to pre-allocate arrays, search returns them directly
-        distances, indices = database.search(query_embedding, k)
 
+if __name__ == "__main__":
+    embed(force_refresh=False)
+    while True:
+        query = input("search for intresting sentence: ")
         print("Search results:")
-        for i in range(k):
-            utternace_idx = indices[0][i]
-            print(
-                f"Match {i+1}: Index {utternace_idx}, Utterance: {utternaces[utternace_idx][::-1]}")
+        for i, (utter_id, score, text) in enumerate(search([query])[0]):
+            print(f"Match {i+1}: {utter_id}, Utterance: {text[::-1]}")
@@ -0,0 +1,411 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from logger_config import get_logger
+from metrics import metrics, peak_rss_mb
+from vector_index import (INDEX_TYPES, RETRAIN_GROWTH, IndexFile, index_config, index_ids, new_index,
+                          structure_fingerprint, supports_remove)
+
+EMBEDDING_STORE_DIR = "embedding_store"
+SHARD_ROWS = 65536
+STORAGE_DTYPES = {"float32": "f32", "float16": "f16"}
+ROWS_DB_FILE = "rows.sqlite"
+INDEX_FILE = "committie_index"
+ENCODE_CHUNK_SIZE = 4096
+BLOCK_ROWS = 16384
+# compact once this share of the matrix is rows nothing points to anymore
+COMPACT_GARBAGE_RATIO = 0.2
+# seconds a writer waits for another process's append or compaction to commit
+WRITE_LOCK_TIMEOUT = 60
+
+logger = get_logger(__name__)
+
+
+def content_key(model_name: str, text: str) -> str:
+    """text is the committee prefixed utterance, so the same words in two committees are two rows."""
+    return hashlib.sha1(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingView:
+    """
+    Embeddings of a list of utterances, read from the store's shards on demand.
+    Indexing gathers just the requested rows, iter_blocks streams everything in bounded memory.
+    """
+
+    def __init__(self, store, rows: np.ndarray):
+        self.store = store
+        self.rows = rows
+        self.shape = (len(rows), store.dim)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, indices) -> np.ndarray:
+        rows = self.rows[indices]
+        if np.ndim(rows) == 0:
+            return self.store.gather(np.array([rows]))[0]
+        return self.store.gather(rows)
+
+    def iter_blocks(self, block_rows: int = BLOCK_ROWS):
+        """Yields (start, float32 block) in utterance order."""
+        for start in range(0, len(self.rows), block_rows):
+            yield start, self.store.gather(self.rows[start:start + block_rows])
+
+
+class EmbeddingStore:
+    """
+    Embeddings keyed by content, so only utterances that were never encoded with this model are encoded.
+
+    Vectors are appended to fixed-size shard files (vectors_00000.f32, ...) of SHARD_ROWS rows each,
+    read back through read-only memory maps, so loading costs page cache and not process memory.
+    float16 storage halves disk and page cache, vectors are widened to float32 per block when read.
+    rows.sqlite maps every content key to its matrix row and every utter_id to a stable integer id,
+    that id is also the utterance's id in the FAISS index, so the index survives compaction.
+    Writers hold a BEGIN IMMEDIATE transaction from writing shard bytes until their rows commit,
+    so one process appends at a time and readers (other processes too) only see committed rows.
+    """
+
+    def __init__(self, model_name: str, dim: int, root: str = EMBEDDING_STORE_DIR, dtype: str = "float32"):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype {dtype}, expected one of {list(STORAGE_DTYPES)}")
+        self.model_name = model_name
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, ROWS_DB_FILE), timeout=WRITE_LOCK_TIMEOUT)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS vectors (content_key TEXT PRIMARY KEY, row INTEGER UNIQUE)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS utterances (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "utter_id TEXT UNIQUE, content_key TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            stored = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+            expected = {"model": model_name, "dim": str(dim), "dtype": dtype}
+            if stored and stored != expected:
+                raise ValueError(f"{root} holds {stored} embeddings, not {expected}")
+            self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", expected.items())
+        self._shards = {}
+        # shard() reads it on every gather, it is counted again when asked for a row past it,
+        # which another process committed since
+        self._rows = self._count_rows()
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * self.dtype.itemsize
+
+    def shard_path(self, shard: int) -> str:
+        return os.path.join(self.root, f"vectors_{shard:05d}.{STORAGE_DTYPES[self.dtype.name]}")
+
+    def num_rows(self) -> int:
+        return self._rows
+
+    def _count_rows(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def _refresh_rows(self, row: int):
+        if row >= self._rows:
+            self._rows = self._count_rows()
+
+    def _write_lock(self):
+        # the caller commits it with `with self.conn`, readers are not blocked (WAL)
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def _truncate_uncommitted(self, rows: int):
+        # vectors are appended before their rows are committed, a crash in between leaves a tail nothing points to.
+        # Only called under the write lock, otherwise the tail may be another writer's append in progress
+        shard = rows // SHARD_ROWS
+        path = self.shard_path(shard)
+        if os.path.exists(path) and os.path.getsize(path) > (rows % SHARD_ROWS) * self.row_bytes:
+            with open(path, "r+b") as f:
+                f.truncate((rows % SHARD_ROWS) * self.row_bytes)
+        while os.path.exists(self.shard_path(shard + 1)):
+            shard += 1
+            os.remove(self.shard_path(shard))
+
+    def shard(self, shard: int) -> np.ndarray:
+        """Read-only memory map of one shard, the last shard is remapped when it grew."""
+        self._refresh_rows(shard * SHARD_ROWS)
+        rows = min(SHARD_ROWS, self.num_rows() - shard * SHARD_ROWS)
+        cached = self._shards.get(shard)
+        if cached is None or len(cached) != rows:
+            cached = np.memmap(self.shard_path(shard), dtype=self.dtype, mode="r", shape=(rows, self.dim))
+            self._shards[shard] = cached
+        return cached
+
+    def num_shards(self) -> int:
+        return -(-self.num_rows() // SHARD_ROWS)
+
+    def gather(self, rows: np.ndarray) -> np.ndarray:
+        """float32 copy of the given matrix rows, reading every shard at most once."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows):
+            self._refresh_rows(int(rows.max()))
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        shards = rows // SHARD_ROWS
+        for shard in np.unique(shards):
+            mask = shards == shard
+            out[mask] = self.shard(int(shard))[rows[mask] % SHARD_ROWS]
+        return out
+
+    def iter_blocks(self, block_rows: int = BLOCK_ROWS):
+        """
+        Yields (first row, block) over the whole matrix in row order. float32 blocks are
+        views of the memory map, not copies; float16 blocks are widened one block at a time.
+        """
+        for shard in range(self.num_shards()):
+            vectors = self.shard(shard)
+            for start in range(0, len(vectors), block_rows):
+                block = vectors[start:start + block_rows]
+                if self.dtype != np.float32:
+                    block = block.astype(np.float32)
+                yield shard * SHARD_ROWS + start, block
+
+    def _append(self, keys: list, vectors: np.ndarray):
+        data = np.ascontiguousarray(vectors, dtype=self.dtype)
+        with self.conn:
+            self._write_lock()
+            start = self._count_rows()
+            self._truncate_uncommitted(start)
+            written = 0
+            while written < len(data):
+                row = start + written
+                take = min(len(data) - written, SHARD_ROWS - row % SHARD_ROWS)
+                with open(self.shard_path(row // SHARD_ROWS), "ab") as f:
+                    f.write(data[written:written + take].tobytes())
+                written += take
+            self.conn.executemany("INSERT INTO vectors (content_key, row) VALUES (?, ?)",
+                                  [(k, start + i) for i, k in enumerate(keys)])
+        self._rows = start + len(keys)
+
+    def sync(self, utter_ids: list, texts: list, encode) -> dict:
+        """
+        Makes the store hold exactly these utterances.
+        encode(texts) -> float32 array is only called for texts whose content key is new.
+        Returns counts of what changed.
+        """
+        keys = [content_key(self.model_name, t) for t in texts]
+        wanted = dict(zip(utter_ids, keys))
+        current = dict(self.conn.execute("SELECT utter_id, content_key FROM utterances").fetchall())
+
+        removed = [u for u, k in current.items() if wanted.get(u) != k]
+        added = [(u, k) for u, k in wanted.items() if current.get(u) != k]
+        if removed:
+            self._forget(removed)
+        with self.conn:
+            self.conn.executemany("INSERT INTO utterances (utter_id, content_key) VALUES (?, ?)", added)
+
+        known = {k for (k,) in self.conn.execute("SELECT content_key FROM vectors")}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in known and key not in missing:
+                missing[key] = text
+        missing_keys = list(missing)
+        encode_seconds = 0.0
+        for start in range(0, len(missing_keys), ENCODE_CHUNK_SIZE):
+            chunk = missing_keys[start:start + ENCODE_CHUNK_SIZE]
+            started = time.perf_counter()
+            vectors = encode([missing[k] for k in chunk])
+            seconds = time.perf_counter() - started
+            encode_seconds += seconds
+            metrics.observe("encode_chunk_seconds", seconds)
+            self._append(chunk, vectors)
+        metrics.inc("utterances_encoded_total", len(missing_keys))
+        metrics.inc("utterances_reused_total", len(wanted) - len(added))
+        if missing_keys:
+            metrics.set_gauge("encode_utterances_per_second", len(missing_keys) / max(encode_seconds, 1e-9))
+            logger.info(f"Encoded {len(missing_keys)} new utterances, {len(wanted) - len(added)} were already stored")
+
+        garbage = self.num_rows() - self.conn.execute(
+            "SELECT COUNT(DISTINCT content_key) FROM utterances").fetchone()[0]
+        if self.num_rows() and garbage / self.num_rows() > COMPACT_GARBAGE_RATIO:
+            self.compact()
+        return {"added": len(added), "removed": len(removed), "encoded": len(missing_keys)}
+
+    def import_vectors(self, other: "EmbeddingStore") -> int:
+        """
+        Copies the vectors of another store (a shard's) whose content keys this store does not have,
+        so the next sync finds them instead of encoding them again. Utterances are not copied, sync decides those.
+        """
+        if (other.model_name, other.dim) != (self.model_name, self.dim):
+            raise ValueError(f"{other.root} holds {other.model_name}/{other.dim} embeddings, "
+                             f"not {self.model_name}/{self.dim}")
+        known = {k for (k,) in self.conn.execute("SELECT content_key FROM vectors")}
+        new = [(k, r) for k, r in other.conn.execute("SELECT content_key, row FROM vectors ORDER BY row")
+               if k not in known]
+        for start in range(0, len(new), BLOCK_ROWS):
+            chunk = new[start:start + BLOCK_ROWS]
+            self._append([k for k, _ in chunk], other.gather(np.array([r for _, r in chunk], dtype=np.int64)))
+        metrics.inc("vectors_imported_total", len(new))
+        return len(new)
+
+    def _forget(self, utter_ids: list):
+        # their ids are dropped from each FAISS index the next time it is loaded
+        with self.conn:
+            self.conn.executemany("DELETE FROM utterances WHERE utter_id = ?", [(u,) for u in utter_ids])
+
+    def _select_in(self, query: str, values: list) -> list:
+        rows = []
+        # sqlite caps the number of bound parameters
+        for i in range(0, len(values), 500):
+            chunk = values[i:i + 500]
+            rows += self.conn.execute(f"{query} ({','.join('?' * len(chunk))})", chunk).fetchall()
+        return rows
+
+    def compact(self):
+        """Rewrites the shards without rows no utterance points to, row numbers change but utterance ids do not."""
+        with self.conn:
+            self._write_lock()
+            live = [k for (k,) in self.conn.execute(
+                "SELECT v.content_key FROM vectors v WHERE EXISTS "
+                "(SELECT 1 FROM utterances u WHERE u.content_key = v.content_key) ORDER BY v.row")]
+            old_rows = dict(self.conn.execute("SELECT content_key, row FROM vectors").fetchall())
+            self._rows = len(old_rows)
+            self._truncate_uncommitted(self._rows)
+            old_shards = self.num_shards()
+            tmp_paths = []
+            for shard_start in range(0, len(live), SHARD_ROWS):
+                tmp_path = self.shard_path(shard_start // SHARD_ROWS) + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    for start in range(shard_start, min(shard_start + SHARD_ROWS, len(live)), ENCODE_CHUNK_SIZE):
+                        keys = live[start:min(start + ENCODE_CHUNK_SIZE, shard_start + SHARD_ROWS)]
+                        rows = np.array([old_rows[k] for k in keys], dtype=np.int64)
+                        f.write(self.gather(rows).astype(self.dtype).tobytes())
+                tmp_paths.append(tmp_path)
+            self._shards.clear()
+            self.conn.execute("DELETE FROM vectors")
+            self.conn.executemany("INSERT INTO vectors (content_key, row) VALUES (?, ?)",
+                                  [(k, i) for i, k in enumerate(live)])
+            for tmp_path in tmp_paths:
+                os.replace(tmp_path, tmp_path[:-len(".tmp")])
+            for shard in range(len(tmp_paths), old_shards):
+                os.remove(self.shard_path(shard))
+        self._rows = len(live)
+        logger.info(f"Compacted embedding store from {len(old_rows)} to {len(live)} rows")
+
+    def rows_for(self, utter_ids: list) -> np.ndarray:
+        rows = dict(self._select_in(
+            "SELECT u.utter_id, v.row FROM utterances u JOIN vectors v ON u.content_key = v.content_key "
+            "WHERE u.utter_id IN", utter_ids))
+        return np.array([rows[u] for u in utter_ids], dtype=np.int64)
+
+    def vectors_for(self, utter_ids: list) -> np.ndarray:
+        """float32 copy of the embeddings of utter_ids, in their order."""
+        return self.gather(self.rows_for(utter_ids))
+
+    def view(self, utter_ids: list) -> EmbeddingView:
+        """The embeddings of utter_ids without reading any of them yet."""
+        return EmbeddingView(self, self.rows_for(utter_ids))
+
+    def embedded(self, utter_ids: list) -> list:
+        """The utter_ids that are in the store, in their order."""
+        found = {u for u, in self._select_in("SELECT utter_id FROM utterances WHERE utter_id IN", utter_ids)}
+        return [u for u in utter_ids if u in found]
+
+    def ids_for(self, utter_ids: list) -> np.ndarray:
+        ids = dict(self._select_in("SELECT utter_id, id FROM utterances WHERE utter_id IN", utter_ids))
+        return np.array([ids[u] for u in utter_ids], dtype=np.int64)
+
+    def utterance_rows(self) -> tuple:
+        """(utter_ids, matrix row of each) for every utterance in the store, ordered by utter_id."""
+        pairs = self.conn.execute(
+            "SELECT u.utter_id, v.row FROM utterances u JOIN vectors v ON u.content_key = v.content_key "
+            "ORDER BY u.utter_id").fetchall()
+        return [u for u, _ in pairs], np.array([r for _, r in pairs], dtype=np.int64)
+
+    def id_map(self) -> dict:
+        """{utter_id: FAISS id} of every utterance in the store."""
+        return dict(self.conn.execute("SELECT utter_id, id FROM utterances").fetchall())
+
+    def utter_ids_for(self, ids) -> list:
+        """Maps FAISS result ids back to utter_ids, -1 (no result) maps to None."""
+        found = dict(self._select_in("SELECT id, utter_id FROM utterances WHERE id IN",
+                                     [int(i) for i in ids if i >= 0]))
+        return [found.get(int(i)) for i in ids]
+
+    def index_path(self, index_type: str) -> str:
+        return os.path.join(self.root, f"{INDEX_FILE}_{index_type}")
+
+    def load_index(self, force_reload: bool = False, config: dict = None, seed: int = 0):
+        """
+        The FAISS index of the store, ids are the stable utterance ids.
+        The saved index is reused when its sidecar matches the model, storage and index config:
+        ids no longer in the store are removed and only new utterances are added.
+        It is rebuilt when anything else changed, when an HNSW index would need removals,
+        or when an IVF index grew RETRAIN_GROWTH times past the rows its centroids were trained on.
+        """
+        config = config or index_config()
+        index_file = IndexFile(self.index_path(config["type"]))
+        fingerprint = structure_fingerprint(self.model_name, self.dim, self.dtype.name, config)
+        index, meta = (None, {}) if force_reload else index_file.load(fingerprint)
+        wanted = dict(self.conn.execute(
+            "SELECT u.id, v.row FROM utterances u JOIN vectors v ON u.content_key = v.content_key").fetchall())
+        trained_rows = meta.get("trained_rows", 0)
+
+        present = np.empty(0, dtype=np.int64)
+        stale = np.empty(0, dtype=np.int64)
+        if index is not None:
+            present = index_ids(index)
+            stale = np.setdiff1d(present, np.fromiter(wanted, dtype=np.int64, count=len(wanted)))
+            if len(stale) and not supports_remove(index):
+                logger.info(f"{len(stale)} utterances left the store, HNSW can not remove them, rebuilding")
+                index = None
+            elif config["type"].startswith("ivf") and len(wanted) > RETRAIN_GROWTH * max(trained_rows, 1):
+                logger.info(f"Index grew from {trained_rows} to {len(wanted)} rows, retraining")
+                index = None
+
+        changed = False
+        if index is None:
+            all_rows = np.fromiter(wanted.values(), dtype=np.int64, count=len(wanted))
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(all_rows, min(config["train_size"], len(all_rows)), replace=False))
+            index = new_index(config, self.dim, self.gather(sample), rows=len(wanted))
+            trained_rows = len(wanted)
+            present = np.empty(0, dtype=np.int64)
+            changed = True
+        elif len(stale):
+            index.remove_ids(stale)
+            changed = True
+
+        pending = sorted(set(wanted) - set(present.tolist()))
+        if pending:
+            logger.info(f"Adding {len(pending)} utterances to the FAISS index of {index.ntotal}")
+            ids = np.array(pending, dtype=np.int64)
+            for start in range(0, len(ids), BLOCK_ROWS):
+                chunk = ids[start:start + BLOCK_ROWS]
+                index.add_with_ids(self.gather([wanted[int(i)] for i in chunk]), chunk)
+            changed = True
+        if changed:
+            index_file.save(index, fingerprint, config, trained_rows)
+        return index
+
+    def num_shards_on_disk(self) -> int:
+        shard = 0
+        while os.path.exists(self.shard_path(shard)):
+            shard += 1
+        return shard
+
+    def clear(self):
+        with self.conn:
+            self._write_lock()
+            self.conn.execute("DELETE FROM utterances")
+            self.conn.execute("DELETE FROM vectors")
+            self._shards.clear()
+            for path in [self.shard_path(s) for s in range(self.num_shards_on_disk())]:
+                if os.path.exists(path):
+                    os.remove(path)
+        self._rows = 0
+        for index_type in INDEX_TYPES:
+            for path in (self.index_path(index_type), self.index_path(index_type) + ".json"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def close(self):
+        self._shards.clear()
+        self.conn.close()
@@ -2,7 +2,7 @@ import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
 from heb_to_eng_translator import HebToEngTranslator
-import json
+from utterance_store import UtteranceStore, build_filter
 from datetime import datetime
 import sys
 from pathlib import Path
@@ -11,7 +11,8 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 
-FILE = project_root / "utterances" / "utterances_25_ptv_1525067.json"
+STORE_DIR = project_root / "utterance_store"
+DOC_ID = "25_ptv_1525067"
 
 # embed all translated utterances from given file with some generic transformer and measure cosine sim to original.
 
@@ -21,29 +22,29 @@ def compare_translators() -> dict:
     libre_trans = HebToEngTranslator()
     model = SentenceTransformer(
         'sentence-transformers/distiluse-base-multilingual-cased-v2')
-    with open(FILE, "r", encoding="utf-8") as f:
-        meeting = json.load(f)
+    # only this protocol's text column is read from the store
+    utterances = UtteranceStore(str(STORE_DIR)).read(
+        columns=["text"], filter=build_filter(doc_id=DOC_ID)).column("text").to_pylist()
     translators = {
         "google": {"resolver": google_trans.translate, "scores": []},
         "libre": {"resolver": libre_trans.translate, "scores": []}}
     number_of_utterances = 0
-    for _, mk_data in meeting["utterances"].items():
-        for utterance in mk_data["utterances"]:
-            number_of_utterances += 1
-            orig_embedding = model.encode(utterance, convert_to_tensor=True)
-            for translator in translators:
-
-                sentence_translated = translators[translator]["resolver"](
-                    utterance)
-                # convert to tensor to allow working with pytorch (as we already have it from hugggingface transformers)
-
-                translated_embedding = model.encode(
-                    sentence_translated, convert_to_tensor=True)
-                # hack to allow for one sample batch, no need for  parallelism
-                similarity = torch.nn.functional.cosine_similarity(
-                    orig_embedding.unsqueeze(0), translated_embedding.unsqueeze(0), dim=1).item()
-
-                translators[translator]["scores"].append(similarity)
+    for utterance in utterances:
+        number_of_utterances += 1
+        orig_embedding = model.encode(utterance, convert_to_tensor=True)
+        for translator in translators:
+
+            sentence_translated = translators[translator]["resolver"](
+                utterance)
+            # convert to tensor to allow working with pytorch (as we already have it from hugggingface transformers)
+
+            translated_embedding = model.encode(
+                sentence_translated, convert_to_tensor=True)
+            # hack to allow for one sample batch, no need for  parallelism
+            similarity = torch.nn.functional.cosine_similarity(
+                orig_embedding.unsqueeze(0), translated_embedding.unsqueeze(0), dim=1).item()
+
+            translators[translator]["scores"].append(similarity)
 
     for _, t in translators.items():
         scores_np = np.array(t["scores"], dtype=np.float32)
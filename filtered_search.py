@@ -0,0 +1,189 @@
+import json
+import math
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from logger_config import get_logger
+
+CODED_FIELDS = ["speaker_key", "mk_id", "faction", "committee", "doc_id"]
+# postfilter while k / selectivity (times the margin) stays below this many results, prefilter beyond it
+POSTFILTER_MAX_FETCH = 500
+POSTFILTER_MARGIN = 2.0
+# subsets this small are searched exactly in their own flat sub-index
+PARTITION_MAX_ROWS = 20_000
+PARTITION_CACHE_SIZE = 64
+HNSW_MAX_EF_SEARCH = 4096
+
+logger = get_logger(__name__)
+
+
+def date_code(values: np.ndarray) -> np.ndarray:
+    """yyyymmdd as int32, 0 when the date is missing."""
+    dates = pd.to_datetime(pd.Series(values), errors="coerce")
+    codes = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+    return codes.fillna(0).to_numpy(dtype=np.int32)
+
+
+def filter_key(filters: dict) -> str:
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False)
+
+
+class MetadataCodes:
+    """
+    Every filterable column as one compact int array per row (dictionary codes, dates as yyyymmdd),
+    so a filter becomes a few vectorized comparisons instead of a pass over python objects.
+    """
+
+    def __init__(self, columns: dict, ids: np.ndarray):
+        self.ids = ids
+        self.codes = {}
+        self.vocab = {}
+        for field in CODED_FIELDS:
+            codes, uniques = pd.factorize(pd.Series(columns[field]), use_na_sentinel=True)
+            self.codes[field] = codes.astype(np.int32)
+            self.vocab[field] = {value: i for i, value in enumerate(uniques)}
+        self.dates = date_code(columns["date"])
+        self.bitmap_size = int(ids.max()) + 1 if len(ids) else 0
+        self.position = np.full(self.bitmap_size, -1, dtype=np.int64)
+        self.position[ids] = np.arange(len(ids))
+
+    def positions(self, ids: np.ndarray) -> np.ndarray:
+        """Row of every FAISS id, -1 for ids that are not in the metadata (or -1 results)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        valid = (ids >= 0) & (ids < self.bitmap_size)
+        out = np.full(ids.shape, -1, dtype=np.int64)
+        out[valid] = self.position[ids[valid]]
+        return out
+
+    def mask(self, filters: dict):
+        """Rows matching every filter, None when there is nothing to filter on."""
+        if not filters:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field in CODED_FIELDS:
+            value = filters.get(field)
+            if value is not None:
+                code = self.vocab[field].get(value)
+                if code is None:
+                    return np.zeros(len(self.ids), dtype=bool)
+                mask &= self.codes[field] == code
+        if filters.get("date_from"):
+            mask &= self.dates >= date_code(np.array([filters["date_from"]]))[0]
+        if filters.get("date_to"):
+            mask &= self.dates <= date_code(np.array([filters["date_to"]]))[0]
+        return mask
+
+    def selector(self, mask: np.ndarray):
+        """IDSelectorBitmap over the FAISS ids of the masked rows, returned with the bits it points into."""
+        bitmap = np.zeros(self.bitmap_size, dtype=bool)
+        bitmap[self.ids[mask]] = True
+        bits = np.packbits(bitmap, bitorder="little")
+        return faiss.IDSelectorBitmap(self.bitmap_size, faiss.swig_ptr(bits)), bits
+
+
+def choose_strategy(matching: int, total: int, k: int) -> tuple:
+    """("postfilter", results to fetch), ("partition", None) or ("prefilter", None) from the filter's selectivity."""
+    if matching == 0:
+        return "empty", 0
+    selectivity = matching / total
+    fetch = math.ceil(k / selectivity * POSTFILTER_MARGIN)
+    if fetch <= POSTFILTER_MAX_FETCH:
+        return "postfilter", fetch
+    if matching <= PARTITION_MAX_ROWS:
+        return "partition", None
+    return "prefilter", None
+
+
+def search_parameters(index, selector, selectivity: float, k: int, nprobe: int = None, ef_search: int = None):
+    """Selector search parameters, widened so a selective filter still fills k results."""
+    inner = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+    if isinstance(inner, faiss.IndexIVF):
+        base = nprobe or inner.nprobe
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(inner.nlist, math.ceil(base / selectivity)))
+    if isinstance(inner, faiss.IndexHNSW):
+        base = ef_search or inner.hnsw.efSearch
+        return faiss.SearchParametersHNSW(sel=selector,
+                                          efSearch=min(HNSW_MAX_EF_SEARCH, max(base, math.ceil(k / selectivity))))
+    return faiss.SearchParameters(sel=selector)
+
+
+class FilteredSearcher:
+    """
+    Filtered k-NN over an IndexIDMap2:
+    broad filters search unfiltered and drop non matching results (postfilter),
+    narrow ones restrict the search itself with an IDSelector (prefilter),
+    and subsets of at most PARTITION_MAX_ROWS rows get an exact flat sub-index of their own, cached per filter.
+    """
+
+    def __init__(self, index, codes: MetadataCodes):
+        self.index = index
+        self.codes = codes
+        self.partitions = OrderedDict()
+        self.strategy_counts = {}
+
+    def _count(self, strategy: str):
+        self.strategy_counts[strategy] = self.strategy_counts.get(strategy, 0) + 1
+
+    def _partition(self, key: str, mask: np.ndarray):
+        partition = self.partitions.get(key)
+        if partition is not None:
+            self.partitions.move_to_end(key)
+            return partition
+        ids = self.codes.ids[mask]
+        try:
+            vectors = np.vstack([self.index.reconstruct(int(i)) for i in ids])
+        except RuntimeError:
+            # IVF without a direct map can not give its vectors back
+            return None
+        partition = faiss.IndexIDMap2(faiss.IndexFlatIP(self.index.d))
+        partition.add_with_ids(vectors, ids)
+        self.partitions[key] = partition
+        if len(self.partitions) > PARTITION_CACHE_SIZE:
+            self.partitions.popitem(last=False)
+        return partition
+
+    def search(self, vectors: np.ndarray, k: int, filters: dict = None) -> tuple:
+        """(scores, ids) for queries sharing one filter, ids are -1 past the last match."""
+        mask = self.codes.mask(filters)
+        if mask is None:
+            self._count("unfiltered")
+            return self.index.search(vectors, k)
+        matching = int(mask.sum())
+        strategy, fetch = choose_strategy(matching, len(mask), k)
+        self._count(strategy)
+        if strategy == "empty":
+            return np.full((len(vectors), k), -np.inf, dtype=np.float32), np.full((len(vectors), k), -1, dtype=np.int64)
+
+        if strategy == "postfilter":
+            scores, ids = self.index.search(vectors, min(fetch, self.index.ntotal))
+            scores, ids, complete = self._keep_matching(scores, ids, mask, k, matching)
+            if complete:
+                return scores, ids
+            # unlucky draw, fewer than k of the fetched results matched
+            self._count("postfilter_retry")
+            strategy = "prefilter"
+
+        if strategy == "partition":
+            partition = self._partition(filter_key(filters), mask)
+            if partition is not None:
+                return partition.search(vectors, min(k, matching))
+        # the selector points into bits, which has to stay alive until the search returns
+        selector, bits = self.codes.selector(mask)
+        params = search_parameters(self.index, selector, matching / len(mask), k)
+        return self.index.search(vectors, k, params=params)
+
+    def _keep_matching(self, scores, ids, mask, k: int, matching: int) -> tuple:
+        positions = self.codes.positions(ids)
+        keep = (positions >= 0) & mask[np.maximum(positions, 0)]
+        out_scores = np.full((len(ids), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(ids), k), -1, dtype=np.int64)
+        complete = True
+        for row in range(len(ids)):
+            kept_ids = ids[row][keep[row]][:k]
+            out_ids[row, :len(kept_ids)] = kept_ids
+            out_scores[row, :len(kept_ids)] = scores[row][keep[row]][:k]
+            complete &= len(kept_ids) >= min(k, matching)
+        return out_scores, out_ids, complete
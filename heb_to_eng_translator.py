@@ -1,16 +1,19 @@
-import requests
 from googletrans import Translator
 import subprocess
 import time
 
+from translation_client import BatchTranslationClient, LIBRE_TRANSLATE_URL
+
 
 class HebToEngTranslator:
 
-    def __init__(self, force_google=False):
+    def __init__(self, force_google=False, libre_url=LIBRE_TRANSLATE_URL):
         self.resolver = self._use_libre
         self.source_language = 'he'
         self.target_language = 'en'
         self.docker_process = None  # Store the Docker process
+        self.libre_client = BatchTranslationClient(
+            libre_url, self.source_language, self.target_language)
 #        if force_google or not self._try_to_establish_docker_img():
  #           self.gTranslator = Translator()
   #          self.resolver = self._use_google
@@ -18,6 +21,11 @@ class HebToEngTranslator:
     def translate(self, text: str) -> str:
         return self.resolver(text)
 
+    def translate_many(self, texts: list) -> list:
+        if self.resolver == self._use_libre:
+            return self.libre_client.translate_many(texts)
+        return [self.resolver(text) for text in texts]
+
     def _try_to_establish_docker_img(self):
         # Start Docker container
         # todo: pull img if not exists
@@ -31,18 +39,7 @@ class HebToEngTranslator:
         return True
 
     def _use_libre(self, text: str):
-
-        try:
-            resp = requests.post("http://localhost:5000/translate", data={
-                "q": text,
-                "source": self.source_language,
-                "target": self.target_language,
-                "format": "text"
-            }, timeout=1000)
-            return resp.json()['translatedText']
-        except Exception as e:
-            print(f"Error translating with Libre Translate: {e}")
-            return text
+        return self.libre_client.translate(text)
 
     def _use_google(self, text: str) -> str:
         try:
@@ -54,10 +51,14 @@ class HebToEngTranslator:
             return text
 
     def cleanup(self):
-        """Clean up Docker container on exit"""
+        """Clean up Docker container and the translation client on exit"""
         if self.docker_process:
             self.docker_process.terminate()
             self.docker_process = None
+        libre_client = getattr(self, "libre_client", None)
+        if libre_client is not None:
+            libre_client.close()
+            self.libre_client = None
 
     def __del__(self):
         """Ensure cleanup when object is destroyed"""
@@ -1,6 +1,75 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing.util
 import os
+import queue
 import sys
+import threading
+
+# per-file DEBUG lines still go to logs/<name>.log, the console only shows this level and up
+CONSOLE_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+
+class _Router(logging.Handler):
+    """Runs on the listener thread: writes each record to its logger's file, and to the console."""
+
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+        self.console_names = set()
+        self.console = logging.StreamHandler(sys.stdout)
+        self.console.setLevel(CONSOLE_LEVEL)
+        self.console.setFormatter(logging.Formatter('%(name)s - %(levelname)s - %(message)s'))
+
+    def emit(self, record):
+        file_handler = self.files.get(record.name)
+        if file_handler is not None and record.levelno >= file_handler.level:
+            file_handler.handle(record)
+        if record.name in self.console_names and record.levelno >= self.console.level:
+            self.console.handle(record)
+
+
+_router = _Router()
+_lock = threading.Lock()
+_state = {"pid": None, "queue": None, "listener": None}
+
+
+def _stop_listener():
+    listener = _state["listener"]
+    if listener is not None and _state["pid"] == os.getpid():
+        listener.stop()
+        _state["listener"] = None
+
+
+def _log_queue() -> queue.Queue:
+    """The queue of this process; a forked child gets its own queue and listener thread."""
+    if _state["pid"] == os.getpid():
+        return _state["queue"]
+    with _lock:
+        if _state["pid"] != os.getpid():
+            forked = _state["pid"] is not None
+            _state["queue"] = queue.SimpleQueue()
+            _state["listener"] = logging.handlers.QueueListener(_state["queue"], _router)
+            _state["listener"].start()
+            _state["pid"] = os.getpid()
+            if forked:
+                # pool workers leave through os._exit, which skips atexit but runs multiprocessing finalizers
+                multiprocessing.util.Finalize(None, _stop_listener, exitpriority=100)
+    return _state["queue"]
+
+
+atexit.register(_stop_listener)
+
+
+class _NonBlockingHandler(logging.handlers.QueueHandler):
+    """Logging calls only put the record on a queue, formatting and I/O happen on the listener thread."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def enqueue(self, record):
+        _log_queue().put_nowait(record)
 
 
 def get_logger(
@@ -26,15 +95,10 @@ def get_logger(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
+    _router.files[name] = file_handler
 
     if to_console:
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setLevel(level)
-        console_formatter = logging.Formatter(
-            '%(name)s - %(levelname)s - %(message)s'
-        )
-        console_handler.setFormatter(console_formatter)
-        logger.addHandler(console_handler)
+        _router.console_names.add(name)
 
+    logger.addHandler(_NonBlockingHandler())
     return logger
@@ -1,45 +1,427 @@
-from setminent_analayzer import analyze_sentiment
-from UtterancesExtraction.utterance_extractor import process_protocols
-from data_fetcher import process_knesset_data
-from embedder import embed
 import argparse
+import glob
+import os
+import sys
+
 from logger_config import get_logger
+from metrics import METRICS_DIR, PROFILERS, metrics
+from pipeline import Pipeline, Stage, format_plan
+from sentiment_scorers import DEFAULT_TRANSFORMER_MODEL_DIR
+from vector_index import INDEX_TYPES, index_config
+
+# every stage imports its modules (pandas, sklearn, torch, the models) when it is planned or built,
+# so --help or a fetch-only run never pays for the stages it does not run
 
 logger = get_logger(__name__)
 OUTPUT_FOLDER = "committee_data"
+MKS_FILE = "mks_data.json"
+STAGE_NAMES = ["fetch", "extract", "sentiment", "embed", "cluster", "graph"]
+COMMANDS = ["run", *STAGE_NAMES, "search", "shards", "dead-letters"]
+DEFAULT_KNESSET = 25
 
 
-def main():
-    knesset_number = 25
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--force-refresh", dest="force_refresh",
-                        action=argparse.BooleanOptionalAction)
+def _json_files(folder: str) -> list:
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f for f in os.listdir(folder) if f.endswith(".json"))
+
+
+def _store_doc_paths() -> dict:
+    from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+    return UtteranceStore(UTTERANCE_STORE_DIR).doc_paths()
+
+
+def build_pipeline(knesset_number: int, args) -> Pipeline:
+    # {doc_id: store file}, refreshed on every extract plan
+    extracted = {}
+
+    def plan_fetch():
+        return {OUTPUT_FOLDER: []}
+
+    def build_fetch(_):
+        from data_fetcher import process_knesset_data
+
+        # Step 1: Fetch and process Knesset data
+        # This will also save the MKs data to mks_data.json
+        logger.info(
+            f"started process_knesset_data with knesset {knesset_number}")
+        process_knesset_data(knesset=knesset_number,
+                             force_refresh=args.force_refresh, to_save_txt=args.save_txt)
+
+    # extract artifacts are "<store>/<doc_id>", the protocol's actual file sits under its knesset/committee partition
+    def plan_extract():
+        from utterance_store import UTTERANCE_STORE_DIR
+
+        extracted.clear()
+        extracted.update(_store_doc_paths())
+        return {os.path.join(UTTERANCE_STORE_DIR, f[:-len(".json")]): [os.path.join(OUTPUT_FOLDER, f), MKS_FILE]
+                for f in _json_files(OUTPUT_FOLDER)}
+
+    def extracted_exists(artifact):
+        return os.path.basename(artifact) in extracted
+
+    def build_extract(artifacts):
+        from UtterancesExtraction.utterance_extractor import process_protocols
+        from utterance_store import UTTERANCE_STORE_DIR
+
+        # Step 2: Process protocols to extract utterances and enrich with MKs data
+        logger.info(
+            f"started process_protocols to utterances with knesset {knesset_number}")
+        process_protocols(OUTPUT_FOLDER, UTTERANCE_STORE_DIR,
+                          file_names=[os.path.basename(a) + ".json" for a in artifacts],
+                          workers=args.workers)
+
+    def sentiment_budget() -> int:
+        from setminent_analayzer import SAMPLES_PER_MK
+        return args.sentiment_budget or SAMPLES_PER_MK
+
+    def plan_sentiment():
+        from setminent_analayzer import SENTIMENT_TABLE_FILE
+        return {SENTIMENT_TABLE_FILE: sorted(_store_doc_paths().values())}
+
+    def build_sentiment(_):
+        from setminent_analayzer import analyze_sentiment_sampled
+        from utterance_store import UTTERANCE_STORE_DIR
+
+        # Step 3: Process Agressiveness
+        logger.info(f"started analyzing santiment of utterances")
+        scorer_kwargs = {}
+        if args.sentiment_backend == "transformer":
+            scorer_kwargs = {"model_dir": args.sentiment_model_dir,
+                             "quantize": args.sentiment_int8, "use_onnx": args.sentiment_onnx}
+        analyze_sentiment_sampled(
+            UTTERANCE_STORE_DIR, budget=sentiment_budget(), backend=args.sentiment_backend, **scorer_kwargs)
+
+    index_settings = index_config(type=args.index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+
+    def model_name() -> str:
+        from embedder import MODEL_NAME
+        return MODEL_NAME
+
+    def plan_embed():
+        from embedding_store import EMBEDDING_STORE_DIR
+        return {EMBEDDING_STORE_DIR: sorted(_store_doc_paths().values())}
+
+    def build_embed(_):
+        from embedder import build_faiss_index, embed
+        from utterance_store import UTTERANCE_STORE_DIR
+
+        logger.info(f"started embedding utterances")
+        # the embedding store only encodes utterances it has not seen
+        embed(dir=UTTERANCE_STORE_DIR, force_refresh=args.force_refresh)
+        build_faiss_index(config=index_settings)
+
+    def cluster_settings() -> dict:
+        from clustering import cluster_config
+        return cluster_config(reducer=args.cluster_reducer, dim=args.cluster_dim, micro_clusters=args.micro_clusters)
+
+    def plan_cluster():
+        from clustering import CLUSTER_DIR, LABELS_FILE
+        return {os.path.join(CLUSTER_DIR, LABELS_FILE): sorted(_store_doc_paths().values())}
+
+    def build_cluster(_):
+        from embedder import cluster
+        from utterance_store import UTTERANCE_STORE_DIR
+
+        logger.info(f"started clustering utterance embeddings")
+        # a saved model only labels utterances it has not seen, unless force_refresh
+        cluster(dir=UTTERANCE_STORE_DIR, refit=args.force_refresh, config=cluster_settings())
+
+    def graph_sample() -> int:
+        from utterance_graph import SAMPLE_SIZE
+        return args.graph_sample or SAMPLE_SIZE
+
+    def plan_graph():
+        from utterance_graph import GRAPH_FILE
+        return {GRAPH_FILE: sorted(_store_doc_paths().values())}
+
+    def build_graph(_):
+        from embedder import graph
+        from utterance_store import UTTERANCE_STORE_DIR
+
+        logger.info(f"started graphing a sample of the utterance embeddings")
+        graph(dir=UTTERANCE_STORE_DIR, config=index_settings, sample_size=graph_sample())
+
+    return Pipeline([
+        Stage("fetch", plan_fetch, build_fetch, config={"knesset": knesset_number},
+              code_paths=["data_fetcher.py", "odata_crawler.py", "doc_converter.py"], always_run=True),
+        Stage("extract", plan_extract, build_extract,
+              code_paths=glob.glob("UtterancesExtraction/*.py") + ["utterance_store.py"], exists=extracted_exists),
+        Stage("sentiment", plan_sentiment, build_sentiment,
+              config=lambda: {"budget": sentiment_budget(), "backend": args.sentiment_backend,
+                              "model_dir": args.sentiment_model_dir},
+              code_paths=["setminent_analayzer.py", "sentiment_scorers.py", "heb_to_eng_translator.py"]),
+        Stage("embed", plan_embed, build_embed, config=lambda: {"model": model_name(), "index": index_settings},
+              code_paths=["embedder.py", "embedding_store.py", "vector_index.py"]),
+        Stage("cluster", plan_cluster, build_cluster,
+              config=lambda: {"model": model_name(), "cluster": cluster_settings()},
+              code_paths=["clustering.py"]),
+        Stage("graph", plan_graph, build_graph, config=lambda: {"model": model_name(), "sample": graph_sample()},
+              code_paths=["utterance_graph.py"]),
+    ], profiler=args.profile, profile_stages=args.profile_stages)
+
+
+def add_fetch_args(parser):
+    parser.add_argument("--knesset", type=int, default=DEFAULT_KNESSET,
+                        help="Knesset to fetch, the shards command processes several")
     parser.add_argument("--save-txt",
                         dest="save_txt",
                         action=argparse.BooleanOptionalAction,
                         help="Save TXT files during processing")
-    args = parser.parse_args()
+
+
+def add_extract_args(parser):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes used to extract utterances from protocols")
+
+
+def add_sentiment_args(parser):
+    parser.add_argument("--sentiment-budget", dest="sentiment_budget", type=int, default=None,
+                        help="Utterances sampled per MK for sentiment analysis, SAMPLES_PER_MK by default")
+    parser.add_argument("--sentiment-backend", dest="sentiment_backend", choices=["textblob", "transformer"],
+                        default="textblob", help="textblob translates to English first, transformer scores the Hebrew directly")
+    parser.add_argument("--sentiment-model-dir", dest="sentiment_model_dir", default=DEFAULT_TRANSFORMER_MODEL_DIR,
+                        help="Local weights of the transformer sentiment backend")
+    parser.add_argument("--sentiment-int8", dest="sentiment_int8", action="store_true",
+                        help="int8 dynamic quantization of the transformer backend")
+    parser.add_argument("--sentiment-onnx", dest="sentiment_onnx", action="store_true",
+                        help="Run the transformer backend with ONNX Runtime")
+
+
+def add_index_args(parser):
+    parser.add_argument("--index-type", dest="index_type", choices=INDEX_TYPES, default="flat",
+                        help="FAISS index built over the embeddings, see benchmarks/bench_index_recall.py")
+    parser.add_argument("--nlist", type=int, default=None,
+                        help="IVF lists, 4*sqrt(rows) capped at train_size/39 when not given")
+    parser.add_argument("--pq-m", dest="pq_m", type=int, default=None,
+                        help="IVF-PQ sub-quantizers, must divide the embedding dimension")
+    parser.add_argument("--hnsw-m", dest="hnsw_m", type=int, default=None,
+                        help="HNSW neighbours per node")
+
+
+def add_cluster_args(parser):
+    parser.add_argument("--cluster-reducer", dest="cluster_reducer", default=None,
+                        help="Projection applied before clustering, pca (default) or random")
+    parser.add_argument("--cluster-dim", dest="cluster_dim", type=int, default=None,
+                        help="Dimensions the embeddings are projected to before clustering")
+    parser.add_argument("--micro-clusters", dest="micro_clusters", type=int, default=None,
+                        help="MiniBatchKMeans clusters that HDBSCAN groups into topics")
+
+
+def add_graph_args(parser):
+    parser.add_argument("--graph-sample", dest="graph_sample", type=int, default=None,
+                        help="Utterances sampled by faction and committee for the PCA graph, SAMPLE_SIZE by default")
+
+
+STAGE_ARGS = {
+    "fetch": [add_fetch_args],
+    "extract": [add_extract_args],
+    "sentiment": [add_sentiment_args],
+    "embed": [add_index_args],
+    "cluster": [add_cluster_args],
+    "graph": [add_graph_args, add_index_args],
+}
+
+
+def add_run_args(parser, stages: list):
+    parser.add_argument("--force-refresh", dest="force_refresh",
+                        action=argparse.BooleanOptionalAction,
+                        help="Rebuild every artifact of the selected stages")
+    if len(stages) > 1:
+        parser.add_argument("--only", nargs="+", choices=STAGE_NAMES,
+                            help="Run only these stages")
+        parser.add_argument("--from", dest="start_from", choices=STAGE_NAMES,
+                            help="Run this stage and everything after it")
+    parser.add_argument("--profile", choices=PROFILERS, default=None,
+                        help="Profile stage builds, profiles are written to profiles/<stage>.prof or .html")
+    parser.add_argument("--profile-stages", dest="profile_stages", nargs="+", choices=STAGE_NAMES,
+                        help="Only profile these stages")
+    parser.add_argument("--metrics-dir", dest="metrics_dir", default=METRICS_DIR,
+                        help="Where the JSON run report and the Prometheus metrics of the run are written")
+    parser.add_argument("--dry-run", dest="dry_run", action="store_true",
+                        help="Print what would be rebuilt without running anything")
+    added = set()
+    for stage in stages:
+        for add_args in STAGE_ARGS[stage]:
+            if add_args not in added:
+                add_args(parser)
+                added.add(add_args)
+
+
+def build_parser() -> tuple:
+    parser = argparse.ArgumentParser(
+        description="Knesset committee protocols pipeline. Without a command every stage runs, like `run`.")
+    commands = parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+    run_parser = commands.add_parser("run", help="Run the pipeline, only the stale artifacts of each stage are rebuilt")
+    add_run_args(run_parser, STAGE_NAMES)
+    for stage in STAGE_NAMES:
+        add_run_args(commands.add_parser(stage, help=f"Run only the {stage} stage"), [stage])
+
+    search_parser = commands.add_parser("search", help="Nearest utterances of a query, interactive without one")
+    search_parser.add_argument("queries", nargs="*")
+    search_parser.add_argument("-k", type=int, default=None, help="Results per query")
+    add_index_args(search_parser)
+
+    dead_letters_parser = commands.add_parser(
+        "dead-letters", help="Documents whose download or conversion kept failing, and retrying them")
+    dead_letters_parser.add_argument("--stage", choices=["download", "conversion"], default=None,
+                                     help="Only the documents that failed in this stage")
+    dead_letters_parser.add_argument("--retry", action="store_true", help="Download and convert them again")
+
+    shards_parser = commands.add_parser(
+        "shards", help="Process several Knessets as shards (knesset x committee x date range) pulled from a work queue")
+    shard_commands = shards_parser.add_subparsers(dest="shard_command", required=True)
+    for name, help in (("plan", "Queue the shards of a set of Knessets and committees"),
+                       ("work", "Lease and process shards until the queue is empty, run as many as you like"),
+                       ("merge", "Merge finished shards into the global utterance store and vector index"),
+                       ("status", "Count the shards by status")):
+        shard_parser = shard_commands.add_parser(name, help=help)
+        shard_parser.add_argument("--queue", default=None, help="SQLite queue file, shared by every worker")
+        shard_parser.add_argument("--shard-dir", dest="shard_dir", default=None,
+                                  help="Folder of the per-shard outputs, shared by the workers and the merge")
+        add_shard_args[name](shard_parser)
+    return parser, run_parser
+
+
+def add_plan_args(parser):
+    parser.add_argument("--knessets", required=True, help="e.g. 16-25 or 20,23-25")
+    parser.add_argument("--committees", nargs="+", type=int, default=None,
+                        help="Committee ids, every committee of each Knesset when not given")
+    parser.add_argument("--shard-months", dest="shard_months", type=int, default=None,
+                        help="Months of sessions per shard, DEFAULT_SHARD_MONTHS by default")
+
+
+def add_work_args(parser):
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes on this machine")
+    parser.add_argument("--max-shards", dest="max_shards", type=int, default=None,
+                        help="Shards each worker takes before it exits")
+    parser.add_argument("--lease-seconds", dest="lease_seconds", type=float, default=None,
+                        help="How long a shard stays leased without a renewal, LEASE_SECONDS by default")
+    parser.add_argument("--embed", action=argparse.BooleanOptionalAction, default=True,
+                        help="Encode each shard's utterances in the worker, --no-embed leaves it to the merge")
+    parser.add_argument("--force-refresh", dest="force_refresh", action="store_true",
+                        help="Download every document of the shards again")
+    add_extract_args(parser)
+
+
+def add_merge_args(parser):
+    parser.add_argument("--embed", action=argparse.BooleanOptionalAction, default=True,
+                        help="Sync the global embedding store and FAISS index after merging")
+    add_index_args(parser)
+
+
+def add_status_args(parser):
+    parser.add_argument("--retry-failed", dest="retry_failed", action="store_true",
+                        help="Give the failed shards a fresh set of attempts")
+
+
+add_shard_args = {"plan": add_plan_args, "work": add_work_args, "merge": add_merge_args, "status": add_status_args}
+
+
+def parse_args(argv: list = None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser, run_parser = build_parser()
+    # the options of the pipeline before the stage commands existed still work without a command
+    if not argv or argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = ["run", *argv]
+    args = parser.parse_args(argv)
+    # a stage command only exposes its own options, the other stages keep their defaults
+    defaults = vars(run_parser.parse_args([]))
+    defaults.update(vars(args))
+    return argparse.Namespace(**defaults)
+
+
+def search(args):
+    from embedder import SEARCH_K, search as search_utterances
+
+    config = index_config(type=args.index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+    k = args.k or SEARCH_K
+    queries = args.queries
+    while True:
+        if not args.queries:
+            queries = [input("search for intresting sentence: ")]
+        for query, results in zip(queries, search_utterances(queries, k, config)):
+            print(f"Search results for {query}:")
+            for i, (utter_id, score, text) in enumerate(results):
+                print(f"Match {i+1}: {utter_id} ({score:.3f}), Utterance: {text[::-1]}")
+        if args.queries:
+            return
+
+
+def dead_letters(args):
+    import data_fetcher
+
+    if args.retry:
+        try:
+            print(f"Retried dead letters: {data_fetcher.retry_dead_letters(args.stage)}")
+        finally:
+            data_fetcher.close_conversion_pool()
+    entries = data_fetcher.dead_letters(args.stage)
+    for entry in entries:
+        print(f"{entry['doc_id']} ({entry['meta'].get('stage', 'unknown')}): {entry['meta'].get('error')}")
+    print(f"{len(entries)} dead-lettered documents")
+
+
+def shards(args):
+    import sharding
+    from work_queue import LEASE_SECONDS, QUEUE_FILE, ShardQueue
+
+    queue_path = args.queue or QUEUE_FILE
+    root = args.shard_dir or sharding.SHARD_DIR
+    if args.shard_command == "work":
+        sharding.run_workers(args.processes, queue_path=queue_path, root=root, max_shards=args.max_shards,
+                             embed=args.embed, extract_workers=args.workers,
+                             lease_seconds=args.lease_seconds or LEASE_SECONDS, force_refresh=args.force_refresh)
+    queue = ShardQueue(queue_path)
+    try:
+        if args.shard_command == "plan":
+            sharding.plan_shards(queue, sharding.parse_knessets(args.knessets), args.committees,
+                                 args.shard_months or sharding.DEFAULT_SHARD_MONTHS)
+        elif args.shard_command == "merge":
+            config = index_config(type=args.index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+            sharding.merge_shards(queue, root, config=config, embed=args.embed)
+        elif args.shard_command == "status" and args.retry_failed:
+            print(f"{queue.retry_failed()} failed shards queued again")
+        print(", ".join(f"{status}: {count}" for status, count in queue.counts().items()))
+    finally:
+        queue.close()
+
+
+def main(argv: list = None):
+    args = parse_args(argv)
+    if args.command == "search":
+        search(args)
+        return
+    if args.command == "dead-letters":
+        dead_letters(args)
+        return
+    if args.command == "shards":
+        try:
+            shards(args)
+        finally:
+            logger.info(f"Run metrics written to {metrics.write(args.metrics_dir)}")
+        return
 
     if args.force_refresh:
         logger.info("Forcing refresh of all data...")
 
-    # Step 1: Fetch and process Knesset data
-    # This will also save the MKs data to mks_data.json
-    logger.info(f"started process_knesset_data with knesset {knesset_number}")
-    process_knesset_data(knesset=knesset_number,
-                         force_refresh=args.force_refresh, to_save_txt=args.save_txt)
-
-    # Step 2: Process protocols to extract utterances and enrich with MKs data
-    logger.info(
-        f"started process_protocols to utterances with knesset {knesset_number}")
-    process_protocols(
-        OUTPUT_FOLDER, force_refresh=args.force_refresh)
-
-    # Step 3: Process Agressiveness
-    logger.info(f"started analyzing santiment of utterances")
-    analyze_sentiment(force_refresh=args.force_refresh)
-    logger.info(f"started embedding utterances")
-    embed(force_refresh=args.force_refresh)
+    only = [args.command] if args.command in STAGE_NAMES else args.only
+    pipeline = build_pipeline(args.knesset, args)
+    for stage in pipeline.select(only, args.start_from):
+        # a bad stage option fails here and not after the stages before it have run
+        try:
+            stage.config
+        except ValueError as e:
+            sys.exit(f"{stage.name}: {e}")
+    if args.dry_run:
+        print(format_plan(pipeline.explain(
+            only, args.start_from, args.force_refresh)))
+        return
+
+    try:
+        pipeline.run(only, args.start_from, args.force_refresh)
+    finally:
+        logger.info(f"Run metrics written to {metrics.write(args.metrics_dir)}")
 
 
 if __name__ == "__main__":
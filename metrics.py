@@ -0,0 +1,262 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from logger_config import get_logger
+
+METRICS_DIR = "metrics"
+RUN_REPORT_FILE = "run_report.json"
+PROMETHEUS_FILE = "metrics.prom"
+PROFILE_DIR = "profiles"
+PROFILERS = ["cprofile", "pyinstrument"]
+METRIC_PREFIX = "knesset_"
+# seconds, covers a cached lookup up to a soffice batch that hits its timeout
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PROFILE_TOP_FUNCTIONS = 25
+RSS_SAMPLE_SECONDS = 0.05
+
+logger = get_logger(__name__)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, over its whole lifetime."""
+    try:
+        import resource
+    except ImportError:  # windows
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """Resident set size right now, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _RssSampler(threading.Thread):
+    """Samples the current RSS every RSS_SAMPLE_SECONDS, peak is the largest seen while it ran."""
+
+    def __init__(self):
+        super().__init__(daemon=True, name="rss-sampler")
+        self.peak = current_rss_mb()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return self.peak
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prometheus_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> list:
+        total, out = 0, []
+        for count in self.counts:
+            total += count
+            out.append(total)
+        return out
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and latency histograms of one pipeline run, keyed by name and labels,
+    plus a record per stage (duration, peak RSS and what the counters did during it).
+    Exported as a JSON run report and in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.counters = {}
+            self.gauges = {}
+            self.histograms = {}
+            self.stages = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes the seconds spent in the block into the `name` histogram."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Records the stage's duration, counters and peak_rss_mb: the largest RSS sampled while the stage
+        ran (in this process, pool workers are not included). Where RSS can not be sampled it is the
+        process lifetime peak instead. process_peak_rss_mb is the lifetime peak, a run-level gauge.
+        """
+        with self.lock:
+            before = dict(self.counters)
+        sampler = _RssSampler() if current_rss_mb() is not None else None
+        if sampler is not None:
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            process_rss = peak_rss_mb()
+            rss = sampler.stop() if sampler is not None else process_rss
+            self.observe("stage_seconds", seconds, stage=name)
+            self.set_gauge("peak_rss_mb", rss, stage=name)
+            self.set_gauge("process_peak_rss_mb", process_rss)
+            with self.lock:
+                counted = {f"{n}{_prometheus_labels(labels)}": value - before.get((n, labels), 0)
+                           for (n, labels), value in self.counters.items() if value != before.get((n, labels), 0)}
+                self.stages.append({"stage": name, "seconds": seconds, "peak_rss_mb": rss, "counters": counted})
+            logger.info(f"Stage {name} took {seconds:.1f}s, peak RSS {rss:.0f} MB "
+                        f"(process peak {process_rss:.0f} MB), {counted}")
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "finished_at": time.time(),
+                "stages": list(self.stages),
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.gauges.items())],
+                "histograms": [{"name": n, "labels": dict(l), "count": h.count, "sum": h.sum,
+                                "buckets": dict(zip(map(str, h.buckets), h.cumulative()))}
+                               for (n, l), h in sorted(self.histograms.items())],
+            }
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({n for n, _ in series}):
+                    lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                    for (n, labels), value in sorted(series.items()):
+                        if n == name:
+                            lines.append(f"{METRIC_PREFIX}{name}{_prometheus_labels(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(h.buckets, h.cumulative()):
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{_prometheus_labels(labels, (('le', str(bound)),))} {count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_prometheus_labels(labels, (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{_prometheus_labels(labels)} {h.sum}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{_prometheus_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str = METRICS_DIR) -> str:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, RUN_REPORT_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(directory, PROMETHEUS_FILE), "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        return directory
+
+
+# one registry per process, pool workers hand what they counted back to the parent with their results
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def profiled(name: str, profiler: str = None, directory: str = PROFILE_DIR):
+    """
+    Runs the block under cProfile or pyinstrument when a profiler is given.
+    cProfile writes <directory>/<name>.prof (for snakeviz / pstats) and logs the top functions,
+    pyinstrument writes <directory>/<name>.html.
+    """
+    if profiler is None:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler}, expected one of {PROFILERS}")
+    os.makedirs(directory, exist_ok=True)
+
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            path = os.path.join(directory, f"{name}.html")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(session.output_html())
+            logger.info(f"Profile of {name} written to {path}")
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        path = os.path.join(directory, f"{name}.prof")
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        logger.info(f"Profile of {name} written to {path}\n{summary.getvalue()}")
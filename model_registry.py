@@ -0,0 +1,50 @@
+import threading
+import time
+
+from logger_config import get_logger
+from metrics import metrics
+
+logger = get_logger(__name__)
+
+_loaders = {}
+_models = {}
+# reentrant, a loader may itself ask for another model
+_lock = threading.RLock()
+
+
+def register_model(name: str, loader):
+    """`loader()` builds the model, it is only called the first time the model is asked for."""
+    with _lock:
+        _loaders[name] = loader
+
+
+def get_model(name: str, loader=None):
+    """
+    The one instance of a model in this process, loaded on first use.
+    A loader given here registers the model if it is not registered yet.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _lock:
+        if name not in _models:
+            if loader is not None:
+                _loaders.setdefault(name, loader)
+            if name not in _loaders:
+                raise KeyError(f"No model registered as {name}")
+            started = time.perf_counter()
+            _models[name] = _loaders[name]()
+            seconds = time.perf_counter() - started
+            metrics.observe("model_load_seconds", seconds, model=name)
+            logger.info(f"Loaded {name} in {seconds:.1f}s")
+        return _models[name]
+
+
+def loaded_models() -> list:
+    with _lock:
+        return list(_models)
+
+
+def unload_model(name: str):
+    with _lock:
+        _models.pop(name, None)
@@ -0,0 +1,247 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger_config import get_logger
+from metrics import metrics
+from retry_policy import RetryPolicy, circuit_breaker
+
+ODATA_BASE_URI = "https://knesset.gov.il/OdataV4/ParliamentInfo"
+COMMITTEE_SESSION_COUNT_URI = "~base~/KNS_CommitteeSession?$filter=~filter~&$count=true&$top=0"
+PAGE_SIZE = 50
+MAX_PAGE_WORKERS = 8
+MAX_DOC_WORKERS = 50
+REQUESTS_PER_SECOND_PER_HOST = 10
+MAX_HTTP_TRIES = 5
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = get_logger(__name__)
+
+
+def build_sessions_filter(knesset: int, since: str = None, scope: dict = None):
+    """
+    scope narrows the sessions to one committee ("committee_id") and/or a StartDate range,
+    "date_from" inclusive and "date_to" exclusive, that is how a shard's sessions are selected.
+    """
+    filter_part = f"KnessetNum%20eq%20{knesset}"
+    scope = scope or {}
+    if scope.get("committee_id") is not None:
+        filter_part += f"%20and%20CommitteeID%20eq%20{scope['committee_id']}"
+    if scope.get("date_from"):
+        filter_part += f"%20and%20StartDate%20ge%20{quote(scope['date_from'], safe='')}"
+    if scope.get("date_to"):
+        filter_part += f"%20and%20StartDate%20lt%20{quote(scope['date_to'], safe='')}"
+    if since:
+        # only sessions that changed after the last crawl's high-water mark
+        filter_part += f"%20and%20LastUpdatedDate%20gt%20{quote(since, safe='')}"
+    return filter_part
+
+
+def build_committees_uri(knesset: int, top: int, skip: int, base_uri: str = ODATA_BASE_URI, since: str = None,
+                         scope: dict = None):
+    expand_part = "$expand=KNS_CmtSessionItem%2CKNS_DocumentCommitteeSession"
+    filter_part = f"$filter={build_sessions_filter(knesset, since, scope)}"
+    pagination_part = f"$top={top}&$skip={skip}&$orderby=ID"
+    return f"{base_uri}/KNS_CommitteeSession?{filter_part}&{expand_part}&{pagination_part}"
+
+
+def build_committee_session_count_uri(knesset: int, base_uri: str = ODATA_BASE_URI, since: str = None,
+                                      scope: dict = None):
+    return COMMITTEE_SESSION_COUNT_URI.replace("~base~", base_uri).replace(
+        "~filter~", build_sessions_filter(knesset, since, scope))
+
+
+def build_session_dates_uri(knesset: int, order: str, base_uri: str = ODATA_BASE_URI):
+    return (f"{base_uri}/KNS_CommitteeSession?$filter={build_sessions_filter(knesset)}"
+            f"&$select=StartDate&$orderby=StartDate%20{order}&$top=1")
+
+
+def build_knesset_committees_uri(knesset: int, base_uri: str = ODATA_BASE_URI):
+    return f"{base_uri}/KNS_Committee?$filter=KnessetNum%20eq%20{knesset}&$orderby=Id"
+
+
+def retryable_http_error(error: Exception) -> bool:
+    """Connection trouble and overload answers are worth retrying, a 404 is not."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return True
+    response = getattr(error, "response", None)
+    return isinstance(error, requests.HTTPError) and response is not None \
+        and response.status_code in RETRYABLE_STATUS_CODES
+
+
+def build_pooled_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HostRateLimiter:
+    """
+    Token bucket per host, shared by all the crawler threads.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}  # host -> (tokens, last_refill)
+
+    def acquire(self, url: str):
+        if not self.rate:
+            return
+        host = urlparse(url).netloc
+        while True:
+            with self.lock:
+                tokens, last = self.buckets.get(host, (self.burst, time.monotonic()))
+                now = time.monotonic()
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self.buckets[host] = (tokens - 1, now)
+                    return
+                self.buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+
+class ODataCrawler:
+    """
+    Long-lived crawler for the Knesset OData API.
+    Plans all the page offsets up front from $count, fetches the pages with bounded concurrency
+    over keep-alive connections and feeds the document jobs into one work queue that lives for the whole run.
+    """
+
+    def __init__(self, base_uri: str = ODATA_BASE_URI, page_size: int = PAGE_SIZE,
+                 page_workers: int = MAX_PAGE_WORKERS, doc_workers: int = MAX_DOC_WORKERS,
+                 requests_per_second: float = REQUESTS_PER_SECOND_PER_HOST, max_tries: int = MAX_HTTP_TRIES,
+                 session: requests.Session = None, download_session: requests.Session = None):
+        self.base_uri = base_uri.rstrip("/")
+        self.page_size = page_size
+        self.page_workers = page_workers
+        self.doc_workers = doc_workers
+        self.max_tries = max_tries
+        pool_size = page_workers + doc_workers
+        self.session = session or build_pooled_session(pool_size)
+        self.download_session = download_session or self.session
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.retry_policy = RetryPolicy("odata", max_tries, retryable=retryable_http_error)
+        self.doc_executor = None
+        self.doc_futures = []
+        self.max_last_updated = None
+        self.failed_pages = 0
+
+    def request(self, url: str, session: requests.Session = None, tries: int = None, guarded: bool = True,
+                **kwargs) -> requests.Response:
+        """
+        GET through the host's circuit breaker, retried with backoff up to `tries` (max_tries) times.
+        guarded=False skips the breaker, for callers whose own retry policy already waits on it.
+        """
+        session = session or self.session
+
+        def attempt():
+            self.rate_limiter.acquire(url)
+            with metrics.timer("odata_request_seconds"):
+                response = session.get(url, **kwargs)
+            metrics.inc("odata_requests_total", status=response.status_code)
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                response.close()
+                raise requests.HTTPError(f"{response.status_code} for {url}", response=response)
+            response.raise_for_status()
+            return response
+
+        breaker = circuit_breaker(urlparse(url).netloc) if guarded else None
+        return self.retry_policy.run(attempt, breaker, tries)
+
+    def get_json(self, url: str) -> dict:
+        return self.request(url, timeout=60).json()
+
+    def download(self, url: str, headers: dict = None) -> requests.Response:
+        # a single attempt outside the breaker, the caller retries the download together with reading its body
+        # and waits on the host's breaker itself; waiting here too would take the half-open probe slot twice
+        return self.request(url, session=self.download_session, tries=1, guarded=False,
+                            timeout=120, stream=True, headers=headers)
+
+    def count_sessions(self, knesset: int, since: str = None, scope: dict = None) -> int:
+        res = self.get_json(build_committee_session_count_uri(knesset, self.base_uri, since, scope))
+        return int(res["@odata.count"])
+
+    def iter_values(self, url: str):
+        """Every entity of a query, following the server's @odata.nextLink paging."""
+        while url:
+            res = self.get_json(url)
+            yield from res["value"]
+            url = res.get("@odata.nextLink")
+
+    def session_date_range(self, knesset: int) -> tuple:
+        """StartDate of the first and the last committee session of a Knesset, (None, None) when it has none."""
+        first = self.get_json(build_session_dates_uri(knesset, "asc", self.base_uri))["value"]
+        last = self.get_json(build_session_dates_uri(knesset, "desc", self.base_uri))["value"]
+        if not first or not last:
+            return None, None
+        return first[0]["StartDate"], last[0]["StartDate"]
+
+    def committees(self, knesset: int) -> list:
+        return list(self.iter_values(build_knesset_committees_uri(knesset, self.base_uri)))
+
+    def plan_page_offsets(self, total: int, max_pages: int = None) -> list:
+        offsets = list(range(0, total, self.page_size))
+        if max_pages is not None:
+            offsets = offsets[:max_pages]
+        return offsets
+
+    def fetch_page(self, knesset: int, skip: int, since: str = None, scope: dict = None) -> list:
+        uri = build_committees_uri(knesset, self.page_size, skip, self.base_uri, since, scope)
+        return self.get_json(uri)["value"]
+
+    def submit(self, fn, *args):
+        self.doc_futures.append(self.doc_executor.submit(fn, *args))
+
+    def crawl(self, knesset: int, jobs_for_session, max_pages: int = None, since: str = None,
+              scope: dict = None) -> int:
+        """
+        jobs_for_session(session) yields (fn, args) tuples, each one is queued as a document job.
+        When `since` is given only sessions updated after it are crawled, `scope` limits the crawl
+        to one shard, see build_sessions_filter.
+        Returns the number of sessions seen, the newest LastUpdatedDate seen is kept in max_last_updated.
+        """
+        self.max_last_updated = None
+        self.failed_pages = 0
+        total = self.count_sessions(knesset, since, scope)
+        offsets = self.plan_page_offsets(total, max_pages)
+        logger.info(
+            f"Knesset {knesset} has {total} committee sessions, fetching {len(offsets)} pages")
+
+        sessions_seen = 0
+        self.doc_futures = []
+        with ThreadPoolExecutor(max_workers=self.doc_workers) as self.doc_executor:
+            with ThreadPoolExecutor(max_workers=self.page_workers) as page_executor:
+                page_futures = {page_executor.submit(self.fetch_page, knesset, skip, since, scope): skip
+                                for skip in offsets}
+                for future in as_completed(page_futures):
+                    try:
+                        sessions = future.result()
+                    except Exception as e:
+                        logger.error(
+                            f"Failed fetching page skip={page_futures[future]}: {e}")
+                        self.failed_pages += 1
+                        continue
+                    sessions_seen += len(sessions)
+                    for session in sessions:
+                        last_updated = session.get("LastUpdatedDate")
+                        if last_updated and (self.max_last_updated is None or last_updated > self.max_last_updated):
+                            self.max_last_updated = last_updated
+                        for fn, args in jobs_for_session(session):
+                            self.submit(fn, *args)
+
+            for future in as_completed(self.doc_futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Document job raised exception: {e}")
+        self.doc_executor = None
+        return sessions_seen
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import time
+
+from logger_config import get_logger
+from metrics import metrics, profiled
+
+LINEAGE_FILE = "pipeline_lineage.json"
+
+logger = get_logger(__name__)
+
+
+def hash_files(paths) -> str:
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def file_signature(path: str):
+    # size + mtime, like make - hashing every protocol on every run would cost more than it saves
+    try:
+        stat = os.stat(path)
+        return [path, stat.st_size, stat.st_mtime_ns]
+    except FileNotFoundError:
+        return [path, None, None]
+
+
+class Stage:
+    """
+    A pipeline step that produces artifacts, each artifact being an output path.
+
+    plan() returns {artifact_path: [input paths]} for everything the stage should produce,
+    build(artifact_paths) (re)builds the given artifacts.
+    config and code_paths are part of every artifact's fingerprint, so changing a model name
+    or the stage's code invalidates its outputs. config may be a function returning the dict,
+    it is then only called when the stage is planned, so unselected stages import nothing.
+    exists(artifact) tells whether an artifact was built, for artifacts that are not plain paths.
+    """
+
+    def __init__(self, name: str, plan, build, config: dict = None, code_paths=(), always_run=False,
+                 exists=os.path.exists):
+        self.name = name
+        self.plan = plan
+        self.build = build
+        self._config = config
+        self.code_paths = list(code_paths)
+        self.always_run = always_run
+        self.exists = exists
+        self._code_version = None
+
+    @property
+    def config(self) -> dict:
+        if callable(self._config):
+            self._config = self._config()
+        return self._config or {}
+
+    @property
+    def code_version(self) -> str:
+        if self._code_version is None:
+            self._code_version = hash_files(self.code_paths)
+        return self._code_version
+
+    def fingerprint(self, inputs: list) -> str:
+        payload = {
+            "inputs": [file_signature(p) for p in sorted(inputs)],
+            "config": self.config,
+            "code": self.code_version,
+        }
+        return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Pipeline:
+    """
+    Runs stages in order, rebuilding only their stale artifacts.
+    Every build is timed into the metrics registry; stages named in profile_stages
+    (every stage when it is None) run under `profiler` when one is given.
+    """
+
+    def __init__(self, stages: list, lineage_path: str = LINEAGE_FILE, profiler: str = None,
+                 profile_stages: list = None):
+        self.stages = stages
+        self.lineage_path = lineage_path
+        self.profiler = profiler
+        self.profile_stages = profile_stages
+        self.lineage = self._load_lineage()
+
+    def _load_lineage(self) -> dict:
+        if not os.path.exists(self.lineage_path):
+            return {}
+        with open(self.lineage_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_lineage(self):
+        tmp_path = self.lineage_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.lineage, f, ensure_ascii=False)
+        os.replace(tmp_path, self.lineage_path)
+
+    def select(self, only: list = None, start_from: str = None) -> list:
+        names = [s.name for s in self.stages]
+        for name in (only or []) + ([start_from] if start_from else []):
+            if name not in names:
+                raise ValueError(f"Unknown stage {name}, expected one of {names}")
+        if only:
+            return [s for s in self.stages if s.name in only]
+        if start_from:
+            return self.stages[names.index(start_from):]
+        return list(self.stages)
+
+    def stale_artifacts(self, stage: Stage, force: bool, upstream_pending: set = frozenset()) -> tuple:
+        """Returns (stale artifacts, all planned artifacts), an artifact is stale if anything it was built from changed."""
+        planned = stage.plan()
+        if force or stage.always_run:
+            return sorted(planned), planned
+        records = self.lineage.get(stage.name, {})
+        stale = []
+        for artifact, inputs in planned.items():
+            record = records.get(artifact)
+            if (record is None
+                    or not stage.exists(artifact)
+                    or upstream_pending.intersection(inputs)
+                    or record["fingerprint"] != stage.fingerprint(inputs)):
+                stale.append(artifact)
+        return sorted(stale), planned
+
+    def estimate_seconds(self, stage: Stage, artifacts: list):
+        records = self.lineage.get(stage.name, {})
+        durations = [r["seconds"] for r in records.values()]
+        if not durations:
+            return None
+        average = sum(durations) / len(durations)
+        return sum(records.get(a, {}).get("seconds", average) for a in artifacts)
+
+    def explain(self, only: list = None, start_from: str = None, force=False) -> list:
+        """Dry run: what each selected stage would rebuild and roughly how long it took last time."""
+        plan = []
+        pending = set()
+        for stage in self.select(only, start_from):
+            stale, planned = self.stale_artifacts(stage, force, pending)
+            pending.update(stale)
+            plan.append({
+                "stage": stage.name,
+                "stale": len(stale),
+                "total": len(planned),
+                "always_run": stage.always_run,
+                "estimated_seconds": self.estimate_seconds(stage, stale),
+                "artifacts": stale,
+            })
+        return plan
+
+    def run(self, only: list = None, start_from: str = None, force=False):
+        for stage in self.select(only, start_from):
+            stale, planned = self.stale_artifacts(stage, force)
+            metrics.set_gauge("artifacts_planned", len(planned), stage=stage.name)
+            metrics.set_gauge("artifacts_stale", len(stale), stage=stage.name)
+            if not stale:
+                logger.info(f"Stage {stage.name}: all {len(planned)} artifacts are up to date")
+                continue
+            logger.info(
+                f"Stage {stage.name}: rebuilding {len(stale)}/{len(planned)} artifacts")
+            profiler = self.profiler if self.profile_stages is None or stage.name in self.profile_stages else None
+            started = time.monotonic()
+            with metrics.stage(stage.name), profiled(stage.name, profiler):
+                stage.build(stale)
+            per_artifact = (time.monotonic() - started) / len(stale)
+
+            # fingerprint after the build - some stages rewrite their own inputs
+            replanned = stage.plan()
+            records = self.lineage.setdefault(stage.name, {})
+            for artifact in stale:
+                if artifact in replanned and stage.exists(artifact):
+                    records[artifact] = {
+                        "fingerprint": stage.fingerprint(replanned[artifact]),
+                        "seconds": per_artifact,
+                        "built_at": time.time(),
+                    }
+            for artifact in set(records) - set(replanned):
+                del records[artifact]
+            self._save_lineage()
+
+
+def format_plan(plan: list) -> str:
+    lines = []
+    for step in plan:
+        estimate = step["estimated_seconds"]
+        cost = "unknown cost" if estimate is None else f"~{estimate:.1f}s"
+        reason = " (always runs)" if step["always_run"] else ""
+        lines.append(
+            f"{step['stage']}: {step['stale']}/{step['total']} artifacts to rebuild, {cost}{reason}")
+        for artifact in step["artifacts"][:10]:
+            lines.append(f"    {artifact}")
+        if len(step["artifacts"]) > 10:
+            lines.append(f"    ... and {len(step['artifacts']) - 10} more")
+    return "\n".join(lines)
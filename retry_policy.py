@@ -0,0 +1,154 @@
+import random
+import threading
+import time
+from collections import deque
+
+from logger_config import get_logger
+from metrics import metrics
+
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 30
+# a breaker opens when at least FAILURE_RATIO of the last WINDOW_CALLS calls failed, after MIN_CALLS calls
+FAILURE_RATIO = 0.5
+WINDOW_CALLS = 20
+MIN_CALLS = 10
+OPEN_SECONDS = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+logger = get_logger(__name__)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_CAP_SECONDS) -> float:
+    # "full jitter" - spreads the retries of many threads instead of having them hit the server together
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_after_seconds(error: Exception):
+    """The Retry-After of an HTTP error response, in seconds, None when there is none."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    return int(value) if value is not None and value.isdigit() else None
+
+
+class CircuitBreaker:
+    """
+    Watches the outcome of the last calls to one endpoint (a host, the converter).
+    When too many of them failed it opens: wait() holds every caller for open_seconds instead of
+    letting them add load to an endpoint that is down. Then a single probe call goes through,
+    its success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_ratio: float = FAILURE_RATIO, window: int = WINDOW_CALLS,
+                 min_calls: int = MIN_CALLS, open_seconds: float = OPEN_SECONDS):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.condition = threading.Condition()
+
+    def wait(self):
+        """Returns once a call may be made, blocking while the breaker is open."""
+        with self.condition:
+            while True:
+                if self.state == CLOSED:
+                    return
+                now = time.monotonic()
+                if self.state == OPEN and now >= self.opened_at + self.open_seconds:
+                    self.state = HALF_OPEN
+                    self.probing = False
+                if self.state == HALF_OPEN and not self.probing:
+                    self.probing = True
+                    return
+                remaining = self.opened_at + self.open_seconds - now
+                self.condition.wait(remaining if self.state == OPEN else self.open_seconds)
+
+    def record(self, success: bool):
+        with self.condition:
+            if self.state == HALF_OPEN:
+                if success:
+                    self._set_state(CLOSED)
+                    self.outcomes.clear()
+                    logger.info(f"Circuit {self.name} closed, the probe call succeeded")
+                else:
+                    self._open()
+                return
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if (self.state == CLOSED and len(self.outcomes) >= self.min_calls
+                    and failures >= self.failure_ratio * len(self.outcomes)):
+                logger.warning(f"Circuit {self.name} opened, {failures} of the last {len(self.outcomes)} calls "
+                               f"failed, pausing calls for {self.open_seconds}s")
+                metrics.inc("circuit_opened_total", endpoint=self.name)
+                self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self.probing = False
+        self._set_state(OPEN)
+
+    def _set_state(self, state: str):
+        self.state = state
+        metrics.set_gauge("circuit_open", int(state != CLOSED), endpoint=self.name)
+        self.condition.notify_all()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """The process wide breaker of an endpoint, every thread calling it shares it."""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+class RetryPolicy:
+    """
+    Retries an operation up to max_tries times with full-jitter exponential backoff
+    (or the server's Retry-After, when longer), only for the errors retryable(error) accepts.
+    Every attempt first waits on the endpoint's circuit breaker and reports its outcome to it,
+    errors that are not retryable say nothing about the endpoint's health and count as successes.
+    """
+
+    def __init__(self, name: str, max_tries: int, retryable=None, base: float = BACKOFF_BASE_SECONDS,
+                 cap: float = BACKOFF_CAP_SECONDS):
+        self.name = name
+        self.max_tries = max_tries
+        self.retryable = retryable or (lambda error: True)
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        return max(backoff_delay(attempt, self.base, self.cap), retry_after_seconds(error) or 0)
+
+    def run(self, fn, breaker: CircuitBreaker = None, tries: int = None):
+        tries = tries or self.max_tries
+        for attempt in range(tries):
+            if breaker is not None:
+                breaker.wait()
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = self.retryable(e)
+                if breaker is not None:
+                    breaker.record(not retryable)
+                if not retryable or attempt + 1 == tries:
+                    raise
+                delay = self.delay(attempt, e)
+                metrics.inc(f"{self.name}_retries_total")
+                logger.info(f"{self.name} failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+            else:
+                if breaker is not None:
+                    breaker.record(True)
+                return result
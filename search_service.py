@@ -0,0 +1,276 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from filtered_search import FilteredSearcher, MetadataCodes, filter_key
+from logger_config import get_logger
+from translation_client import percentile
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+MAX_BATCH_SIZE = 64
+BATCH_WAIT_SECONDS = 0.005
+DEFAULT_K = 10
+MAX_K = 1000
+# a request waiting longer than this on the batcher gets a 503, it does not hold the handler thread
+SEARCH_TIMEOUT_SECONDS = 30
+METRICS_WINDOW = 10_000
+METADATA_COLUMNS = ["utter_id", "speaker_key", "mk_id", "faction", "committee", "date", "doc_id", "text"]
+
+logger = get_logger(__name__)
+
+
+class SearchMetrics:
+    def __init__(self, window: int = METRICS_WINDOW):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.latencies = deque(maxlen=window)
+        self.finished_at = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def record_batch(self, size: int):
+        with self.lock:
+            self.batch_sizes.append(size)
+
+    def record_request(self, seconds: float, ok: bool = True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+            self.latencies.append(seconds)
+            self.finished_at.append(time.monotonic())
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            recent = [t for t in self.finished_at if now - t <= 10]
+            latencies = list(self.latencies)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "uptime_seconds": now - self.started,
+                "qps_10s": len(recent) / min(10, max(now - self.started, 1e-9)),
+                "latency_ms_p50": percentile(latencies, 50) * 1000,
+                "latency_ms_p95": percentile(latencies, 95) * 1000,
+                "latency_ms_p99": percentile(latencies, 99) * 1000,
+                "batches": len(self.batch_sizes),
+                "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            }
+
+
+class UtteranceMetadata:
+    """Columns of the utterance store as numpy arrays, with compact filter codes per row."""
+
+    def __init__(self, table: dict, ids: np.ndarray):
+        self.columns = table
+        self.ids = ids
+        self.codes = MetadataCodes(table, ids)
+
+    @classmethod
+    def load(cls, id_map: dict, store_dir: str = UTTERANCE_STORE_DIR):
+        df = UtteranceStore(store_dir).read_pandas(columns=METADATA_COLUMNS)
+        df = df[df["utter_id"].isin(id_map)].reset_index(drop=True)
+        ids = df["utter_id"].map(id_map).to_numpy(dtype=np.int64)
+        return cls({c: df[c].to_numpy(dtype=object) for c in METADATA_COLUMNS}, ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rows(self, ids, scores) -> list:
+        results = []
+        for position, score in zip(self.codes.positions(ids), scores):
+            if position < 0:
+                continue
+            row = {c: self.columns[c][position] for c in METADATA_COLUMNS}
+            row["score"] = float(score)
+            results.append(row)
+        return results
+
+
+class SearchEngine:
+    """
+    Answers concurrent queries through one batching thread: queries that arrive within
+    BATCH_WAIT_SECONDS of each other share one encode call, and one index search per distinct filter.
+    """
+
+    def __init__(self, encode, index, metadata: UtteranceMetadata, max_batch_size: int = MAX_BATCH_SIZE,
+                 batch_wait: float = BATCH_WAIT_SECONDS):
+        self.encode = encode
+        self.index = index
+        self.metadata = metadata
+        self.searcher = FilteredSearcher(index, metadata.codes)
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait
+        self.metrics = SearchMetrics()
+        self.requests = queue.Queue()
+        self.closed = threading.Event()
+        self.worker = threading.Thread(target=self._run, name="search-batcher", daemon=True)
+        self.worker.start()
+
+    def search(self, query: str, k: int = DEFAULT_K, filters: dict = None) -> list:
+        future = Future()
+        self.requests.put((query, min(max(1, k), MAX_K), filters or {}, future))
+        return future.result(timeout=SEARCH_TIMEOUT_SECONDS)
+
+    def _next_batch(self) -> list:
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.requests.get(timeout=max(remaining, 0)) if remaining > 0
+                             else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self.closed.is_set():
+            batch = self._next_batch()
+            batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+            self.metrics.record_batch(len(batch))
+            try:
+                self._answer(batch)
+            except Exception as e:
+                logger.error(f"Search batch of {len(batch)} failed: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _answer(self, batch: list):
+        vectors = np.ascontiguousarray(self.encode([query for query, *_ in batch]), dtype=np.float32)
+        groups = {}
+        for row, (_, k, filters, future) in enumerate(batch):
+            groups.setdefault(filter_key(filters), []).append(row)
+        for rows in groups.values():
+            filters = batch[rows[0]][2]
+            k = max(batch[row][1] for row in rows)
+            scores, ids = self.searcher.search(vectors[rows], k, filters)
+            for row, row_scores, row_ids in zip(rows, scores, ids):
+                k = batch[row][1]
+                batch[row][3].set_result(self.metadata.rows(row_ids[:k], row_scores[:k]))
+
+    def close(self):
+        self.closed.set()
+        self.requests.put(None)
+        self.worker.join()
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    engine: SearchEngine = None
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, {**self.engine.metrics.snapshot(),
+                                  "filter_strategies": dict(self.engine.searcher.strategy_counts)})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok", "utterances": len(self.engine.metadata)})
+        else:
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self._send_json(404, {"error": f"unknown path {self.path}"})
+            return
+        started = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            query = request["query"]
+            k = request.get("k", DEFAULT_K)
+            filters = request.get("filters")
+            if not isinstance(query, str):
+                raise ValueError("query must be a string")
+            if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= MAX_K:
+                raise ValueError(f"k must be an integer from 1 to {MAX_K}")
+            if filters is not None and not isinstance(filters, dict):
+                raise ValueError("filters must be an object")
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"expected a JSON body with a query: {e}"})
+            return
+        try:
+            results = self.engine.search(query, k, filters)
+        except FutureTimeoutError:
+            self.engine.metrics.record_request(time.perf_counter() - started, ok=False)
+            self._send_json(503, {"error": f"search did not finish in {SEARCH_TIMEOUT_SECONDS}s"})
+            return
+        except Exception as e:
+            self.engine.metrics.record_request(time.perf_counter() - started, ok=False)
+            self._send_json(500, {"error": str(e)})
+            return
+        took = time.perf_counter() - started
+        self.engine.metrics.record_request(took)
+        self._send_json(200, {"results": results, "took_ms": took * 1000})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(engine: SearchEngine, host: str = SERVICE_HOST, port: int = SERVICE_PORT) -> ThreadingHTTPServer:
+    handler = type("BoundSearchHandler", (SearchHandler,), {"engine": engine})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def build_engine(index_type: str = "flat", nprobe: int = None, ef_search: int = None) -> SearchEngine:
+    """Loads the model, index and metadata once, from the embedding and utterance stores."""
+    from embedder import build_faiss_index, get_embedding_store, get_sentence_model
+    from vector_index import DEFAULT_EF_SEARCH, DEFAULT_NPROBE, index_config
+
+    index = build_faiss_index(config=index_config(type=index_type), nprobe=nprobe or DEFAULT_NPROBE,
+                              ef_search=ef_search or DEFAULT_EF_SEARCH)
+    store = get_embedding_store()
+    metadata = UtteranceMetadata.load(store.id_map())
+    store.close()
+
+    model = get_sentence_model()
+
+    def encode(texts):
+        return model.encode(texts, normalize_embeddings=True, batch_size=MAX_BATCH_SIZE, convert_to_numpy=True)
+
+    logger.info(f"Search service ready over {index.ntotal} utterances")
+    return SearchEngine(encode, index, metadata)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--index-type", dest="index_type", default="flat")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", dest="ef_search", type=int, default=None)
+    args = parser.parse_args()
+
+    engine = build_engine(args.index_type, args.nprobe, args.ef_search)
+    server = serve(engine, args.host, args.port)
+    logger.info(f"Listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import os
+
+from logger_config import get_logger
+from model_registry import get_model
+
+DEFAULT_TRANSFORMER_MODEL_DIR = os.path.join("models", "multilingual-toxic-xlm-roberta")
+TRANSFORMER_BATCH_SIZE = 32
+TRANSFORMER_MAX_LENGTH = 256
+ONNX_FILE_NAME = "model.onnx"
+
+logger = get_logger(__name__)
+
+
+class SentimentScorer:
+    """
+    Scores a list of Hebrew texts. Each backend returns one dict of named scores per text,
+    the score names become columns of the sentiment table.
+    """
+    name = "base"
+
+    def score_many(self, texts: list) -> list:
+        raise NotImplementedError
+
+
+class TextBlobScorer(SentimentScorer):
+    """Translates to English first, TextBlob only understands English."""
+    name = "textblob"
+
+    def __init__(self, translator):
+        self.translator = translator
+
+    def score_many(self, texts: list) -> list:
+        # textblob pulls in nltk, only paid for when this backend actually scores something
+        from textblob import TextBlob
+
+        scores = []
+        for en_txt in self.translator.translate_many(texts):
+            try:
+                blob = TextBlob(en_txt)
+                scores.append({"polarity": blob.polarity,
+                              "subjectivity": blob.subjectivity})
+            except Exception as e:
+                logger.error(f"Error analyzing sentiment with TextBlob: {e}")
+                scores.append({"polarity": 0.0, "subjectivity": 0.0})
+        return scores
+
+
+class TransformerScorer(SentimentScorer):
+    """
+    Multilingual classifier run directly on the Hebrew text on CPU, no translation.
+    Weights are read from a local directory only, so nothing is downloaded at run time.
+    Texts are sorted by length and batched, so each batch is padded only to its own longest text.
+    """
+    name = "transformer"
+
+    def __init__(self, model_dir: str = DEFAULT_TRANSFORMER_MODEL_DIR, batch_size: int = TRANSFORMER_BATCH_SIZE,
+                 max_length: int = TRANSFORMER_MAX_LENGTH, quantize: bool = False, use_onnx: bool = False,
+                 num_threads: int = None):
+        # heavy optional dependencies, only needed when this backend is selected
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.torch = torch
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.num_threads = num_threads or os.cpu_count()
+        torch.set_num_threads(self.num_threads)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_dir, local_files_only=True).eval()
+        self.labels = [model.config.id2label[i].lower() for i in range(model.config.num_labels)]
+
+        self.onnx_session = None
+        if use_onnx:
+            self.onnx_session = self._load_onnx(model, model_dir)
+            self.name = "transformer-onnx"
+        elif quantize:
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.name = "transformer-int8"
+        self.model = model
+
+    def _load_onnx(self, model, model_dir: str):
+        import onnxruntime
+
+        onnx_path = os.path.join(model_dir, ONNX_FILE_NAME)
+        if not os.path.exists(onnx_path):
+            logger.info(f"Exporting {model_dir} to ONNX...")
+            dummy = self.tokenizer(["שלום"], return_tensors="pt")
+            self.torch.onnx.export(
+                model, (dummy["input_ids"], dummy["attention_mask"]), onnx_path,
+                input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                dynamic_axes={"input_ids": {0: "batch", 1: "seq"},
+                              "attention_mask": {0: "batch", 1: "seq"},
+                              "logits": {0: "batch"}},
+                opset_version=14)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.num_threads
+        return onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def _logits(self, batch: list):
+        if self.onnx_session is not None:
+            encoded = self.tokenizer(batch, padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors="np")
+            logits = self.onnx_session.run(["logits"], {"input_ids": encoded["input_ids"],
+                                                        "attention_mask": encoded["attention_mask"]})[0]
+            return self.torch.from_numpy(logits)
+        encoded = self.tokenizer(batch, padding=True, truncation=True,
+                                 max_length=self.max_length, return_tensors="pt")
+        return self.model(**encoded).logits
+
+    def score_many(self, texts: list) -> list:
+        # length buckets: neighbours in the sorted order have similar lengths
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        scores = [None] * len(texts)
+        with self.torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                idx = order[start:start + self.batch_size]
+                logits = self._logits([texts[i] for i in idx])
+                if logits.shape[-1] == 1:
+                    probs = self.torch.sigmoid(logits)
+                else:
+                    probs = self.torch.softmax(logits, dim=-1)
+                for i, row in zip(idx, probs.tolist()):
+                    scores[i] = dict(zip(self.labels, row))
+        return scores
+
+
+def build_scorer(backend: str, translator=None, **kwargs) -> SentimentScorer:
+    if backend == "textblob":
+        return TextBlobScorer(translator)
+    if backend == "transformer":
+        # one loaded classifier per configuration, shared by every analyzer in the process
+        key = f"{TransformerScorer.name}:" + ",".join(f"{k}={v}" for k, v in sorted(kwargs.items()))
+        return get_model(key, lambda: TransformerScorer(**kwargs))
+    raise ValueError(f"Unknown sentiment backend {backend}")
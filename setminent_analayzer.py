@@ -1,12 +1,70 @@
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from textblob import TextBlob
+import pandas as pd
+import numpy as np
+import random
 import json
 import os
 
 from heb_to_eng_translator import HebToEngTranslator
+from sentiment_scorers import SentimentScorer, build_scorer
 from logger_config import get_logger
+from metrics import metrics
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
 
 logger = get_logger(__name__)
+SAMPLES_PER_MK = 200
+SENTIMENT_TABLE_FILE = "sentiment_table.parquet"
+MK_SENTIMENT_FILE = "mk_sentiment.parquet"
+CONFIDENCE_Z = 1.96  # 95% normal interval
+
+
+def iter_utterances(store_dir: str):
+    """Streams (utter_id, speaker_key, faction, protocol meta, text) from the utterance store, one record batch at a time."""
+    columns = ["utter_id", "speaker_key", "faction", "doc_id", "committee", "date", "text"]
+    for batch in UtteranceStore(store_dir).iter_batches(columns=columns):
+        for row in batch.to_pylist():
+            meta = {"doc_id": row["doc_id"], "committee": row["committee"], "date": row["date"]}
+            yield row["utter_id"], row["speaker_key"], row["faction"], meta, row["text"]
+
+
+def sample_utterances_per_mk(store_dir: str, budget: int = SAMPLES_PER_MK, seed: int = 0) -> tuple:
+    """
+    One pass over the corpus keeping a uniform reservoir sample of at most `budget` utterances per MK.
+    Returns (samples, total utterances seen per MK).
+    """
+    rng = random.Random(seed)
+    reservoirs = {}
+    seen = {}
+    for utter_id, speaker_key, faction, meta, text in iter_utterances(store_dir):
+        count = seen.get(speaker_key, 0) + 1
+        seen[speaker_key] = count
+        reservoir = reservoirs.setdefault(speaker_key, [])
+        row = {"utter_id": utter_id, "speaker_key": speaker_key,
+               "faction": faction, **meta, "text": text}
+        if len(reservoir) < budget:
+            reservoir.append(row)
+        else:
+            j = rng.randrange(count)
+            if j < budget:
+                reservoir[j] = row
+    samples = [row for reservoir in reservoirs.values() for row in reservoir]
+    return samples, seen
+
+
+def aggregate_mk_sentiment(table: pd.DataFrame, seen: dict, score_columns: list) -> pd.DataFrame:
+    """Per MK mean of each score with a normal-approximation confidence interval over the sample."""
+    grouped = table.groupby("speaker_key")
+    aggregations = {"faction": ("faction", "first"), "sampled": ("utter_id", "size")}
+    for score in score_columns:
+        aggregations[score] = (score, "mean")
+        aggregations[f"{score}_std"] = (score, "std")
+    summary = grouped.agg(**aggregations)
+    summary["total_utterances"] = summary.index.map(seen)
+    for score in score_columns:
+        margin = CONFIDENCE_Z * summary[f"{score}_std"].fillna(0) / np.sqrt(summary["sampled"])
+        summary[f"{score}_ci_low"] = summary[score] - margin
+        summary[f"{score}_ci_high"] = summary[score] + margin
+    return summary.reset_index()
 
 
 class SentimentAnalyzer:
@@ -15,10 +73,14 @@ class SentimentAnalyzer:
     to analyze sentiment of Hebrew text by translating it to English first.
     """
 
-    def __init__(self):
-        self.translator = HebToEngTranslator()
+    def __init__(self, backend: str = "textblob", scorer: SentimentScorer = None, **scorer_kwargs):
+        # only textblob scores English, the other backends read Hebrew and need no translation cache or client
+        self.translator = HebToEngTranslator() if backend == "textblob" else None
+        self.scorer = scorer or build_scorer(
+            backend, translator=self.translator, **scorer_kwargs)
 
     def analyze_sentiment_textblob(self, text: str):
+        from textblob import TextBlob
 
         try:
             blob = TextBlob(text)
@@ -40,8 +102,9 @@ class SentimentAnalyzer:
 
                 for key_mk, mk_data in committee["utterances"].items():
                     acc_sentiment = {"subjectivity": 0, "polarity": 0}
-                    for utterance in mk_data['utterances']:
-                        en_txt = self.translator.translate(utterance)
+                    en_txts = self.translator.translate_many(
+                        mk_data['utterances'])
+                    for en_txt in en_txts:
                         sentiment = self.analyze_sentiment_textblob(en_txt)
                         acc_sentiment["polarity"] += sentiment.polarity
                         acc_sentiment["subjectivity"] += sentiment.subjectivity
@@ -53,7 +116,7 @@ class SentimentAnalyzer:
 
                     mk_data["sentiment"] = total_sentiment
 
-                    logger.ifno(
+                    logger.info(
                         f"Finished Analyzing mk: {key_mk} with polarity: {total_sentiment['polarity']} with subjectivity: {total_sentiment['subjectivity']}")
 
                 with open(file_path, 'w', encoding='utf-8') as f:
@@ -62,16 +125,26 @@ class SentimentAnalyzer:
                 logger.info(f"Sentiment analysis saved to {file_path}")
                 return True
 
+    def score_samples(self, samples: list) -> tuple:
+        """Returns the scored table and the names of the score columns the backend produced."""
+        scores = self.scorer.score_many([row["text"] for row in samples])
+        score_columns = list(scores[0]) if scores else []
+        rows = [{**row, **score} for row, score in zip(samples, scores)]
+        return pd.DataFrame(rows), score_columns
+
     def batch_analyze_directory(self, directory_path: str, force_refresh: bool):
+        file_paths = [os.path.join(directory_path, filename)
+                      for filename in os.listdir(directory_path) if filename.endswith('.json')]
+        self.batch_analyze_files(file_paths, force_refresh)
+
+    def batch_analyze_files(self, file_paths: list, force_refresh: bool):
 
         with ThreadPoolExecutor(max_workers=10) as executor:
             futures = []
-            for filename in os.listdir(directory_path):
-                if filename.endswith('.json'):
-                    file_path = os.path.join(directory_path, filename)
-                    print(f"Analyzing {filename}...")
-                    futures.append(executor.submit(
-                        self.analyze_utterances_file, file_path, force_refresh))
+            for file_path in file_paths:
+                print(f"Analyzing {os.path.basename(file_path)}...")
+                futures.append(executor.submit(
+                    self.analyze_utterances_file, file_path, force_refresh))
 
             for future in as_completed(futures):
                 try:
@@ -80,16 +153,46 @@ class SentimentAnalyzer:
                     logger.error(f"Thread raised exception: {e}")
 
 
-def analyze_sentiment(force_refresh=False):
+def analyze_sentiment(force_refresh=False, file_paths: list = None):
     """
     Main function to demonstrate the sentiment analyzer functionality.
     """
     analyzer = SentimentAnalyzer()
     utterances_dir = "utterances"
-    if os.path.exists(utterances_dir):
+    if file_paths is not None:
+        analyzer.batch_analyze_files(file_paths, force_refresh=True)
+    elif os.path.exists(utterances_dir):
         logger.info(
             f"\n=== Analyzing utterances directory: {utterances_dir} ===")
         analyzer.batch_analyze_directory(utterances_dir, force_refresh)
+    logger.info(
+        f"Translation stats: {analyzer.translator.libre_client.stats()}")
+
+
+def analyze_sentiment_sampled(store_dir=UTTERANCE_STORE_DIR, budget: int = SAMPLES_PER_MK, seed: int = 0,
+                              table_path=SENTIMENT_TABLE_FILE, summary_path=MK_SENTIMENT_FILE,
+                              backend: str = "textblob", **scorer_kwargs) -> pd.DataFrame:
+    """
+    Scores a per-MK reservoir sample instead of the whole corpus, so translation cost grows with
+    the number of MKs and not with the number of utterances. Scores go to a separate table
+    keyed by utter_id, the utterance store is left untouched.
+    """
+    analyzer = SentimentAnalyzer(backend, **scorer_kwargs)
+    samples, seen = sample_utterances_per_mk(store_dir, budget, seed)
+    logger.info(
+        f"Sampled {len(samples)} of {sum(seen.values())} utterances for {len(seen)} MKs")
+    if not samples:
+        return pd.DataFrame()
+
+    with metrics.timer("sentiment_scoring_seconds", backend=analyzer.scorer.name):
+        table, score_columns = analyzer.score_samples(samples)
+    metrics.inc("utterances_scored_total", len(table), backend=analyzer.scorer.name)
+    table.drop(columns=["text"]).to_parquet(table_path, index=False)
+    summary = aggregate_mk_sentiment(table, seen, score_columns)
+    summary.to_parquet(summary_path, index=False)
+    translated = f", translation stats: {analyzer.translator.libre_client.stats()}" if analyzer.translator else ""
+    logger.info(f"{analyzer.scorer.name} sentiment of {len(summary)} MKs saved to {summary_path}{translated}")
+    return summary
 
 
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+from contextlib import contextmanager
+
+from logger_config import get_logger
+from metrics import metrics
+from odata_crawler import ODATA_BASE_URI, REQUESTS_PER_SECOND_PER_HOST
+from work_queue import LEASE_SECONDS, QUEUE_FILE, STATUS_DONE, ShardQueue, shard_id
+
+# every shard works in its own folder, shards/<shard_id>/{committee_data, utterance_store, embedding_store},
+# the global stores only change when shards are merged
+SHARD_DIR = "shards"
+ROSTER_DIR = "rosters"
+DEFAULT_SHARD_MONTHS = 12
+# the lease is renewed this many times per lease period, a few missed renewals do not lose it
+RENEWALS_PER_LEASE = 4
+
+logger = get_logger(__name__)
+
+
+def parse_knessets(spec: str) -> list:
+    """Expands "16-25,27" to [16, ..., 25, 27]."""
+    knessets = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        knessets.update(range(int(first), int(last or first) + 1))
+    return sorted(knessets)
+
+
+def date_windows(first: str, last: str, months: int) -> list:
+    """[date_from, date_to) windows of `months` calendar months covering the dates first..last."""
+    year, month = int(first[:4]), int(first[5:7])
+    windows = []
+    while True:
+        start = f"{year:04d}-{month:02d}-01T00:00:00"
+        if start[:10] > last[:10]:
+            return windows
+        month += months
+        year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+        windows.append((start, f"{year:04d}-{month:02d}-01T00:00:00"))
+
+
+def shard_dir(shard: str, root: str = SHARD_DIR) -> str:
+    return os.path.join(root, shard)
+
+
+def plan_shards(queue: ShardQueue, knessets: list, committee_ids: list = None, months: int = DEFAULT_SHARD_MONTHS,
+                crawler=None) -> int:
+    """
+    Queues a shard per knesset x committee x `months` long date window, from the Knesset's first
+    committee session to its last. Planning again only adds the shards that are not queued yet,
+    e.g. a new window of the current Knesset. Returns the number of shards added.
+    """
+    import data_fetcher
+
+    crawler = crawler or data_fetcher.build_crawler()
+    shards = []
+    for knesset in knessets:
+        first, last = crawler.session_date_range(knesset)
+        if first is None:
+            logger.warning(f"Knesset {knesset} has no committee sessions, nothing to plan")
+            continue
+        committees = crawler.committees(knesset)
+        if committee_ids:
+            committees = [c for c in committees if c["Id"] in committee_ids]
+        windows = date_windows(first, last, months)
+        for committee in committees:
+            for date_from, date_to in windows:
+                shards.append({"shard_id": shard_id(knesset, committee["Id"], date_from, date_to),
+                               "knesset": knesset, "committee_id": committee["Id"],
+                               "committee_name": committee.get("Name"), "date_from": date_from, "date_to": date_to})
+        logger.info(f"Knesset {knesset}: {len(committees)} committees x {len(windows)} windows from {first} to {last}")
+    added = queue.add(shards)
+    logger.info(f"Planned {len(shards)} shards, {added} of them new")
+    return added
+
+
+def load_roster(knesset: int, root: str = SHARD_DIR) -> tuple:
+    """(mks, role_aliases) of a Knesset, fetched once and kept under <root>/rosters for every shard of it."""
+    import data_fetcher
+    from UtterancesExtraction.mk_name_index import load_role_aliases
+
+    directory = os.path.join(root, ROSTER_DIR)
+    mks_path = os.path.join(directory, f"mks_{knesset}.json")
+    roles_path = os.path.join(directory, f"roles_{knesset}.json")
+    os.makedirs(directory, exist_ok=True)
+    # workers of the same Knesset may fetch at the same time, each writes its own file and renames it
+    for path, fetch in ((mks_path, data_fetcher.fetch_MKs_data), (roles_path, data_fetcher.fetch_MK_roles)):
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            fetch(knesset, file_path=tmp_path)
+            os.replace(tmp_path, path)
+    with open(mks_path, "r", encoding="utf-8") as f:
+        mks = json.load(f)
+    return mks, load_role_aliases(roles_path)
+
+
+def process_shard(shard: dict, root: str = SHARD_DIR, crawler=None, embed: bool = True, extract_workers: int = 1,
+                  force_refresh: bool = False) -> dict:
+    """Fetches, extracts and (unless embed is False) embeds one shard into its own folder."""
+    import data_fetcher
+    from UtterancesExtraction.utterance_extractor import NOT_FOUND_KEYS_FILE, process_protocols
+    from embedding_store import EMBEDDING_STORE_DIR
+    from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+
+    directory = shard_dir(shard["shard_id"], root)
+    data_dir = os.path.join(directory, data_fetcher.OUTPUT_FOLDER)
+    store_dir = os.path.join(directory, UTTERANCE_STORE_DIR)
+
+    data_fetcher.COMMITTEES[shard["committee_id"]] = {"Id": shard["committee_id"], "Name": shard["committee_name"]}
+    scope = {"committee_id": shard["committee_id"], "date_from": shard["date_from"], "date_to": shard["date_to"]}
+    sessions = data_fetcher.fetch_shard(shard["knesset"], scope, data_dir, force_refresh, crawler=crawler)
+
+    mks, role_aliases = load_roster(shard["knesset"], root)
+    # an attempt after a crash starts from an empty store, the shard's protocols are few
+    shutil.rmtree(store_dir, ignore_errors=True)
+    if os.path.isdir(data_dir):
+        process_protocols(data_dir, store_dir, force_refresh=True, workers=extract_workers, mks=mks,
+                          role_aliases=role_aliases, not_found_path=os.path.join(directory, NOT_FOUND_KEYS_FILE))
+    result = {"sessions": sessions, "protocols": len(UtteranceStore(store_dir).doc_paths())}
+
+    if embed and result["protocols"]:
+        from embedder import embed_shard
+        result.update(embed_shard(store_dir, os.path.join(directory, EMBEDDING_STORE_DIR)))
+    return result
+
+
+class _LeaseKeeper(threading.Thread):
+    def __init__(self, queue: ShardQueue, shard: str, worker: str):
+        super().__init__(daemon=True, name=f"lease-{shard}")
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.queue.lease_seconds / RENEWALS_PER_LEASE):
+            if not self.queue.renew(self.shard, self.worker):
+                self.lost = True
+                logger.warning(f"{self.worker} lost the lease of {self.shard}")
+                return
+
+
+@contextmanager
+def _kept_lease(queue: ShardQueue, shard: str, worker: str):
+    keeper = _LeaseKeeper(queue, shard, worker)
+    keeper.start()
+    try:
+        yield keeper
+    finally:
+        keeper.stopped.set()
+        keeper.join()
+
+
+def work(queue_path: str = QUEUE_FILE, root: str = SHARD_DIR, worker: str = None, max_shards: int = None,
+         embed: bool = True, extract_workers: int = 1, lease_seconds: float = LEASE_SECONDS,
+         base_uri: str = ODATA_BASE_URI, requests_per_second: float = REQUESTS_PER_SECOND_PER_HOST,
+         force_refresh: bool = False) -> int:
+    """
+    Leases and processes shards until the queue has none left (or max_shards were taken).
+    Any number of these can run against one queue, as processes here or on other machines.
+    Returns the number of shards this worker completed.
+    """
+    import data_fetcher
+
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    queue = ShardQueue(queue_path, lease_seconds)
+    crawler = data_fetcher.build_crawler(base_uri, requests_per_second)
+    os.makedirs(data_fetcher.TEMP_RESOURCE_FOLDER, exist_ok=True)
+    taken = completed = 0
+    try:
+        while max_shards is None or taken < max_shards:
+            shard = queue.lease(worker)
+            if shard is None:
+                break
+            taken += 1
+            logger.info(f"{worker} took {shard['shard_id']}, attempt {shard['attempts']}")
+            try:
+                with _kept_lease(queue, shard["shard_id"], worker) as keeper, metrics.stage("shard"):
+                    result = process_shard(shard, root, crawler, embed, extract_workers, force_refresh)
+            except Exception as e:
+                logger.exception(f"{worker} failed on {shard['shard_id']}")
+                queue.fail(shard["shard_id"], worker, f"{type(e).__name__}: {e}")
+                metrics.inc("shards_total", status="failed")
+                continue
+            # another worker has the shard since the lease was lost, its result is the one that counts
+            if keeper.lost or not queue.complete(shard["shard_id"], worker, result):
+                logger.warning(f"{worker} finished {shard['shard_id']} without its lease, result dropped")
+                metrics.inc("shards_total", status="lost")
+                continue
+            completed += 1
+            metrics.inc("shards_total", status="done")
+            logger.info(f"{worker} finished {shard['shard_id']}: {result}")
+    finally:
+        data_fetcher.close_conversion_pool()
+        queue.close()
+    return completed
+
+
+def run_workers(processes: int = 1, **kwargs) -> int:
+    """
+    `processes` workers on this machine. The per-host request rate is split between them,
+    workers on other machines have their own budget.
+    """
+    if processes <= 1:
+        return work(**kwargs)
+    kwargs["requests_per_second"] = kwargs.get("requests_per_second", REQUESTS_PER_SECOND_PER_HOST) / processes
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=work, kwargs=kwargs, name=f"shard-worker-{i}") for i in range(processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    failed = [p.name for p in workers if p.exitcode != 0]
+    if failed:
+        logger.error(f"Shard workers {failed} exited with an error")
+    return len(workers) - len(failed)
+
+
+def merge_shards(queue: ShardQueue, root: str = SHARD_DIR, store_dir: str = None, config: dict = None,
+                 embed: bool = True) -> dict:
+    """
+    Merges every done shard into the global utterance store, copies the vectors the shards encoded
+    into the global embedding store, then syncs it and updates the FAISS index, which only encodes
+    utterances of shards that were processed without embedding. Merging is idempotent, a merge that
+    crashes is just run again.
+    """
+    from embedding_store import EMBEDDING_STORE_DIR
+    from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+
+    store_dir = store_dir or UTTERANCE_STORE_DIR
+    shards = queue.with_status(STATUS_DONE)
+    summary = {"shards": len(shards), "protocols": 0, "vectors_imported": 0}
+    if not shards:
+        return summary
+
+    store = UtteranceStore(store_dir)
+    for shard in shards:
+        directory = shard_dir(shard["shard_id"], root)
+        summary["protocols"] += store.merge_from(UtteranceStore(os.path.join(directory, UTTERANCE_STORE_DIR)))
+        vectors_dir = os.path.join(directory, EMBEDDING_STORE_DIR)
+        if os.path.isdir(vectors_dir):
+            summary["vectors_imported"] += _import_vectors(vectors_dir)
+
+    if embed:
+        from embedder import build_faiss_index, embed as embed_utterances
+        embed_utterances(dir=store_dir)
+        build_faiss_index(config=config)
+    for shard in shards:
+        queue.mark_merged(shard["shard_id"])
+    metrics.inc("shards_merged_total", len(shards))
+    logger.info(f"Merged {summary}")
+    return summary
+
+
+def _import_vectors(vectors_dir: str) -> int:
+    from embedder import get_embedding_store
+
+    shard_vectors = get_embedding_store(vectors_dir)
+    vectors = get_embedding_store()
+    try:
+        return vectors.import_vectors(shard_vectors)
+    finally:
+        shard_vectors.close()
+        vectors.close()
@@ -0,0 +1,58 @@
+import io
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+
+@pytest.fixture
+def converter(tmp_path, monkeypatch):
+    # imported after the chdir, so the modules' logs/ is created in tmp_path
+    monkeypatch.chdir(tmp_path)
+    import doc_converter
+    from benchmarks.synthetic_protocols import protocol_docx
+    monkeypatch.setattr(doc_converter, "SCRATCH_ROOT", str(tmp_path))
+    return doc_converter, protocol_docx
+
+
+def test_unreadable_stream_fails_only_its_job(converter):
+    doc_converter, protocol_docx = converter
+    closed = io.BytesIO(protocol_docx("סגור"))
+    closed.close()
+    with doc_converter.ConversionPool(doc_converter.PythonTextBackend, workers=1, batch_wait=0.5) as pool:
+        failed = pool.submit_stream("closed.docx", closed)
+        converted = pool.submit_stream("open.docx", io.BytesIO(protocol_docx("פתוח")))
+        assert converted.result(timeout=10) == "פתוח"
+        with pytest.raises(doc_converter.ConversionError):
+            failed.result(timeout=10)
+        assert pool.stats()["restarts"] == 0
+
+
+def test_timed_out_job_is_dropped_from_the_queue(converter, monkeypatch):
+    doc_converter, protocol_docx = converter
+    release = threading.Event()
+    streams_read = []
+
+    class BlockingBackend(doc_converter.PythonTextBackend):
+        def convert(self, doc_paths, workdir):
+            streams_read.extend(Path(p).name for p in doc_paths)
+            release.wait(10)
+            return super().convert(doc_paths, workdir)
+
+    monkeypatch.setattr(doc_converter, "RESULT_TIMEOUT_SECONDS", 0.2)
+    with doc_converter.ConversionPool(BlockingBackend, workers=1, batch_size=1) as pool:
+        first = pool.submit_stream("first.docx", io.BytesIO(protocol_docx("ראשון")))
+        stream = io.BytesIO(protocol_docx("שני"))
+        with pytest.raises(doc_converter.ConversionError):
+            pool.convert_stream("second.docx", stream)
+        # what process_document does once the conversion gave up
+        stream.close()
+        release.set()
+        assert first.result(timeout=10) == "ראשון"
+    assert streams_read == ["first.docx"]
+    stats = pool.stats()
+    assert (stats["converted"], stats["failed"], stats["restarts"]) == (1, 0, 0)
@@ -0,0 +1,126 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from benchmarks.synthetic_protocols import protocol_docx  # noqa: E402
+
+FAILURES_BEFORE_RECOVERY = 2
+
+
+class FlakyDocuments(BaseHTTPRequestHandler):
+    """503 for the first FAILURES_BEFORE_RECOVERY requests, then the document."""
+    hits = 0
+    body = protocol_docx("שורה ראשונה\nשורה שנייה")
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).hits += 1
+        status, body = (503, b"busy") if self.hits <= FAILURES_BEFORE_RECOVERY else (200, self.body)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class CorruptDocuments(FlakyDocuments):
+    """A document that is no DOCX, the python backend can never convert it."""
+
+    def do_GET(self):
+        type(self).hits += 1
+        body = b"not a docx"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def fetcher(tmp_path, monkeypatch):
+    """data_fetcher working in tmp_path, imported after the chdir so its logs/ is created there."""
+    monkeypatch.chdir(tmp_path)
+    import data_fetcher
+    from doc_converter import ConversionPool, PythonTextBackend
+    monkeypatch.setattr(data_fetcher, "MANIFEST", None)
+    monkeypatch.setattr(data_fetcher, "CONVERSION_POOL",
+                        ConversionPool(backend_factory=PythonTextBackend, workers=1).start())
+    (tmp_path / data_fetcher.OUTPUT_FOLDER).mkdir()
+    yield data_fetcher
+    data_fetcher.close_conversion_pool()
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"127.0.0.1:{server.server_port}"
+
+
+def process(data_fetcher, host, crawler):
+    worker = threading.Thread(target=data_fetcher.process_document, daemon=True, args=(
+        {"FilePath": f"http://{host}/docs/25_ptv_1.docx"}, "ועדת הכספים", "2024-01-01", 25, False, False, crawler))
+    worker.start()
+    worker.join(timeout=10)
+    return worker
+
+
+def test_download_recovers_through_half_open_breaker(fetcher, monkeypatch):
+    import retry_policy
+    from crawl_manifest import STATUS_CONVERTED
+    from odata_crawler import retryable_http_error
+
+    server, host = serve(FlakyDocuments)
+    # opens after the two 503s, the retry after it is the half-open probe
+    breaker = retry_policy.CircuitBreaker(host, window=FAILURES_BEFORE_RECOVERY,
+                                          min_calls=FAILURES_BEFORE_RECOVERY, open_seconds=0.2)
+    monkeypatch.setitem(retry_policy._breakers, host, breaker)
+    monkeypatch.setattr(fetcher, "DOWNLOAD_RETRY",
+                        retry_policy.RetryPolicy("download", 5, retryable=retryable_http_error, base=0.01))
+    crawler = fetcher.build_crawler(f"http://{host}", requests_per_second=0)
+    opened = []
+    record = breaker.record
+
+    def watched_record(success):
+        record(success)
+        opened.append(breaker.state)
+
+    monkeypatch.setattr(breaker, "record", watched_record)
+
+    try:
+        worker = process(fetcher, host, crawler)
+        assert not worker.is_alive(), f"download hung, breaker {breaker.state}, probing={breaker.probing}"
+    finally:
+        server.shutdown()
+
+    # each failed attempt is recorded once: closed after the first, open after the second, closed by the probe
+    assert opened == [retry_policy.CLOSED, retry_policy.OPEN, retry_policy.CLOSED]
+    assert FlakyDocuments.hits == FAILURES_BEFORE_RECOVERY + 1
+    assert fetcher.get_manifest().get("25_ptv_1")["status"] == STATUS_CONVERTED
+
+
+def test_unconvertible_document_is_dead_lettered_on_the_first_try(fetcher, monkeypatch):
+    import retry_policy
+    from crawl_manifest import STATUS_FAILED
+
+    server, host = serve(CorruptDocuments)
+    breaker = retry_policy.CircuitBreaker(fetcher.CONVERTER_ENDPOINT, window=2, min_calls=1)
+    monkeypatch.setitem(retry_policy._breakers, fetcher.CONVERTER_ENDPOINT, breaker)
+    crawler = fetcher.build_crawler(f"http://{host}", requests_per_second=0)
+    try:
+        assert not process(fetcher, host, crawler).is_alive()
+    finally:
+        server.shutdown()
+
+    assert fetcher.CONVERSION_POOL.stats()["failed"] == 1
+    # the document failed, not the converter
+    assert breaker.state == retry_policy.CLOSED
+    entry = fetcher.get_manifest().get("25_ptv_1")
+    assert entry["status"] == STATUS_FAILED
+    assert json.loads(entry["meta"])["stage"] == "conversion"
@@ -0,0 +1,56 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+DIM = 4
+
+
+def encode(texts):
+    return np.array([[len(t), i, 0, 1] for i, t in enumerate(texts)], dtype=np.float32)
+
+
+def open_store(root):
+    # imported after the test's chdir, so the module's logs/ is created in tmp_path
+    from embedding_store import EmbeddingStore
+    return EmbeddingStore("test", DIM, str(root))
+
+
+def test_opening_the_store_keeps_an_append_in_progress(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = open_store(tmp_path / "store")
+    writer.sync(["u0", "u1"], ["a", "bb"], encode)
+    # a writer that wrote its shard bytes and did not commit its rows yet
+    shard_path = writer.shard_path(0)
+    with open(shard_path, "ab") as f:
+        f.write(encode(["ccc", "dddd"]).tobytes())
+    size = Path(shard_path).stat().st_size
+
+    reader = open_store(tmp_path / "store")
+    assert Path(shard_path).stat().st_size == size
+    assert reader.num_rows() == 2
+
+    # the next append is the one that recovers the uncommitted tail, under the write lock
+    reader.close()
+    writer.sync(["u0", "u1", "u2"], ["a", "bb", "eeeee"], encode)
+    assert writer.num_rows() == 3
+    assert Path(shard_path).stat().st_size == 3 * writer.row_bytes
+    np.testing.assert_array_equal(writer.vectors_for(["u2"]), encode(["eeeee"]))
+    writer.close()
+
+
+def test_reader_sees_rows_committed_after_it_opened(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = open_store(tmp_path / "store")
+    writer.sync(["u0"], ["a"], encode)
+    reader = open_store(tmp_path / "store")
+    reader.gather(np.array([0]))
+
+    writer.sync(["u0", "u1", "u2"], ["a", "bb", "ccc"], encode)
+    np.testing.assert_array_equal(reader.vectors_for(["u1", "u2"]), encode(["bb", "ccc"]))
+    assert reader.num_rows() == 3
+    reader.close()
+    writer.close()
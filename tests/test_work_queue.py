@@ -0,0 +1,79 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from work_queue import STATUS_DONE, STATUS_FAILED, STATUS_LEASED, STATUS_PENDING, ShardQueue, shard_id  # noqa: E402
+
+LEASE_SECONDS = 0.2
+
+
+def shard(knesset: int = 25, committee_id: int = 1) -> dict:
+    date_from, date_to = "2024-01-01T00:00:00", "2025-01-01T00:00:00"
+    return {"shard_id": shard_id(knesset, committee_id, date_from, date_to), "knesset": knesset,
+            "committee_id": committee_id, "committee_name": "ועדת הכספים", "date_from": date_from, "date_to": date_to}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = ShardQueue(str(tmp_path / "queue.sqlite"), lease_seconds=LEASE_SECONDS, max_attempts=2)
+    queue.add([shard()])
+    yield queue
+    queue.close()
+
+
+def test_add_keeps_queued_shards(queue):
+    assert queue.add([shard(), shard(committee_id=2)]) == 1
+    assert queue.counts()[STATUS_PENDING] == 2
+
+
+def test_lease_reports_the_new_holder(queue):
+    first = queue.lease("w1")
+    assert (first["worker"], first["status"], first["attempts"]) == ("w1", STATUS_LEASED, 1)
+    assert queue.lease("w2") is None
+
+    time.sleep(LEASE_SECONDS * 1.5)
+    second = queue.lease("w2")
+    assert second["shard_id"] == first["shard_id"]
+    assert (second["worker"], second["status"], second["attempts"]) == ("w2", STATUS_LEASED, 2)
+    assert second["lease_until"] > time.time()
+
+
+def test_complete_after_the_lease_was_lost_does_not_count(queue):
+    first = queue.lease("w1")
+    time.sleep(LEASE_SECONDS * 1.5)
+    queue.lease("w2")
+
+    assert not queue.renew(first["shard_id"], "w1")
+    assert not queue.complete(first["shard_id"], "w1", {"sessions": 1})
+    assert queue.complete(first["shard_id"], "w2", {"sessions": 2})
+    [done] = queue.with_status(STATUS_DONE)
+    assert (done["worker"], done["result"]) == ("w2", '{"sessions": 2}')
+
+
+def test_renewed_lease_is_kept(queue):
+    leased = queue.lease("w1")
+    for _ in range(3):
+        time.sleep(LEASE_SECONDS / 2)
+        assert queue.renew(leased["shard_id"], "w1")
+    assert queue.lease("w2") is None
+
+
+def test_failed_shard_is_retried_until_it_runs_out_of_attempts(queue):
+    leased = queue.lease("w1")
+    assert queue.fail(leased["shard_id"], "w1", "boom")
+    assert queue.counts()[STATUS_PENDING] == 1
+
+    # the second attempt's worker crashes, its expired lease fails the shard for good
+    queue.lease("w2")
+    time.sleep(LEASE_SECONDS * 1.5)
+    assert queue.lease("w3") is None
+    [failed] = queue.with_status(STATUS_FAILED)
+    assert failed["error"] == "boom"
+
+    assert queue.retry_failed() == 1
+    assert queue.lease("w3")["attempts"] == 1
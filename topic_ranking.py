@@ -0,0 +1,155 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from logger_config import get_logger
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+
+# utterances at least this similar to the topic count as being about it
+TOPIC_THRESHOLD = 0.35
+CENTROIDS_FILE = "mk_centroids.npz"
+GROUP_BY = ["speaker_key", "faction"]
+
+logger = get_logger(__name__)
+
+
+class TopicRanker:
+    """
+    Ranks MKs (or factions) by how much they talk about a topic.
+
+    Exact mode scores every utterance embedding against the topic in one streamed pass over the
+    embedding store, and sums the similarity above TOPIC_THRESHOLD per speaker with np.bincount.
+    Centroid mode compares the topic to one precomputed mean embedding per speaker instead,
+    a much cheaper approximation of who is closest to the topic on average.
+    """
+
+    def __init__(self, store, utter_rows: np.ndarray, speaker_codes: np.ndarray, speakers: np.ndarray,
+                 speaker_factions: np.ndarray, centroids_path: str = CENTROIDS_FILE):
+        self.store = store
+        self.utter_rows = utter_rows
+        self.speaker_codes = speaker_codes
+        self.speakers = speakers
+        self.faction_codes, self.factions = pd.factorize(pd.Series(speaker_factions).fillna(""))
+        self.utterance_counts = np.bincount(speaker_codes, minlength=len(speakers))
+        self.centroids_path = centroids_path
+        self._centroids = None
+
+    @classmethod
+    def load(cls, store, store_dir: str = UTTERANCE_STORE_DIR, centroids_path: str = CENTROIDS_FILE):
+        utter_ids, rows = store.utterance_rows()
+        df = UtteranceStore(store_dir).read_pandas(columns=["utter_id", "speaker_key", "faction"])
+        df = pd.DataFrame({"utter_id": utter_ids, "row": rows}).merge(df, on="utter_id", how="inner")
+        codes, speakers = pd.factorize(df["speaker_key"])
+        # an MK's faction is the one they spoke for most recently in the store order
+        speaker_factions = df.groupby(codes)["faction"].last().reindex(range(len(speakers))).to_numpy()
+        return cls(store, df["row"].to_numpy(dtype=np.int64), codes.astype(np.int64),
+                   np.asarray(speakers, dtype=object), speaker_factions, centroids_path)
+
+    def similarities(self, query: np.ndarray) -> np.ndarray:
+        """Similarity of the topic to every utterance, in the order of utter_rows."""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        sims = np.empty(self.store.num_rows(), dtype=np.float32)
+        for start, block in self.store.iter_blocks():
+            np.dot(block, query, out=sims[start:start + len(block)])
+        return sims[self.utter_rows]
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha1(self.store.model_name.encode())
+        digest.update(self.utter_rows.tobytes())
+        digest.update(self.speaker_codes.tobytes())
+        return digest.hexdigest()
+
+    def centroids(self) -> np.ndarray:
+        """Normalized mean embedding per speaker, cached on disk for the current store contents."""
+        if self._centroids is not None:
+            return self._centroids
+        fingerprint = self.fingerprint()
+        if os.path.exists(self.centroids_path):
+            saved = np.load(self.centroids_path, allow_pickle=False)
+            if str(saved["fingerprint"]) == fingerprint:
+                self._centroids = saved["centroids"]
+                return self._centroids
+
+        sums = np.zeros((len(self.speakers), self.store.dim), dtype=np.float64)
+        order = np.argsort(self.utter_rows, kind="stable")
+        sorted_rows = self.utter_rows[order]
+        for start, block in self.store.iter_blocks():
+            lo, hi = np.searchsorted(sorted_rows, [start, start + len(block)])
+            picked = order[lo:hi]
+            if not len(picked):
+                continue
+            # group the block's utterances by speaker and sum each group in one reduceat
+            picked = picked[np.argsort(self.speaker_codes[picked], kind="stable")]
+            codes = self.speaker_codes[picked]
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            sums[codes[starts]] += np.add.reduceat(block[self.utter_rows[picked] - start], starts, axis=0)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        self._centroids = (sums / np.where(norms == 0, 1, norms)).astype(np.float32)
+        np.savez(self.centroids_path, centroids=self._centroids, fingerprint=fingerprint,
+                 speakers=self.speakers.astype(str))
+        logger.info(f"Computed {len(self.speakers)} speaker centroids")
+        return self._centroids
+
+    def rank(self, query: np.ndarray, top: int = 20, by: str = "speaker_key", mode: str = "exact",
+             threshold: float = TOPIC_THRESHOLD) -> pd.DataFrame:
+        if by not in GROUP_BY:
+            raise ValueError(f"Can only rank by one of {GROUP_BY}, not {by}")
+        query = np.asarray(query, dtype=np.float32).ravel()
+
+        if mode == "centroid":
+            speaker_scores = self.centroids() @ query
+            speaker_matches = np.full(len(self.speakers), np.nan)
+            if by == "faction":
+                # a faction's centroid is its MKs' centroids weighted by how much each of them spoke
+                weights = self.utterance_counts[:, None] * self.centroids()
+                faction_sums = np.zeros((len(self.factions), self.store.dim), dtype=np.float64)
+                np.add.at(faction_sums, self.faction_codes, weights)
+                faction_sums /= np.maximum(np.linalg.norm(faction_sums, axis=1, keepdims=True), 1e-12)
+                scores = faction_sums @ query
+                matches = np.full(len(self.factions), np.nan)
+        elif mode == "exact":
+            sims = self.similarities(query)
+            above = sims >= threshold
+            mass = np.where(above, sims - threshold, 0.0)
+            speaker_scores = np.bincount(self.speaker_codes, weights=mass, minlength=len(self.speakers))
+            speaker_matches = np.bincount(self.speaker_codes, weights=above, minlength=len(self.speakers))
+            if by == "faction":
+                scores = np.bincount(self.faction_codes, weights=speaker_scores, minlength=len(self.factions))
+                matches = np.bincount(self.faction_codes, weights=speaker_matches, minlength=len(self.factions))
+        else:
+            raise ValueError(f"Unknown ranking mode {mode}, expected exact or centroid")
+
+        if by == "speaker_key":
+            table = pd.DataFrame({"speaker_key": self.speakers, "faction": self.factions[self.faction_codes],
+                                  "score": speaker_scores, "matches": speaker_matches,
+                                  "utterances": self.utterance_counts})
+        else:
+            table = pd.DataFrame({"faction": self.factions, "score": scores, "matches": matches,
+                                  "utterances": np.bincount(self.faction_codes, weights=self.utterance_counts,
+                                                            minlength=len(self.factions))})
+        table["share"] = table["matches"] / table["utterances"].clip(lower=1)
+        top_rows = np.argsort(-table["score"].to_numpy(), kind="stable")[:top]
+        return table.iloc[top_rows].reset_index(drop=True)
+
+
+def main():
+    from embedder import encode_queries, get_embedding_store
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("topic")
+    parser.add_argument("--by", choices=GROUP_BY, default="speaker_key")
+    parser.add_argument("--mode", choices=["exact", "centroid"], default="exact")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=TOPIC_THRESHOLD)
+    args = parser.parse_args()
+
+    ranker = TopicRanker.load(get_embedding_store())
+    query = encode_queries([args.topic])[0]
+    print(ranker.rank(query, args.top, args.by, args.mode, args.threshold).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger_config import get_logger
+from metrics import metrics
+
+LIBRE_TRANSLATE_URL = os.getenv("LIBRE_TRANSLATE_URL", "http://localhost:5000")
+TRANSLATION_CACHE_FILE = "translation_cache.sqlite"
+BATCH_SIZE = 32
+MAX_CONCURRENT_REQUESTS = 4
+REQUEST_TIMEOUT_SECONDS = 300
+# the latency percentiles cover the last this many requests
+LATENCY_WINDOW = 10_000
+
+logger = get_logger(__name__)
+
+
+def text_key(text: str, source: str, target: str) -> str:
+    return hashlib.sha256(f"{source}\0{target}\0{text}".encode("utf-8")).hexdigest()
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class TranslationCache:
+    """
+    Content addressed store of translations, keyed by the hash of the text and the language pair.
+    """
+
+    def __init__(self, path: str = TRANSLATION_CACHE_FILE):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translated TEXT)")
+
+    def get_many(self, keys: list) -> dict:
+        found = {}
+        with self.lock:
+            # sqlite caps the number of bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, translated FROM translations WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                found.update(rows)
+        return found
+
+    def put_many(self, items: dict):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO translations (key, translated) VALUES (?, ?)", items.items())
+
+    def close(self):
+        self.conn.close()
+
+
+class BatchTranslationClient:
+    """
+    LibreTranslate client that deduplicates the texts it is given, serves repeated ones from the
+    persistent cache and sends the rest as batched requests (`q` as a list) over a pooled session.
+    """
+
+    def __init__(self, base_url: str = LIBRE_TRANSLATE_URL, source: str = "he", target: str = "en",
+                 cache: TranslationCache = None, batch_size: int = BATCH_SIZE,
+                 max_concurrency: int = MAX_CONCURRENT_REQUESTS, timeout: int = REQUEST_TIMEOUT_SECONDS):
+        self.url = base_url.rstrip("/") + "/translate"
+        self.source = source
+        self.target = target
+        # a cache passed in belongs to the caller, close() only closes the one made here
+        self.owns_cache = cache is None
+        self.cache = cache if cache is not None else TranslationCache()
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # one pool per client, so max_concurrency holds however many threads call translate_many
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="translate")
+        self.stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.deduped = 0
+        self.failures = 0
+        self.requests = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def _post_batch(self, texts: list) -> list:
+        started = time.perf_counter()
+        resp = self.session.post(self.url, json={
+            "q": texts,
+            "source": self.source,
+            "target": self.target,
+            "format": "text"
+        }, timeout=self.timeout)
+        resp.raise_for_status()
+        translated = resp.json()["translatedText"]
+        with self.stats_lock:
+            self.requests += 1
+            self.latencies.append(time.perf_counter() - started)
+        metrics.observe("translate_request_seconds", time.perf_counter() - started)
+        if isinstance(translated, str):
+            translated = [translated]
+        if len(translated) != len(texts):
+            raise ValueError(
+                f"Got {len(translated)} translations for a batch of {len(texts)}")
+        return translated
+
+    def _translate_batch(self, texts: list) -> dict:
+        try:
+            return dict(zip(texts, self._post_batch(texts)))
+        except Exception as e:
+            logger.error(
+                f"Error translating a batch of {len(texts)} with Libre Translate: {e}")
+            with self.stats_lock:
+                self.failures += len(texts)
+            metrics.inc("translate_failures_total", len(texts))
+            return {}
+
+    def translate_many(self, texts: list) -> list:
+        """Translations in the order of `texts`; texts that failed to translate are returned as is."""
+        unique = list(dict.fromkeys(texts))
+        keys = {t: text_key(t, self.source, self.target) for t in unique}
+        cached = self.cache.get_many(list(keys.values()))
+        translations = {t: cached[k] for t, k in keys.items() if k in cached}
+        missing = [t for t in unique if t not in translations]
+
+        with self.stats_lock:
+            self.deduped += len(texts) - len(unique)
+            self.hits += len(translations)
+            self.misses += len(missing)
+        metrics.inc("translate_cache_hits_total", len(translations))
+        metrics.inc("translate_cache_misses_total", len(missing))
+        metrics.inc("translate_deduped_total", len(texts) - len(unique))
+
+        if missing:
+            batches = [missing[i:i + self.batch_size]
+                       for i in range(0, len(missing), self.batch_size)]
+            for result in self.executor.map(self._translate_batch, batches):
+                translations.update(result)
+                self.cache.put_many({keys[t]: tr for t, tr in result.items()})
+
+        return [translations.get(t, t) for t in texts]
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+        if self.owns_cache:
+            self.cache.close()
+
+    def translate(self, text: str) -> str:
+        return self.translate_many([text])[0]
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            lookups = self.hits + self.misses
+            latencies = list(self.latencies)
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduped": self.deduped,
+                "failures": self.failures,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "requests": self.requests,
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "latency_p99": percentile(latencies, 99),
+            }
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
+from logger_config import get_logger
+from utterance_store import UTTERANCE_STORE_DIR, UtteranceStore
+
+GRAPH_FILE = "PCA_plotly_SBert.html"
+SAMPLE_SIZE = 2000
+STRATA = ["faction", "committee"]
+NEIGHBOURS = 10
+# queries per FAISS search call, bounds the result arrays to SEARCH_BLOCK x NEIGHBOURS
+SEARCH_BLOCK = 256
+HOVER_TEXT_CHARS = 200
+
+logger = get_logger(__name__)
+
+
+def stratified_sample(store_dir: str = UTTERANCE_STORE_DIR, size: int = SAMPLE_SIZE, strata: list = None,
+                      seed: int = 0) -> pd.DataFrame:
+    """
+    About `size` utterances, split between faction/committee strata in proportion to their sizes,
+    at least one per stratum. Two streamed passes over the store, the first only counts,
+    so memory is the sample plus one record batch.
+    """
+    strata = strata or STRATA
+    store = UtteranceStore(store_dir)
+    counts = {}
+    for batch in store.iter_batches(columns=strata):
+        for key, count in batch.to_pandas().fillna("").value_counts().items():
+            counts[key] = counts.get(key, 0) + count
+    if not counts:
+        return pd.DataFrame(columns=["utter_id", *strata, "text"])
+    counts = pd.Series(counts)
+    counts.index.names = strata
+    quotas = np.minimum(counts, np.maximum(1, np.round(size * counts / counts.sum()))).astype(np.int64)
+    quotas.name = "quota"
+
+    # bottom-k of a random key per stratum is a uniform sample of k from that stratum
+    rng = np.random.default_rng(seed)
+    sample = None
+    for batch in store.iter_batches(columns=["utter_id", *strata, "text"]):
+        df = batch.to_pandas()
+        df[strata] = df[strata].fillna("")
+        df["key"] = rng.random(len(df))
+        sample = df if sample is None else pd.concat([sample, df], ignore_index=True)
+        sample = sample.sort_values("key", kind="stable").join(quotas, on=strata)
+        sample = sample[sample.groupby(strata).cumcount() < sample["quota"]].drop(columns="quota")
+    return sample.drop(columns="key").sort_values("utter_id").reset_index(drop=True)
+
+
+def neighbourhoods(index, vectors: np.ndarray, own_ids: np.ndarray, k: int = NEIGHBOURS,
+                   block: int = SEARCH_BLOCK) -> tuple:
+    """
+    (neighbour ids, similarities) of the k nearest utterances of every vector in the whole index,
+    the utterance itself left out. Searched SEARCH_BLOCK queries at a time.
+    """
+    neighbour_ids = np.full((len(vectors), k), -1, dtype=np.int64)
+    similarities = np.full((len(vectors), k), np.nan, dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        scores, found = index.search(np.ascontiguousarray(vectors[start:start + block]), k + 1)
+        for row, (row_scores, row_found) in enumerate(zip(scores, found)):
+            keep = (row_found >= 0) & (row_found != own_ids[start + row])
+            kept = row_found[keep][:k]
+            neighbour_ids[start + row, :len(kept)] = kept
+            similarities[start + row, :len(kept)] = row_scores[keep][:k]
+    return neighbour_ids, similarities
+
+
+def graph_table(store, index, store_dir: str = UTTERANCE_STORE_DIR, size: int = SAMPLE_SIZE,
+                k: int = NEIGHBOURS, seed: int = 0) -> pd.DataFrame:
+    """
+    A stratified sample projected to 3d by a PCA fitted on the sample alone, with the density of
+    every point's neighbourhood in the full index and how much of it shares its faction and committee.
+    """
+    from sklearn.decomposition import PCA
+
+    sample = stratified_sample(store_dir, size, STRATA, seed)
+    sample = sample[sample["utter_id"].isin(store.embedded(sample["utter_id"].tolist()))].reset_index(drop=True)
+    if len(sample) < 3:
+        raise ValueError(f"Need at least 3 embedded utterances to graph, found {len(sample)}")
+    utter_ids = sample["utter_id"].tolist()
+    vectors = store.vectors_for(utter_ids)
+    coords = PCA(n_components=3, random_state=seed).fit_transform(vectors)
+    sample["x"], sample["y"], sample["z"] = coords[:, 0], coords[:, 1], coords[:, 2]
+
+    neighbour_ids, similarities = neighbourhoods(index, vectors, store.ids_for(utter_ids), k)
+    sample["density"] = np.nanmean(similarities, axis=1)
+
+    # strata of the neighbours, which are mostly outside the sample
+    unique_ids, inverse = np.unique(neighbour_ids, return_inverse=True)
+    unique_utter_ids = store.utter_ids_for(unique_ids)
+    meta = UtteranceStore(store_dir).read_pandas(
+        columns=["utter_id", *STRATA], filter=pc.field("utter_id").isin([u for u in unique_utter_ids if u]))
+    meta = meta.fillna("").set_index("utter_id")
+    valid = neighbour_ids >= 0
+    for column in STRATA:
+        values = meta[column].reindex(unique_utter_ids).to_numpy(dtype=object)[inverse.reshape(neighbour_ids.shape)]
+        same = (values == sample[column].to_numpy(dtype=object)[:, None]) & valid
+        sample[f"same_{column}"] = same.sum(axis=1) / np.maximum(valid.sum(axis=1), 1)
+    return sample
+
+
+def write_graph(table: pd.DataFrame, path: str = GRAPH_FILE):
+    """Static HTML, nothing is opened."""
+    import plotly.express as px  # only the HTML needs plotly
+
+    table = table.assign(text=table["text"].str.slice(0, HOVER_TEXT_CHARS))
+    fig = px.scatter_3d(table, x="x", y="y", z="z", color="faction", hover_name="committee",
+                        hover_data={"text": True, "density": ":.3f", "same_faction": ":.2f",
+                                    "same_committee": ":.2f", "x": False, "y": False, "z": False})
+    fig.update_traces(marker=dict(size=3))
+    fig.write_html(path, auto_open=False)
+
+
+def graph_utterances(store, index, store_dir: str = UTTERANCE_STORE_DIR, path: str = GRAPH_FILE,
+                     size: int = SAMPLE_SIZE, k: int = NEIGHBOURS, seed: int = 0) -> pd.DataFrame:
+    table = graph_table(store, index, store_dir, size, k, seed)
+    write_graph(table, path)
+    logger.info(f"Graphed {len(table)} sampled utterances to {path}, mean same-faction share of "
+                f"{k} nearest neighbours {table['same_faction'].mean():.2f}")
+    return table
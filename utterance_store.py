@@ -0,0 +1,160 @@
+import glob
+import os
+import shutil
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+UTTERANCE_STORE_DIR = "utterance_store"
+
+SCHEMA = pa.schema([
+    ("utter_id", pa.string()),
+    ("knesset", pa.int32()),
+    ("committee", pa.string()),
+    ("date", pa.string()),
+    ("doc_id", pa.string()),
+    ("subject", pa.string()),
+    ("speaker_key", pa.string()),
+    ("mk_id", pa.string()),
+    ("faction", pa.string()),
+    ("text", pa.string()),
+    # filled only when a protocol is scored as it is written, sampled scores are in the sentiment table by utter_id
+    ("polarity", pa.float64()),
+    ("subjectivity", pa.float64()),
+])
+PARTITION_SCHEMA = pa.schema([("knesset", pa.int32()), ("committee", pa.string())])
+FILE_COLUMNS = [f.name for f in SCHEMA if f.name not in PARTITION_SCHEMA.names]
+
+
+def utterance_rows(protocol: dict, utterances: dict, subject: str) -> list:
+    """Flattens the extractor's {speaker_key: {"metadata", "utterances"}} into store rows."""
+    rows = []
+    for speaker_key, values in utterances.items():
+        metadata = values.get("metadata") or {}
+        for i, text in enumerate(values["utterances"]):
+            rows.append({
+                "utter_id": f"{protocol['doc_id']}_{speaker_key}_{i}",
+                "knesset": protocol.get("knesset_num"),
+                "committee": protocol.get("committee"),
+                "date": protocol.get("date"),
+                "doc_id": protocol["doc_id"],
+                "subject": subject,
+                "speaker_key": speaker_key,
+                "mk_id": str(metadata.get("Id")) if metadata.get("Id") is not None else None,
+                "faction": metadata.get("FactionName"),
+                "text": text,
+                "polarity": None,
+                "subjectivity": None,
+            })
+    return rows
+
+
+def build_filter(knesset=None, committee=None, doc_id=None, speaker_key=None, faction=None, date_from=None, date_to=None):
+    """Predicate for UtteranceStore.read, knesset/committee prune whole partitions."""
+    conditions = []
+    if knesset is not None:
+        conditions.append(pc.field("knesset") == knesset)
+    if committee is not None:
+        conditions.append(pc.field("committee") == committee)
+    if doc_id is not None:
+        conditions.append(pc.field("doc_id") == doc_id)
+    if speaker_key is not None:
+        conditions.append(pc.field("speaker_key") == speaker_key)
+    if faction is not None:
+        conditions.append(pc.field("faction") == faction)
+    if date_from is not None:
+        conditions.append(pc.field("date") >= date_from)
+    if date_to is not None:
+        conditions.append(pc.field("date") <= date_to)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+class UtteranceStore:
+    """
+    One Parquet table of all utterances, hive-partitioned by knesset/committee.
+    Every protocol is its own file, so writes only ever add files and re-extracting
+    a protocol replaces just that protocol's file.
+    """
+
+    def __init__(self, root: str = UTTERANCE_STORE_DIR):
+        self.root = root
+
+    def partition_dir(self, knesset, committee) -> str:
+        return os.path.join(self.root, f"knesset={knesset}", f"committee={quote(str(committee), safe='')}")
+
+    def doc_path(self, knesset, committee, doc_id: str) -> str:
+        return os.path.join(self.partition_dir(knesset, committee), f"{doc_id}.parquet")
+
+    def write_protocol(self, knesset, committee, doc_id: str, rows: list) -> str:
+        path = self.doc_path(knesset, committee, doc_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pylist(rows, schema=SCHEMA).select(FILE_COLUMNS)
+        # dot-prefixed files are skipped by dataset discovery, readers never see a half written file
+        tmp_path = os.path.join(os.path.dirname(path), f".{doc_id}.parquet.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        self._remove_other_copies(doc_id, path)
+        return path
+
+    def _remove_other_copies(self, doc_id: str, path: str):
+        # a protocol re-extracted under another knesset/committee would otherwise be read twice;
+        # removed after the replace, so readers always find at least one copy
+        pattern = os.path.join(glob.escape(self.root), "knesset=*", "committee=*", f"{glob.escape(doc_id)}.parquet")
+        for other in glob.glob(pattern):
+            if os.path.normpath(other) != os.path.normpath(path):
+                os.remove(other)
+
+    def doc_paths(self) -> dict:
+        """{doc_id: file path} of every protocol in the store."""
+        paths = {}
+        if not os.path.isdir(self.root):
+            return paths
+        for dirpath, _, files in os.walk(self.root):
+            for file in files:
+                if file.endswith(".parquet"):
+                    paths[file[:-len(".parquet")]] = os.path.join(dirpath, file)
+        return paths
+
+    def merge_from(self, other: "UtteranceStore") -> int:
+        """
+        Copies every protocol file of another store (a shard's) into this one, replacing the
+        protocol's file when it is already here. Merging the same store twice changes nothing.
+        """
+        copied = 0
+        for doc_id, path in other.doc_paths().items():
+            target = os.path.join(self.root, os.path.relpath(path, other.root))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = os.path.join(os.path.dirname(target), f".{doc_id}.parquet.tmp")
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, target)
+            self._remove_other_copies(doc_id, target)
+            copied += 1
+        return copied
+
+    def dataset(self) -> ds.Dataset:
+        return ds.dataset(self.root, format="parquet", schema=SCHEMA,
+                          partitioning=ds.partitioning(PARTITION_SCHEMA, flavor="hive"))
+
+    def read(self, columns: list = None, filter=None) -> pa.Table:
+        """Only the requested columns and the rows matching filter are read from disk."""
+        if not os.path.isdir(self.root):
+            return SCHEMA.empty_table().select(columns or SCHEMA.names)
+        return self.dataset().to_table(columns=columns, filter=filter)
+
+    def iter_batches(self, columns: list = None, filter=None, batch_size: int = 8192):
+        if not os.path.isdir(self.root):
+            return
+        yield from self.dataset().to_batches(columns=columns, filter=filter, batch_size=batch_size)
+
+    def read_pandas(self, columns: list = None, filter=None, sort_by: str = "utter_id"):
+        df = self.read(columns, filter).to_pandas()
+        if sort_by and sort_by in df.columns:
+            # stable row order regardless of file discovery order
+            df = df.sort_values(sort_by, kind="stable").reset_index(drop=True)
+        return df
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from logger_config import get_logger
+
+INDEX_TYPES = ["flat", "ivf_flat", "ivf_pq", "hnsw"]
+DEFAULT_INDEX_CONFIG = {
+    "type": "flat",
+    "nlist": None,  # None -> 4 * sqrt(rows), at most train_size / 39
+    "pq_m": 48,  # sub-quantizers, must divide the dimension
+    "pq_bits": 8,
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "train_size": 100_000,
+}
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 128
+# an IVF index is retrained once it holds this many times the rows its centroids were trained on
+RETRAIN_GROWTH = 4
+
+logger = get_logger(__name__)
+
+
+def index_config(**overrides) -> dict:
+    config = dict(DEFAULT_INDEX_CONFIG)
+    config.update({k: v for k, v in overrides.items() if v is not None})
+    if config["type"] not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {config['type']}, expected one of {INDEX_TYPES}")
+    return config
+
+
+def nlist_for(config: dict, rows: int, train_points: int = None) -> int:
+    """4 * sqrt(rows) of the whole index, capped by the training sample (train_size), which may be smaller."""
+    if config["nlist"]:
+        return config["nlist"]
+    train_points = rows if train_points is None else train_points
+    # faiss wants ~39+ training points per centroid
+    return max(1, min(int(4 * math.sqrt(rows)), train_points // 39))
+
+
+def factory_string(config: dict, dim: int, rows: int, train_points: int = None) -> str:
+    kind = config["type"]
+    if kind == "flat":
+        return "Flat"
+    if kind == "ivf_flat":
+        return f"IVF{nlist_for(config, rows, train_points)},Flat"
+    if kind == "ivf_pq":
+        if dim % config["pq_m"]:
+            raise ValueError(f"pq_m={config['pq_m']} does not divide the dimension {dim}")
+        return f"IVF{nlist_for(config, rows, train_points)},PQ{config['pq_m']}x{config['pq_bits']}"
+    return f"HNSW{config['hnsw_m']},Flat"
+
+
+def structure_fingerprint(model_name: str, dim: int, dtype: str, config: dict) -> str:
+    """What the index was built from apart from its rows, any change means a rebuild."""
+    payload = {"model": model_name, "dim": dim, "dtype": dtype, "config": config}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def index_ids(index) -> np.ndarray:
+    return faiss.vector_to_array(index.id_map).astype(np.int64) if index.ntotal else np.empty(0, np.int64)
+
+
+def supports_remove(index) -> bool:
+    return not isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW)
+
+
+def set_search_params(index, nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
+    inner = faiss.downcast_index(index.index if isinstance(index, faiss.IndexIDMap) else index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = min(nprobe, inner.nlist)
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = ef_search
+
+
+def new_index(config: dict, dim: int, train_vectors: np.ndarray, rows: int = None):
+    """
+    Empty IndexIDMap2 of the configured type, trained on train_vectors when the type needs it.
+    rows is how many vectors the index will hold, when train_vectors is only a sample of them.
+    """
+    description = factory_string(config, dim, len(train_vectors) if rows is None else rows, len(train_vectors))
+    inner = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = config["ef_construction"]
+    if not inner.is_trained:
+        if not len(train_vectors):
+            raise ValueError(f"{description} needs training vectors, the embedding store is empty")
+        started = time.perf_counter()
+        inner.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+        logger.info(f"Trained {description} on {len(train_vectors)} vectors in {time.perf_counter() - started:.1f}s")
+    return faiss.IndexIDMap2(inner)
+
+
+class IndexFile:
+    """
+    A FAISS index on disk next to a JSON sidecar recording what it was built from:
+    the structure fingerprint (model, dimension, storage dtype, index config) and how many rows it was trained on.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta_path = path + ".json"
+
+    def read_meta(self) -> dict:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def load(self, fingerprint: str):
+        """The saved index, or None when it is missing, unreadable or built from something else."""
+        meta = self.read_meta()
+        if meta.get("fingerprint") != fingerprint or not os.path.exists(self.path):
+            if meta:
+                logger.info(f"{self.path} was built with a different configuration, rebuilding")
+            return None, meta
+        try:
+            return faiss.read_index(self.path), meta
+        except Exception as e:
+            logger.error(f"Error loading index: {e}. Building new index...")
+            return None, meta
+
+    def save(self, index, fingerprint: str, config: dict, trained_rows: int):
+        tmp_path = self.path + ".tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self.path)
+        meta = {"fingerprint": fingerprint, "config": config, "trained_rows": trained_rows,
+                "ntotal": index.ntotal, "built_at": time.time()}
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
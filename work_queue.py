@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+QUEUE_FILE = "shard_queue.sqlite"
+LEASE_SECONDS = 900
+MAX_ATTEMPTS = 3
+QUEUE_LOCK_TIMEOUT = 60
+
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_MERGED = "merged"
+STATUSES = (STATUS_PENDING, STATUS_LEASED, STATUS_DONE, STATUS_FAILED, STATUS_MERGED)
+
+SHARD_FIELDS = ("shard_id", "knesset", "committee_id", "committee_name", "date_from", "date_to")
+
+
+def shard_id(knesset: int, committee_id: int, date_from: str, date_to: str) -> str:
+    return f"k{knesset}_c{committee_id}_{date_from[:10]}_{date_to[:10]}"
+
+
+class ShardQueue:
+    """
+    Lease-based queue of shards (knesset x committee x date range) in one SQLite file,
+    shared by worker processes on this machine or on others through a shared filesystem.
+
+    A worker leases a shard for lease_seconds and renews the lease while it works. A worker that
+    crashes stops renewing, its shard is leased again once the lease runs out, up to max_attempts.
+    Completing a shard only counts when the worker still holds the lease.
+    Leases are wall clock times, nodes sharing a queue need synchronized clocks.
+    """
+
+    def __init__(self, path: str = QUEUE_FILE, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # autocommit, transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=QUEUE_LOCK_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # not WAL: its shared memory index does not work over network filesystems
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                shard_id TEXT PRIMARY KEY,
+                knesset INTEGER,
+                committee_id INTEGER,
+                committee_name TEXT,
+                date_from TEXT,
+                date_to TEXT,
+                status TEXT,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                result TEXT,
+                updated_at TEXT
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS shards_status ON shards (status)")
+
+    def _transaction(self, fn):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def add(self, shards: list) -> int:
+        """Queues shards (dicts of SHARD_FIELDS), shards already in the queue keep their state."""
+        def insert():
+            before = self.conn.total_changes
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO shards ({', '.join(SHARD_FIELDS)}, status, updated_at) "
+                f"VALUES ({', '.join('?' * len(SHARD_FIELDS))}, ?, ?)",
+                [tuple(s[f] for f in SHARD_FIELDS) + (STATUS_PENDING, self._now()) for s in shards])
+            return self.conn.total_changes - before
+        return self._transaction(insert)
+
+    def lease(self, worker: str):
+        """The next pending shard, or one whose lease ran out, now leased to worker. None when there is none."""
+        def take():
+            now = time.time()
+            self.conn.execute(
+                "UPDATE shards SET status = ?, worker = NULL, lease_until = NULL, "
+                "error = COALESCE(error, 'lease expired'), updated_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (STATUS_FAILED, self._now(), STATUS_LEASED, now, self.max_attempts))
+            row = self.conn.execute(
+                "SELECT * FROM shards WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY attempts, knesset DESC, shard_id LIMIT 1",
+                (STATUS_PENDING, STATUS_LEASED, now)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE shards SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE shard_id = ?",
+                (STATUS_LEASED, worker, now + self.lease_seconds, self._now(), row["shard_id"]))
+            # read again, the row selected above still has the previous holder's lease
+            return dict(self.conn.execute("SELECT * FROM shards WHERE shard_id = ?", (row["shard_id"],)).fetchone())
+        return self._transaction(take)
+
+    def _update_leased(self, shard_id: str, worker: str, sets: str, values: tuple) -> bool:
+        def update():
+            cursor = self.conn.execute(
+                f"UPDATE shards SET {sets}, updated_at = ? WHERE shard_id = ? AND worker = ? AND status = ?",
+                values + (self._now(), shard_id, worker, STATUS_LEASED))
+            return cursor.rowcount == 1
+        return self._transaction(update)
+
+    def renew(self, shard_id: str, worker: str) -> bool:
+        """False when the lease was lost, another worker may already be on the shard."""
+        return self._update_leased(shard_id, worker, "lease_until = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, shard_id: str, worker: str, result: dict) -> bool:
+        return self._update_leased(shard_id, worker, "status = ?, lease_until = NULL, error = NULL, result = ?",
+                                   (STATUS_DONE, json.dumps(result, ensure_ascii=False)))
+
+    def fail(self, shard_id: str, worker: str, error: str) -> bool:
+        """The shard goes back to pending, or to failed once it used up its attempts."""
+        return self._update_leased(
+            shard_id, worker,
+            "status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, lease_until = NULL, error = ?",
+            (self.max_attempts, STATUS_FAILED, STATUS_PENDING, error))
+
+    def with_status(self, status: str) -> list:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM shards WHERE status = ? ORDER BY knesset, shard_id", (status,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_merged(self, shard_id: str):
+        def update():
+            self.conn.execute("UPDATE shards SET status = ?, updated_at = ? WHERE shard_id = ? AND status = ?",
+                              (STATUS_MERGED, self._now(), shard_id, STATUS_DONE))
+        self._transaction(update)
+
+    def retry_failed(self) -> int:
+        """Failed shards get a fresh set of attempts."""
+        def update():
+            return self.conn.execute(
+                "UPDATE shards SET status = ?, attempts = 0, error = NULL, updated_at = ? WHERE status = ?",
+                (STATUS_PENDING, self._now(), STATUS_FAILED)).rowcount
+        return self._transaction(update)
+
+    def counts(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def close(self):
+        self.conn.close()